@@ -1,9 +1,10 @@
-from flask import Flask, request # type: ignore
+from flask import Flask, Response, request, stream_with_context # type: ignore
 import numpy as np # type: ignore
 # import cv2
 
 import base64
-from PIL import Image
+import binascii
+from PIL import Image, UnidentifiedImageError
 from io import BytesIO
 
 possible_models = [
@@ -11,16 +12,128 @@ possible_models = [
     'random',
     'clip',
     'clip-centroid',
-    'vclip'
+    'vclip',
+    'clip-int8',
+    'vclip-int8'
 ]
 
-from encoders import EncoderBuilder
+from batching import BatchScheduler
+from catalog import VideoCatalog
+from config import get_config
+from cpu_runtime import configure_cpu_runtime
+from registry import get_registry
+from serialization import (EMBEDDING_MIMETYPES, FRAMES_MIMETYPE, JSON_MIMETYPE, NDJSON_MIMETYPE,
+                           binary_frame, ndjson_chunk, ndjson_error, serialize_embeddings)
+from text_cache import TextEmbeddingCache
+from vector_index import IndexRegistry, collection_name
+from video import read_frame, resolve_video
 
 app = Flask(__name__)
+cfg = get_config()
+
+# Thread pools must be sized before any model runs
+configure_cpu_runtime(intra_op_threads=cfg.CPU.INTRA_OP_THREADS,
+                      inter_op_threads=cfg.CPU.INTER_OP_THREADS,
+                      pin_threads=cfg.CPU.PIN_THREADS)
+
+# Resident encoders, shared by every request
+registry = get_registry()
+registry.preload(cfg.REGISTRY.PRELOAD)
+
+# Concurrent requests to the same encoder are encoded together
+scheduler = BatchScheduler(registry,
+                           max_batch_size=cfg.BATCHING.MAX_BATCH_SIZE,
+                           max_wait=cfg.BATCHING.MAX_WAIT_MS / 1000)
+
+# Embeddings of already seen texts
+text_cache = None
+if cfg.TEXT_CACHE.CAPACITY > 0:
+    text_cache = TextEmbeddingCache(capacity=cfg.TEXT_CACHE.CAPACITY,
+                                    directory=cfg.TEXT_CACHE.DIR or None)
+
+# Local indexes of the collections, searched by /search
+indexes = IndexRegistry(cfg.INDEX.DIR, nprobe=cfg.INDEX.NPROBE, rerank=cfg.INDEX.RERANK)
+
+# Frame counts of the videos, to clamp the events of /search
+catalog = VideoCatalog(cfg.VIDEO.CATALOG_DIR) if cfg.VIDEO.CATALOG_DIR else None
 
 def check_request(req):
     return req['encoder'] and req['data']
 
+def embedding_response(emb):
+    """Builds the response in the format requested through the Accept header. JSON by default.
+    """
+    mimetype = request.accept_mimetypes.best_match(EMBEDDING_MIMETYPES) or JSON_MIMETYPE
+    body, headers = serialize_embeddings(emb, mimetype)
+    return body, 200, headers
+
+def encode_texts(encoder_name, texts, encode_fn):
+    """Encodes the texts with encode_fn, skipping the ones found in the text cache.
+    """
+    if text_cache is None:
+        return encode_fn(texts)
+    model_version = registry.get(encoder_name).model_version()
+    return text_cache.encode(encoder_name, model_version, texts, encode_fn)
+
+def decode_image(img_b64):
+    """Opens a b64-encoded image. Only its header is read, its pixels are decoded when used.
+
+    Raises
+    ------
+    ValueError
+        If the data is not a b64-encoded image.
+    """
+    try:
+        image_data = base64.b64decode(img_b64)
+        return Image.open(BytesIO(image_data))
+    except (binascii.Error, UnidentifiedImageError) as e:
+        raise ValueError(f'Invalid image: {e}') from e
+
+def stream_batch(encoder_name, items, modality, prepare=None):
+    """Encodes the items in chunks sized for the encoder's device and streams each chunk
+    as soon as it is encoded, either as newline-delimited JSON (default) or as binary frames
+    if the client accepts 'application/octet-stream'.
+    """
+    device = str(registry.get(encoder_name).device)
+    chunk_size = cfg.BATCH.GPU_CHUNK_SIZE if device.startswith('cuda') else cfg.BATCH.CPU_CHUNK_SIZE
+
+    mimetype = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, FRAMES_MIMETYPE]) or NDJSON_MIMETYPE
+    serialize = binary_frame if mimetype == FRAMES_MIMETYPE else ndjson_chunk
+
+    if prepare is not None:
+        # Before the response starts, so invalid items are rejected with a 400 instead of cutting the stream
+        prepared = []
+        for i, item in enumerate(items):
+            try:
+                prepared.append(prepare(item))
+            except ValueError as e:
+                raise ValueError(f'Item {i}: {e}') from e
+        items = prepared
+
+    def generate():
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            try:
+                # Leased for every chunk, so it can be evicted between the chunks of a long stream
+                with registry.lease(encoder_name) as model:
+                    if modality == 'text':
+                        embs = encode_texts(encoder_name, chunk, model.encode_text)
+                    else:
+                        embs = model.encode_image(chunk)
+            except MemoryError as e:
+                print(f'Batch encoding stopped at item {start}: {e}')
+                if mimetype == NDJSON_MIMETYPE:
+                    yield ndjson_error(start, 'CUDA out of memory')
+                return
+            except (OSError, ValueError) as e:
+                # E.g. truncated images, which only fail when their pixels are decoded
+                print(f'Batch encoding stopped at item {start}: {e}')
+                if mimetype == NDJSON_MIMETYPE:
+                    yield ndjson_error(start, str(e))
+                return
+            yield serialize(start, embs)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 # This route takes a text and responds with the embedding
 @app.route('/text', methods=['POST'])
 def get_text():
@@ -32,20 +145,27 @@ def get_text():
     # Logging info
     print(f'Text encoding with: {request.json["encoder"]}')
 
-    # Take the requested text
+    # Take the requested text (or list of texts)
     text = request.json['data']
+    texts = [text] if isinstance(text, str) else text
 
     try:
-        # Build the selected model
-        model = EncoderBuilder().build(request.json['encoder'])
-        
-        # Encode text
-        emb = model.encode_text(text)
+        # Make sure the selected model is resident
+        registry.get(request.json['encoder'])
+    except TypeError as e:
+        return str(e), 400
+    except MemoryError:
+        return "ERROR: CUDA out of memory", 500
+
+    try:
+        # Encode text, batched with other concurrent requests
+        encoder_name = request.json['encoder']
+        emb = encode_texts(encoder_name, texts, lambda misses: scheduler.encode_text(encoder_name, misses))
     except MemoryError:
         return "ERROR: CUDA out of memory", 500
 
     # Return succesful response
-    return emb.tolist(), 200
+    return embedding_response(emb)
 
 # This route takes a b64-encoded image and responds with the embedding
 @app.route('/image', methods=['POST'])
@@ -68,16 +188,150 @@ def get_image():
     # print(img)
     
     try:
-        # Build the selected model
-        model = EncoderBuilder().build(request.json['encoder'])
-        
-        # Encode image
-        emb = model.encode_image(img)
+        # Make sure the selected model is resident
+        registry.get(request.json['encoder'])
+    except TypeError as e:
+        return str(e), 400
+    except MemoryError:
+        return "CUDA out of memory", 500
+
+    try:
+        # Encode image, batched with other concurrent requests
+        emb = scheduler.encode_image(request.json['encoder'], [img])
     except MemoryError:
         return "CUDA out of memory", 500
 
     # Return succesful response
-    return emb.tolist(), 200
+    return embedding_response(emb)
+
+# This route takes a list of texts and streams their embeddings in chunks
+@app.route('/text/batch', methods=['POST'])
+def get_text_batch():
+
+    if (not check_request(request.json)) or not isinstance(request.json['data'], list):
+        return "Bad request", 400
+
+    # Logging info
+    print(f'Batch text encoding of {len(request.json["data"])} texts with: {request.json["encoder"]}')
+
+    # Checked before streaming, so an invalid item is rejected with a 400 instead of cutting the stream
+    texts = request.json['data']
+    invalid = next((i for i, text in enumerate(texts) if not isinstance(text, str) or not text), None)
+    if invalid is not None:
+        return f'Item {invalid}: Invalid text, expected a non-empty string', 400
+
+    try:
+        return stream_batch(request.json['encoder'], texts, 'text')
+    except TypeError as e:
+        return str(e), 400
+    except MemoryError:
+        return "ERROR: CUDA out of memory", 500
+
+# This route takes a list of b64-encoded images and streams their embeddings in chunks
+@app.route('/image/batch', methods=['POST'])
+def get_image_batch():
+
+    if (not check_request(request.json)) or not isinstance(request.json['data'], list):
+        return "Bad request", 400
+
+    # Logging info
+    print(f'Batch image encoding of {len(request.json["data"])} images with: {request.json["encoder"]}')
+
+    try:
+        # Images are opened before streaming, but their pixels are decoded chunk by chunk, as they are encoded
+        return stream_batch(request.json['encoder'], request.json['data'], 'image', prepare=decode_image)
+    except (TypeError, ValueError) as e:
+        return str(e), 400
+    except MemoryError:
+        return "CUDA out of memory", 500
+
+# This route explains why an image (or a video frame) matches a prompt, with an attention heatmap
+@app.route('/explain', methods=['POST'])
+def get_explanation():
+
+    req = request.json
+    has_image = bool(req.get('data')) or (isinstance(req.get('video'), str) and req['video']
+                                           and isinstance(req.get('frame'), int))
+    if not req.get('encoder') or not isinstance(req.get('prompt'), str) or not has_image:
+        return "Bad request", 400
+
+    # Logging info
+    print(f'Explanation with: {req["encoder"]}')
+
+    try:
+        if req.get('data'):
+            img = np.array(decode_image(req['data']).convert('RGB'))
+        else:
+            # A frame of one of the videos, referenced as in the databases
+            img = read_frame(resolve_video(req['video'], cfg.VIDEO.DIR), req['frame'])
+    except FileNotFoundError as e:
+        return str(e), 404
+    except (OSError, ValueError) as e:
+        # Frames that do not exist or cannot be decoded, and truncated images
+        return str(e), 400
+
+    try:
+        with registry.lease(req['encoder']) as model:
+            explanation = model.explain(img, req['prompt'], layers=req.get('layers'), heads=req.get('heads'))
+    except (TypeError, ValueError, NotImplementedError) as e:
+        return str(e), 400
+    except MemoryError:
+        return "CUDA out of memory", 500
+
+    # The heatmap is a uint8 grid over the image patches, with the most relevant one at 255
+    heatmap = explanation['heatmap']
+    return {**explanation, 'grid_size': heatmap.shape[0], 'heatmap': heatmap.tolist()}, 200
+
+# This route takes a prompt and responds with the most similar events of a collection, searching
+# its local index, so clients get the events in a single request
+@app.route('/search', methods=['POST'])
+def search():
+
+    req = request.json
+    k = req.get('k', 10)
+    if not req.get('encoder') or not isinstance(req.get('prompt'), str) or not req.get('dataset') \
+            or not isinstance(k, int) or not 0 < k <= cfg.INDEX.MAX_K:
+        return "Bad request", 400
+
+    # Logging info
+    encoder_name = req['encoder']
+    collection = collection_name(encoder_name, req['dataset'])
+    print(f'Search in {collection} with: {encoder_name}')
+
+    try:
+        # Fails early, before encoding, if the collection has no index
+        indexes.get(collection)
+        registry.get(encoder_name)
+        emb = encode_texts(encoder_name, [req['prompt']], lambda misses: scheduler.encode_text(encoder_name, misses))
+    except FileNotFoundError as e:
+        return str(e), 404
+    except TypeError as e:
+        return str(e), 400
+    except MemoryError:
+        return "ERROR: CUDA out of memory", 500
+
+    # Frame hits are merged into events, so adjacent frames of an incident make a single clip
+    results = indexes.search_events(collection, emb, k, window=cfg.INDEX.FRAME_WINDOW,
+                                    overfetch=cfg.INDEX.OVERFETCH)[0]
+    if catalog is not None:
+        # Events widened past the end of their video are clamped to its last frame
+        for result in results:
+            if result['video'] in catalog:
+                result['start_frame'], result['end_frame'] = catalog.clamp(result['video'], result['start_frame'],
+                                                                           result['end_frame'])
+    return {'collection': collection, 'results': results}, 200
+
+# This route responds with the resident encoders and the memory they take
+@app.route('/encoders', methods=['GET'])
+def get_encoders():
+    return registry.stats(), 200
+
+# This route responds with the hit and miss counters of the text cache
+@app.route('/cache', methods=['GET'])
+def get_cache():
+    if text_cache is None:
+        return {'enabled': False}, 200
+    return {'enabled': True, **text_cache.stats()}, 200
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+from registry import EncoderRegistry
+
+class MicroBatcher:
+
+    def __init__(self, encode_fn: Callable[[list], np.ndarray], max_batch_size: int = 32, max_wait: float = 0.005, name: str = ''):
+        """Gathers the items submitted by concurrent callers into batches, so they are encoded
+        with a single forward pass. Each caller gets back only its own rows.
+
+        Parameters
+        ----------
+        encode_fn : Callable[[list], np.ndarray]
+            Function that encodes a list of items into a matrix with one row per item.
+        max_batch_size : int, optional
+            Maximum number of items encoded together. By default, 32
+        max_wait : float, optional
+            Maximum time (in seconds) the first item of a batch waits for others to join. By default, 0.005
+        name : str, optional
+            Name given to the worker thread. By default, ''
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=f'batcher-{name}', daemon=True)
+        self._worker.start()
+
+    def submit(self, items: list) -> np.ndarray:
+        """Encodes the items along with the ones submitted by other callers. Blocks until done.
+
+        Parameters
+        ----------
+        items : list
+            The items to encode.
+
+        Returns
+        -------
+        np.ndarray
+            The embeddings, one row per item.
+        """
+        future = Future()
+        self._queue.put((items, future))
+        return future.result()
+
+    def _run(self):
+        pending = None
+        while True:
+            # Wait for the first request of the batch
+            requests = [pending or self._queue.get()]
+            pending = None
+            size = len(requests[0][0])
+
+            # Gather requests until the batch is full or the first one has waited enough
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if size + len(request[0]) > self.max_batch_size:
+                    # Does not fit, it opens the next batch
+                    pending = request
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            self._process(requests)
+
+    def _process(self, requests: list):
+        items = [item for batch, _ in requests for item in batch]
+        try:
+            embs = self.encode_fn(items)
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for batch, future in requests:
+            future.set_result(embs[start:start + len(batch)])
+            start += len(batch)
+
+class BatchScheduler:
+
+    def __init__(self, registry: EncoderRegistry, max_batch_size: int = 32, max_wait: float = 0.005):
+        """Routes encoding requests to one MicroBatcher per encoder and modality.
+
+        Parameters
+        ----------
+        registry : EncoderRegistry
+            The registry holding the resident encoders.
+        max_batch_size : int, optional
+            Maximum number of items encoded together. By default, 32
+        max_wait : float, optional
+            Maximum time (in seconds) a request waits for others to join its batch. By default, 0.005
+        """
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._batchers: dict[tuple, MicroBatcher] = {}
+        self._lock = threading.Lock()
+
+    def encode_text(self, encoder_name: str, texts: list) -> np.ndarray:
+        """Generates the embeddings of a list of texts.
+        """
+        return self._batcher(encoder_name, 'text').submit(texts)
+
+    def encode_image(self, encoder_name: str, images: list) -> np.ndarray:
+        """Generates the embeddings of a list of images.
+        """
+        return self._batcher(encoder_name, 'image').submit(images)
+
+    def _batcher(self, encoder_name: str, modality: str) -> MicroBatcher:
+        key = (encoder_name, modality)
+        with self._lock:
+            if key not in self._batchers:
+                # The encoder is leased for every batch, so it follows the registry's evictions
+                # and is not unloaded during the forward pass
+                def encode_fn(items, encoder_name=encoder_name, modality=modality):
+                    with self.registry.lease(encoder_name) as model:
+                        return getattr(model, f'encode_{modality}')(items)
+
+                self._batchers[key] = MicroBatcher(encode_fn,
+                                                   max_batch_size=self.max_batch_size,
+                                                   max_wait=self.max_wait,
+                                                   name=f'{encoder_name}-{modality}')
+            return self._batchers[key]
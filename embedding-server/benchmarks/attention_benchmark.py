@@ -0,0 +1,82 @@
+"""Latency and memory of VCLIP's fused attention path against the previous ResidualAttentionBlock.
+
+Previously every block ran nn.MultiheadAttention with need_weights=True, materializing the
+per-head attention matrices of every layer, and the Transformer stacked them even though the
+encoders discard them. Now the blocks run the fused scaled_dot_product_attention kernel with the
+same weights, and only compute the attention weights when need_weights=True.
+
+For the image tower (50 tokens) and the text tower (77 tokens) of a ViT-B/32 with random weights
+it reports the difference between both outputs, the latency per batch and the size of the
+attention weights the previous path kept alive (plus the CUDA peak memory when running on GPU).
+
+Usage: python benchmarks/attention_benchmark.py [--batch-sizes 1,8,32] [--device cuda]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from cpu_throughput_benchmark import build_model
+
+def reference_transformer(transformer: torch.nn.Module, x: torch.Tensor) -> tuple:
+    # Transformer.forward as it was: the weights of every head and layer, stacked
+    weights_all_blocks = []
+    for block in transformer.resblocks:
+        block.attn_mask = block.attn_mask.to(dtype=x.dtype, device=x.device) if block.attn_mask is not None else None
+        y = block.ln_1(x)
+        attn_out, weights = block.attn(y, y, y, need_weights=True, attn_mask=block.attn_mask, average_attn_weights=False)
+        x = x + attn_out
+        x = x + block.mlp(block.ln_2(x))
+        weights_all_blocks.append(weights)
+    return x, torch.stack(weights_all_blocks)
+
+def measure(fn, device: torch.device, repeat: int) -> tuple:
+    fn()  # Warm-up
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    peak = torch.cuda.max_memory_allocated() if device.type == 'cuda' else 0
+    return (time.perf_counter() - start) / repeat, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', default='1,8,32')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = build_model('vclip').to(device)
+    towers = {'image': (model.visual.transformer, 50, 768), 'text': (model.transformer, 77, 512)}
+
+    print(f'{"tower":<7}{"batch":>6}{"max abs diff":>14}{"before (ms)":>13}{"after (ms)":>12}{"speedup":>9}'
+          f'{"weights (MB)":>14}' + (f'{"peak before (MB)":>18}{"peak after (MB)":>17}' if device.type == 'cuda' else ''))
+    with torch.no_grad():
+        for tower, (transformer, length, width) in towers.items():
+            for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+                x = torch.randn(length, batch_size, width, device=device)
+
+                before, weights = reference_transformer(transformer, x)
+                after, _ = transformer(x)
+                diff = (before - after).abs().max().item()
+
+                before_s, before_peak = measure(lambda: reference_transformer(transformer, x), device, args.repeat)
+                after_s, after_peak = measure(lambda: transformer(x), device, args.repeat)
+                line = (f'{tower:<7}{batch_size:>6}{diff:>14.2e}{before_s * 1000:>13.1f}{after_s * 1000:>12.1f}'
+                        f'{before_s / after_s:>8.2f}x{weights.numel() * weights.element_size() / 1024 ** 2:>14.1f}')
+                if device.type == 'cuda':
+                    line += f'{before_peak / 1024 ** 2:>18.1f}{after_peak / 1024 ** 2:>17.1f}'
+                print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""CPU throughput benchmark of the CLIP/VCLIP encoders across thread and batch settings.
+
+Runs the text and image towers of a ViT-B/32 CLIP (the architecture shared by the clip and
+vclip encoders) with random weights, since throughput does not depend on the weight values.
+For every number of intra-op threads and batch size it reports items per second, in fp32 and,
+if the CPU supports it natively, with bf16 autocast.
+
+Usage: python benchmarks/cpu_throughput_benchmark.py [--threads 1,2,4] [--batch-sizes 1,8,32] [--model vclip]
+"""
+import argparse
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from cpu_runtime import configure_cpu_runtime, cpu_supports_bf16
+
+def build_model(name: str) -> torch.nn.Module:
+    # ViT-B/32 hyperparameters, as build_model() infers them from the checkpoint
+    args = dict(image_resolution=224, vision_layers=12, vision_width=768, vision_patch_size=32,
+                context_length=77, vocab_size=49408, transformer_width=512, transformer_heads=8, transformer_layers=12)
+    if name == 'vclip':
+        from vclip.model import CLIP
+        return CLIP(output_embed_dim=512, **args).float().eval()
+    from clip.model import CLIP
+    return CLIP(embed_dim=512, **args).float().eval()
+
+def throughput(fn, batch_size: int, min_seconds: float) -> float:
+    fn()  # Warm-up
+    runs, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_seconds or runs < 3:
+        fn()
+        runs += 1
+    return runs * batch_size / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['clip', 'vclip'], default='vclip')
+    parser.add_argument('--threads', default=','.join(str(t) for t in sorted({1, 2, 4, os.cpu_count()}) if t <= os.cpu_count()))
+    parser.add_argument('--batch-sizes', default='1,8,32')
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    parser.add_argument('--pin-threads', action='store_true')
+    parser.add_argument('--min-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    threads = [int(t) for t in args.threads.split(',')]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+
+    # Inter-op threads and pinning can only be set once, before running anything
+    configure_cpu_runtime(intra_op_threads=max(threads), inter_op_threads=args.inter_op_threads, pin_threads=args.pin_threads)
+
+    model = build_model(args.model)
+    precisions = ['fp32'] + (['bf16'] if cpu_supports_bf16() else [])
+
+    print(f'{"tower":<7}{"precision":<11}{"threads":>8}{"batch":>7}{"items/s":>12}')
+    for tower in ['text', 'image']:
+        for precision in precisions:
+            for n_threads in threads:
+                torch.set_num_threads(n_threads)
+                for batch_size in batch_sizes:
+                    if tower == 'text':
+                        inputs = torch.randint(1, 49406, (batch_size, 77))
+                        inputs[:, 12] = 49407  # End of text
+                        forward = model.encode_text
+                    else:
+                        inputs = torch.randn(batch_size, 3, 224, 224)
+                        forward = model.encode_image
+
+                    def run():
+                        autocast = torch.autocast('cpu', dtype=torch.bfloat16) if precision == 'bf16' else nullcontext()
+                        with torch.no_grad(), autocast:
+                            forward(inputs)
+
+                    items = throughput(run, batch_size, args.min_seconds)
+                    print(f'{tower:<7}{precision:<11}{n_threads:>8}{batch_size:>7}{items:>12.1f}')
+
+if __name__ == '__main__':
+    main()
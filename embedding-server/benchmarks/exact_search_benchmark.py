@@ -0,0 +1,104 @@
+"""Latency of the exact in-process search (vector_index.ExactIndex) against the size of the corpus.
+
+For each corpus size it writes an index of random normalized float16 embeddings (in chunks, so
+sizes larger than memory work; 10M x 512 takes 10 GB of disk) and reports the latency of a single
+query and of a batch of queries (median of --repeat runs, after a warm-up run that also reads the
+matrix from disk), the scan rate, and the anonymous memory of the process (its resident memory
+without the pages of the memory-mapped matrix, which the kernel can drop), which does not grow with
+the size of the matrix. By default it runs up to 1M rows; pass --sizes 10000,100000,1000000,10000000
+for 10M rows, which needs 10 GB of free disk.
+
+Usage: python benchmarks/exact_search_benchmark.py [--sizes 10000,100000,1000000] [--dim 512] [--dir /tmp/exact_index]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from vector_index import ExactIndex
+
+def write_synthetic_index(directory: str, count: int, dim: int, chunk: int = 1 << 18, videos: int = 1000,
+                          drift: float = 0.0):
+    # Same layout as vector_index.build_exact_index, for a frames collection. With drift, the frames of each
+    # video are a random walk from a random start, by steps of that size (closer to real frame embeddings
+    # than independent noise); otherwise they are independent
+    os.makedirs(directory, exist_ok=True)
+    embeddings = np.memmap(os.path.join(directory, 'embeddings.f16'), dtype=np.float16, mode='w+', shape=(count, dim))
+    video_id = np.memmap(os.path.join(directory, 'video_id.i32'), dtype=np.int32, mode='w+', shape=(count,))
+    frame_n = np.memmap(os.path.join(directory, 'frame_n.i32'), dtype=np.int32, mode='w+', shape=(count,))
+    rng = np.random.default_rng(0)
+    per_video = -(-count // videos)
+    # Chunks of whole videos
+    chunk = max(1, chunk // per_video) * per_video
+    for start in range(0, count, chunk):
+        n_videos = -(-min(chunk, count - start) // per_video)
+        embs = rng.standard_normal((n_videos, per_video, dim), dtype=np.float32)
+        if drift:
+            embs[:, 1:] *= drift
+            embs = np.cumsum(embs, axis=1)
+        embs = embs.reshape(-1, dim)[:count - start]
+        rows = np.arange(start, start + len(embs))
+        embeddings[start:start + len(embs)] = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+        video_id[start:start + len(embs)] = rows // per_video
+        frame_n[start:start + len(embs)] = rows % per_video
+    for array in [embeddings, video_id, frame_n]:
+        array.flush()
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump({'kind': 'frames', 'count': count, 'dim': dim, 'videos': [f'video{i}' for i in range(videos)]}, f)
+
+def anonymous_memory_mb() -> float:
+    # RssAnon, in kB (Linux only)
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+def latency(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def measure(directory: str, queries: np.ndarray, args) -> tuple:
+    # Latency of a single query and of the batch of queries, and the anonymous memory after the searches
+    index = ExactIndex(directory)
+    search = lambda q: index.search(q, args.k, block_size=args.block_size)
+    search(queries[:1])  # Warm-up
+    single = latency(lambda: search(queries[:1]), args.repeat)
+    batch = latency(lambda: search(queries), args.repeat)
+    return single, batch, anonymous_memory_mb()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Numbers of rows, comma-separated')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=16, help='Queries per batch')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--block-size', type=int, default=32768)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dir', default='/tmp/exact_index_benchmark')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    print(f'{"rows":>10}{"GB":>7}{"1 query (ms)":>14}{f"{args.queries} queries (ms)":>18}{"rows/s":>12}{"anon. memory (MB)":>19}')
+    for size in [int(s) for s in args.sizes.split(',')]:
+        directory = os.path.join(args.dir, str(size))
+        write_synthetic_index(directory, size, args.dim)
+        # The index is closed when measure returns, before its files are deleted
+        single, batch, memory = measure(directory, queries, args)
+        shutil.rmtree(directory)
+        gb = size * args.dim * 2 / 1e9
+        print(f'{size:>10}{gb:>7.2f}{single * 1000:>14.1f}{batch * 1000:>18.1f}{size / single:>12.3g}{memory:>19.0f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Encoder work saved and retrieval impact of static-scene frame skipping.
+
+Decodes and encodes every sampled frame of a video directory once, as ingestion.py does without
+skipping, and replays frame_skipping.StaticFrameSkipper over the same frames for each threshold.
+Skipped frames take the embedding of the last encoded frame, exactly as during ingestion, so no
+frame has to be encoded twice. For each threshold it reports:
+
+- the fraction of frames skipped (the fraction of visual-tower forwards saved),
+- the recall@k of text-to-frame retrieval against no skipping: for each prompt, the fraction of the
+  top-k frames without skipping that are also in the top-k with skipping,
+- with --annotations (UCF-Crime's Temporal_Anomaly_Annotation.txt format: video, class, then up to
+  two start/end frame pairs, -1 if absent), the recall@k on that labeled set: for each anomaly
+  class, the fraction of its annotated events that contain one of the top-k frames retrieved for
+  the prompt "a video of <class>".
+
+Usage: python benchmarks/frame_skipping_benchmark.py VIDEOS_DIR [--encoder vclip] [--stride 5]
+       [--thresholds 0.005,0.01,0.02] [--annotations Temporal_Anomaly_Annotation.txt]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from encoders import EncoderBuilder
+from frame_skipping import StaticFrameSkipper
+from ingestion import list_videos, video_name
+from quantization_parity import PROMPTS, normalize
+from video import iter_frames
+
+def load_annotations(path: str) -> dict:
+    # {class: [(video, start_frame, end_frame)]}, with the videos named as in ingestion.video_name
+    events = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            video, label, spans = fields[0], fields[1], [int(x) for x in fields[2:]]
+            video = video[:-len('.mp4')] if video.endswith('.mp4') else video
+            for start, end in zip(spans[::2], spans[1::2]):
+                if start >= 0 and end >= 0:
+                    events.setdefault(label, []).append((video, start, end))
+    return events
+
+def class_prompt(label: str) -> str:
+    # RoadAccidents => a video of road accidents
+    return 'a video of ' + ' '.join(re.findall('[A-Z][a-z]*|[a-z]+', label)).lower()
+
+def encode_videos(model, paths: list, videos_dir: str, stride: int, batch_size: int, thresholds: list,
+                  max_skipped: int) -> tuple:
+    # Encodes every sampled frame, and selects the frames a skipper of each threshold would encode
+    names, frame_numbers, embeddings = [], [], []
+    masks = {threshold: [] for threshold in thresholds}
+    resolution = model.input_resolution()
+    for path in paths:
+        skippers = {threshold: StaticFrameSkipper(threshold, max_skipped=max_skipped) for threshold in thresholds}
+        frames = iter_frames(path, stride=stride, short_side=resolution, crop=resolution)
+        while batch := list(islice(frames, batch_size)):
+            batch_frames = np.stack([frame for _, frame in batch])
+            for threshold, skipper in skippers.items():
+                masks[threshold].append(skipper.select(batch_frames))
+            embeddings.append(model.encode_frames(batch_frames))
+            frame_numbers += [frame_n for frame_n, _ in batch]
+            names += [video_name(path, videos_dir)] * len(batch)
+    masks = {threshold: np.concatenate(mask) for threshold, mask in masks.items()}
+    return np.array(names), np.array(frame_numbers), normalize(np.concatenate(embeddings)), masks
+
+def fill_skipped(embeddings: np.ndarray, encoded: np.ndarray) -> np.ndarray:
+    # Every frame takes the embedding of the last encoded frame (the first frame of each video is always encoded)
+    return embeddings[np.maximum.accumulate(np.where(encoded, np.arange(len(encoded)), 0))]
+
+def top_k(queries: np.ndarray, embeddings: np.ndarray, k: int) -> np.ndarray:
+    return np.argpartition(-(queries @ embeddings.T), k - 1, axis=1)[:, :k]
+
+def labeled_recall(top: np.ndarray, labels: list, events: dict, names: np.ndarray, frame_numbers: np.ndarray) -> float:
+    # Fraction of the annotated events of each class containing one of its top-k frames, averaged over the classes
+    recalls = []
+    for hits, label in zip(top, labels):
+        found = [any(names[i] == video and start <= frame_numbers[i] <= end for i in hits)
+                 for video, start, end in events[label]]
+        recalls.append(np.mean(found))
+    return float(np.mean(recalls))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('videos_dir')
+    parser.add_argument('--encoder', default='vclip')
+    parser.add_argument('--stride', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--thresholds', default='0.005,0.01,0.02')
+    parser.add_argument('--max-skipped', type=int, default=0)
+    parser.add_argument('--annotations', default='', help='UCF-Crime temporal annotations of the videos')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    model = EncoderBuilder().build(args.encoder, device='cpu')
+    thresholds = [float(t) for t in args.thresholds.split(',')]
+
+    start = time.perf_counter()
+    names, frame_numbers, embeddings, masks = encode_videos(
+        model, list_videos(args.videos_dir), args.videos_dir, args.stride, args.batch_size, thresholds, args.max_skipped)
+    print(f'Encoded {len(embeddings)} frames in {time.perf_counter() - start:.1f} s')
+    k = min(args.k, len(embeddings))
+
+    events = load_annotations(args.annotations) if args.annotations else {}
+    # Only the classes with annotated events in these videos
+    videos = set(names)
+    events = {label: [event for event in spans if event[0] in videos] for label, spans in events.items()}
+    labels = sorted(label for label, spans in events.items() if spans)
+
+    queries = normalize(model.encode_text(PROMPTS))
+    reference = top_k(queries, embeddings, k)
+    if labels:
+        label_queries = normalize(model.encode_text([class_prompt(label) for label in labels]))
+        label_reference = labeled_recall(top_k(label_queries, embeddings, k), labels, events, names, frame_numbers)
+
+    print(f'{"threshold":<11}{"skipped":>9}{f"recall@{k}":>11}' + (f'{"labeled recall@" + str(k):>19}' if labels else ''))
+    print(f'{"none":<11}{0:>9.1%}{1:>11.4f}' + (f'{label_reference:>19.4f}' if labels else ''))
+    for threshold in thresholds:
+        skipped = fill_skipped(embeddings, masks[threshold])
+        top = top_k(queries, skipped, k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(reference, top)])
+        line = f'{threshold:<11}{1 - masks[threshold].mean():>9.1%}{recall:>11.4f}'
+        if labels:
+            line += f'{labeled_recall(top_k(label_queries, skipped, k), labels, events, names, frame_numbers):>19.4f}'
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Import-time benchmark of the CLIP and VCLIP tokenizers.
+
+Each scenario runs in a fresh interpreter, with torch and torchvision already imported so
+only the tokenizer cost is measured. It reports the time and the resident memory added by:
+
+- eager: the previous behaviour, where clip.py and vclip.py each built a tokenizer from the
+  gzipped merges at import time.
+- lazy import: importing clip.clip and vclip.vclip now, without tokenizing anything.
+- first tokenize (cold): the first tokenize() call, building the vocabulary snapshot.
+- first tokenize (warm): the first tokenize() call, loading the existing snapshot.
+
+Usage: python benchmarks/import_benchmark.py [--repeat R]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PRELUDE = '''
+import json, os, sys, time
+sys.path.insert(0, {server_dir!r})
+import torch, torchvision
+
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+rss_start, start = rss(), time.perf_counter()
+'''
+
+_SCENARIOS = {
+    'eager': '''
+from clip import simple_tokenizer
+def build():
+    # Tables the tokenizer used to build at import time, from the gzipped merges
+    import gzip
+    merges = gzip.open(simple_tokenizer.default_bpe()).read().decode("utf-8").split('\\n')
+    merges = [tuple(merge.split()) for merge in merges[1:49152-256-2+1]]
+    vocab = list(simple_tokenizer.bytes_to_unicode().values())
+    vocab = vocab + [v+'</w>' for v in vocab] + [''.join(merge) for merge in merges] + ['<|startoftext|>', '<|endoftext|>']
+    encoder = dict(zip(vocab, range(len(vocab))))
+    return encoder, {v: k for k, v in encoder.items()}, dict(zip(merges, range(len(merges))))
+from clip import clip
+from vclip import vclip
+tables = [build(), build()]  # One tokenizer per module
+''',
+    'lazy import': '''
+from clip import clip
+from vclip import vclip
+''',
+    'first tokenize (cold)': '''
+from clip import clip
+from vclip import vclip
+clip.tokenize('person fighting')
+vclip.tokenize('person fighting')
+''',
+    'first tokenize (warm)': '''
+from clip import clip
+from vclip import vclip
+clip.tokenize('person fighting')
+vclip.tokenize('person fighting')
+''',
+}
+
+_EPILOGUE = '''
+print(json.dumps({'seconds': time.perf_counter() - start, 'rss': rss() - rss_start}))
+'''
+
+def run_scenario(name: str, home: str) -> dict:
+    code = _PRELUDE.format(server_dir=SERVER_DIR) + _SCENARIOS[name] + _EPILOGUE
+    # The snapshot lives in ~/.cache/clip, so HOME decides whether it exists
+    env = dict(os.environ, HOME=home)
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"scenario":<24}{"time (ms)":>12}{"RSS (MB)":>12}')
+    with tempfile.TemporaryDirectory() as warm_home:
+        # Build the snapshot once for the warm scenario
+        run_scenario('first tokenize (cold)', warm_home)
+
+        for name in _SCENARIOS:
+            results = []
+            for _ in range(args.repeat):
+                if name == 'first tokenize (cold)':
+                    with tempfile.TemporaryDirectory() as cold_home:
+                        results.append(run_scenario(name, cold_home))
+                else:
+                    results.append(run_scenario(name, warm_home))
+            seconds = statistics.median(r['seconds'] for r in results)
+            rss = statistics.median(r['rss'] for r in results)
+            print(f'{name:<24}{seconds * 1000:>12.1f}{rss / 1024 ** 2:>12.1f}')
+
+if __name__ == '__main__':
+    main()
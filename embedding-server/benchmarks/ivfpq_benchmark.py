@@ -0,0 +1,76 @@
+"""Recall@k against queries per second of the IVF-PQ index (vector_index.IVFPQIndex), against the
+exact search (vector_index.ExactIndex) on the same embeddings.
+
+By default it indexes synthetic embeddings, each video a random walk (see exact_search_benchmark.py); with --index,
+an index built by vector_index.py from real embeddings (the IVF-PQ part is built if missing). The
+queries are embeddings of the index plus noise, searched one at a time, as the server does. For every
+nprobe and number of re-ranked candidates it reports the recall@k (the fraction of the exact top-k
+found) and the queries per second, and the same for the exact search.
+
+Usage: python benchmarks/ivfpq_benchmark.py [--size 200000] [--dim 512] [--lists 1024] [--nprobe 1,4,16,64]
+       [--rerank 0,100,1000] [--index INDEX_DIR]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from exact_search_benchmark import write_synthetic_index
+from vector_index import ExactIndex, IVFPQIndex, build_ivfpq_index
+
+def queries_per_second(search, queries: np.ndarray) -> tuple:
+    # Searches the queries one at a time, returning the rows found and the throughput
+    start = time.perf_counter()
+    ids = np.concatenate([search(query)[1] for query in queries])
+    return ids, len(queries) / (time.perf_counter() - start)
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=512, help='512 for CLIP, 768 for VCLIP')
+    parser.add_argument('--drift', type=float, default=0.3, help='Step between consecutive synthetic frames')
+    parser.add_argument('--index', default='', help='Index built by vector_index.py. By default, synthetic embeddings')
+    parser.add_argument('--lists', type=int, default=1024)
+    parser.add_argument('--subvectors', type=int, default=0)
+    parser.add_argument('--nprobe', default='1,4,16,64')
+    parser.add_argument('--rerank', default='0,100,1000', help='Candidates re-ranked exactly (0 for the PQ scores only)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=1.0, help='Norm of the noise added to the queries')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dir', default='/tmp/ivfpq_benchmark')
+    args = parser.parse_args()
+
+    directory = args.index
+    if not directory:
+        directory = args.dir
+        write_synthetic_index(directory, args.size, args.dim, drift=args.drift)
+    exact = ExactIndex(directory)
+    if not args.index or not os.path.isfile(os.path.join(directory, 'ivfpq.json')):
+        start = time.perf_counter()
+        build_ivfpq_index(directory, n_lists=args.lists, n_subvectors=args.subvectors)
+        print(f'Built the IVF-PQ index of {len(exact)} embeddings in {time.perf_counter() - start:.1f} s')
+    ivfpq = IVFPQIndex(directory)
+
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(exact), args.queries, replace=False))
+    queries = np.asarray(exact.embeddings[rows], dtype=np.float32)
+    queries += args.noise * rng.standard_normal(queries.shape, dtype=np.float32) / np.sqrt(exact.dim)
+
+    truth, exact_qps = queries_per_second(lambda q: exact.search(q, args.k), queries)
+    print(f'{len(exact)} embeddings, {ivfpq.n_lists} lists, {ivfpq.n_subvectors} subvectors, {args.queries} queries')
+    print(f'{"nprobe":>8}{"rerank":>8}{f"recall@{args.k}":>11}{"QPS":>10}')
+    print(f'{"exact":>16}{1:>11.4f}{exact_qps:>10.1f}')
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        for rerank in [int(r) for r in args.rerank.split(',')]:
+            found, qps = queries_per_second(lambda q: ivfpq.search(q, args.k, nprobe=nprobe, rerank=rerank), queries)
+            print(f'{nprobe:>8}{rerank:>8}{recall(found, truth):>11.4f}{qps:>10.1f}')
+
+if __name__ == '__main__':
+    main()
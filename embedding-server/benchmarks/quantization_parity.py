@@ -0,0 +1,146 @@
+"""Parity and latency report of the int8 (dynamically quantized) encoders against fp32.
+
+Encodes a fixed set of surveillance prompts and a set of images with the fp32 encoder and
+its int8 counterpart (clip-int8 or vclip-int8), both on CPU, and reports:
+
+- the cosine similarity between the fp32 and int8 embeddings of each text and image (mean, min),
+- the recall@10 of text-to-image retrieval: for each prompt, the fraction of the fp32 top-10
+  images that the int8 encoder also ranks in its top-10,
+- the latency per batch and the speedup of int8 over fp32.
+
+By default the encoders load their checkpoints, as the server does. Without checkpoints,
+--random-weights builds a ViT-B/32 with random weights: latencies are still meaningful, but
+retrieval on random weights only reflects how much quantization perturbs the rankings.
+
+Usage: python benchmarks/quantization_parity.py [--model vclip] [--images DIR] [--random-weights]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from quantization import quantize_dynamic_int8
+
+PROMPTS = [
+    'a person walking down the street',
+    'two people fighting',
+    'a man breaking into a car',
+    'a car crash at an intersection',
+    'a person running away',
+    'a fire in a building',
+    'an explosion',
+    'a person stealing from a shop',
+    'people shooting guns',
+    'a man falling on the ground',
+    'a crowd of people',
+    'an empty parking lot at night',
+    'a person riding a bicycle',
+    'police officers arresting someone',
+    'a person carrying a bag',
+    'smoke coming out of a window',
+]
+
+class RandomWeightsEncoder:
+
+    def __init__(self, name: str, model: torch.nn.Module):
+        # Mirrors encoders.CLIP/VCLIP on a model built without a checkpoint
+        if name == 'vclip':
+            from vclip import vclip as module
+        else:
+            from clip import clip as module
+        self.model = model
+        self.tokenize = module.tokenize
+        self.preprocess = module._transform(224)
+
+    @torch.no_grad()
+    def encode_text(self, texts):
+        features = self.model.encode_text(self.tokenize(texts))
+        # VCLIP also returns the attention weights
+        return (features[0] if isinstance(features, tuple) else features).float().numpy()
+
+    @torch.no_grad()
+    def encode_image(self, images):
+        features = self.model.encode_image(torch.stack([self.preprocess(image) for image in images]))
+        return (features[0] if isinstance(features, tuple) else features).float().numpy()
+
+def build_encoders(name: str, random_weights: bool) -> tuple:
+    if random_weights:
+        from cpu_throughput_benchmark import build_model
+        torch.manual_seed(0)
+        model = build_model(name)
+        return RandomWeightsEncoder(name, model), RandomWeightsEncoder(name, quantize_dynamic_int8(model))
+
+    from encoders import CLIP, VCLIP
+    encoder_class = VCLIP if name == 'vclip' else CLIP
+    return encoder_class(device='cpu'), encoder_class(quantize=True)
+
+def load_images(directory: str, n_images: int) -> list:
+    if directory:
+        paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                       if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        return [Image.open(path).convert('RGB') for path in paths[:n_images]]
+
+    # Deterministic synthetic images: smooth colour gradients plus noise
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:224, 0:224] / 224
+    images = []
+    for _ in range(n_images):
+        a, b, c = rng.uniform(-1, 1, (3, 3, 1, 1))
+        base = 0.5 + 0.5 * np.sin(np.pi * (a * x + b * y + c))
+        pixels = np.clip(base.transpose(1, 2, 0) + rng.normal(0, 0.1, (224, 224, 3)), 0, 1)
+        images.append(Image.fromarray((pixels * 255).astype(np.uint8)))
+    return images
+
+def normalize(embs: np.ndarray) -> np.ndarray:
+    return embs / np.linalg.norm(embs, axis=-1, keepdims=True)
+
+def latency(fn, inputs: list, repeat: int) -> float:
+    fn(inputs)  # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(inputs)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['clip', 'vclip'], default='vclip')
+    parser.add_argument('--images', default='', help='Directory of images. By default, synthetic images')
+    parser.add_argument('--n-images', type=int, default=64)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--random-weights', action='store_true')
+    args = parser.parse_args()
+
+    fp32, int8 = build_encoders(args.model, args.random_weights)
+    images = load_images(args.images, args.n_images)
+    k = min(args.k, len(images))
+
+    text_fp32, text_int8 = normalize(fp32.encode_text(PROMPTS)), normalize(int8.encode_text(PROMPTS))
+    image_fp32, image_int8 = normalize(fp32.encode_image(images)), normalize(int8.encode_image(images))
+
+    print(f'{args.model} fp32 vs int8, {len(PROMPTS)} prompts, {len(images)} images')
+    print(f'{"cosine":<8}{"mean":>10}{"min":>10}')
+    for modality, a, b in [('text', text_fp32, text_int8), ('image', image_fp32, image_int8)]:
+        cosine = (a * b).sum(axis=-1)
+        print(f'{modality:<8}{cosine.mean():>10.4f}{cosine.min():>10.4f}')
+
+    # Text-to-image retrieval: overlap between the fp32 and int8 top-k images of each prompt
+    top_fp32 = np.argsort(-text_fp32 @ image_fp32.T, axis=-1)[:, :k]
+    top_int8 = np.argsort(-text_int8 @ image_int8.T, axis=-1)[:, :k]
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(top_fp32, top_int8)])
+    print(f'recall@{k}: {recall:.4f}')
+
+    print(f'{"latency (ms)":<14}{"batch":>7}{"fp32":>10}{"int8":>10}{"speedup":>9}')
+    for modality, inputs in [('text', PROMPTS), ('image', images[:len(PROMPTS)])]:
+        fp32_s = latency(getattr(fp32, f'encode_{modality}'), inputs, args.repeat)
+        int8_s = latency(getattr(int8, f'encode_{modality}'), inputs, args.repeat)
+        print(f'{modality:<14}{len(inputs):>7}{fp32_s * 1000:>10.1f}{int8_s * 1000:>10.1f}{fp32_s / int8_s:>8.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Parity and speed of the trimmed text transformer against the full 77-token context.
+
+encode_text now cuts each batch right after its furthest end-of-text token (the mask is causal,
+so the padding after it does not change the embeddings), and encoders.encode_tokens sorts large
+batches by length and encodes them in buckets, each trimmed to its own longest text.
+
+For a set of generated surveillance prompts it reports:
+
+- the maximum absolute difference and minimum cosine similarity between the trimmed and the
+  full-context embeddings, with and without bucketing,
+- texts per second with the full context, trimmed, and trimmed with bucketing.
+
+Runs a ViT-B/32 CLIP with random weights, since parity and throughput do not depend on the
+weight values.
+
+Usage: python benchmarks/text_trimming_benchmark.py [--model vclip] [--batch-sizes 1,8,32,256] [--bucket-size 64]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+
+from cpu_throughput_benchmark import build_model, throughput
+from encoders import encode_tokens
+
+WORDS = ['person', 'man', 'woman', 'car', 'street', 'fighting', 'running', 'walking', 'stealing', 'shop',
+         'night', 'crowd', 'police', 'fire', 'explosion', 'bag', 'bicycle', 'parking', 'lot', 'window']
+
+def generate_prompts(n: int, seed: int = 0) -> list:
+    # Mostly short prompts (3-12 words) with a few long descriptions (up to 40 words)
+    rng = np.random.default_rng(seed)
+    lengths = np.where(rng.random(n) < 0.9, rng.integers(3, 13, n), rng.integers(13, 41, n))
+    return [' '.join(rng.choice(WORDS, length)) for length in lengths]
+
+def full_context_encode_text(model: torch.nn.Module, text: torch.Tensor) -> torch.Tensor:
+    # encode_text as it was before trimming: the transformer always runs over the whole context
+    x = model.token_embedding(text).type(model.dtype)
+    x = x + model.positional_embedding.type(model.dtype)
+    x = model.transformer(x.permute(1, 0, 2))
+    x = x[0] if isinstance(x, tuple) else x  # VCLIP also returns the attention weights
+    x = model.ln_final(x.permute(1, 0, 2)).type(model.dtype)
+    return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ model.text_projection
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['clip', 'vclip'], default='vclip')
+    parser.add_argument('--batch-sizes', default='1,8,32,256')
+    parser.add_argument('--bucket-size', type=int, default=64)
+    parser.add_argument('--min-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.model == 'vclip':
+        from vclip.vclip import tokenize
+    else:
+        from clip.clip import tokenize
+
+    torch.manual_seed(0)
+    model = build_model(args.model)
+
+    def trimmed(tokens):
+        features = model.encode_text(tokens)
+        return features[0] if isinstance(features, tuple) else features
+
+    def bucketed(tokens):
+        return encode_tokens(tokens, trimmed, args.bucket_size)
+
+    methods = {
+        'full': lambda tokens: full_context_encode_text(model, tokens),
+        'trimmed': trimmed,
+        'bucketed': bucketed,
+    }
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    tokens = tokenize(generate_prompts(max(batch_sizes)))
+    lengths = tokens.argmax(dim=-1) + 1
+    print(f'{args.model}, prompts of {int(lengths.min())}-{int(lengths.max())} tokens (median {int(lengths.median())})')
+
+    with torch.no_grad():
+        reference = methods['full'](tokens)
+        print(f'{"parity":<10}{"max abs diff":>14}{"min cosine":>12}')
+        for name in ['trimmed', 'bucketed']:
+            embs = methods[name](tokens)
+            cosine = torch.nn.functional.cosine_similarity(embs, reference, dim=-1)
+            print(f'{name:<10}{(embs - reference).abs().max().item():>14.2e}{cosine.min().item():>12.6f}')
+
+        print(f'{"batch":>5}' + ''.join(f'{name + " (texts/s)":>20}' for name in methods) + f'{"speedup":>10}')
+        for batch_size in batch_sizes:
+            batch = tokens[:batch_size]
+            rates = [throughput(lambda: fn(batch), batch_size, args.min_seconds) for fn in methods.values()]
+            print(f'{batch_size:>5}' + ''.join(f'{rate:>20.1f}' for rate in rates) + f'{max(rates[1:]) / rates[0]:>9.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Micro-benchmark of the BPE tokenizer against the reference (original CLIP) implementation.
+
+Checks that both produce identical ids and reports tokens per second, with cold caches
+(every word goes through BPE) and warm caches (words repeated, as in a long-lived server).
+
+Usage: python benchmarks/tokenizer_benchmark.py [--texts N] [--repeat R]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clip.simple_tokenizer import SimpleTokenizer, basic_clean, get_pairs, whitespace_clean
+import regex as re
+
+class ReferenceTokenizer(SimpleTokenizer):
+    """The original implementation: unbounded cache, min() over a lambda on every merge."""
+
+    def __init__(self):
+        super().__init__()
+        # Drop the bounded cache wrapper, so the bpe() below is used
+        del self.bpe
+        self.cache = {'<|startoftext|>': '<|startoftext|>', '<|endoftext|>': '<|endoftext|>'}
+
+    def bpe(self, token):
+        if token in self.cache:
+            return self.cache[token]
+        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
+        pairs = get_pairs(word)
+
+        if not pairs:
+            return token+'</w>'
+
+        while True:
+            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
+            if bigram not in self.bpe_ranks:
+                break
+            first, second = bigram
+            new_word = []
+            i = 0
+            while i < len(word):
+                try:
+                    j = word.index(first, i)
+                    new_word.extend(word[i:j])
+                    i = j
+                except:
+                    new_word.extend(word[i:])
+                    break
+
+                if word[i] == first and i < len(word)-1 and word[i+1] == second:
+                    new_word.append(first+second)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            new_word = tuple(new_word)
+            word = new_word
+            if len(word) == 1:
+                break
+            else:
+                pairs = get_pairs(word)
+        word = ' '.join(word)
+        self.cache[token] = word
+        return word
+
+    def encode(self, text):
+        bpe_tokens = []
+        text = whitespace_clean(basic_clean(text)).lower()
+        for token in re.findall(self.pat, text):
+            token = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
+            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
+        return bpe_tokens
+
+def make_texts(tokenizer, n, seed=0):
+    # Random "sentences" of vocabulary words, plus some surveillance-like prompts and non-ascii text
+    rng = random.Random(seed)
+    words = [w[:-4] for w in tokenizer.encoder if w.endswith('</w>') and w[:-4].isalpha() and len(w) > 6]
+    prompts = ['person fighting', 'car accident at night', 'man stealing a bike', 'explosion near a building',
+               'people running in the street', 'Robbery in a shop, café at 3am!']
+    texts = []
+    for _ in range(n):
+        if rng.random() < 0.3:
+            texts.append(rng.choice(prompts))
+        else:
+            texts.append(' '.join(rng.choice(words) for _ in range(rng.randint(3, 15))))
+    return texts
+
+def run(tokenizer, texts):
+    start = time.perf_counter()
+    n_tokens = sum(len(tokenizer.encode(text)) for text in texts)
+    return n_tokens, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    reference, fast = ReferenceTokenizer(), SimpleTokenizer()
+    texts = make_texts(fast, args.texts)
+
+    mismatches = [text for text in texts if reference.encode(text) != fast.encode(text)]
+    print(f'Parity: {len(texts) - len(mismatches)}/{len(texts)} texts with identical ids')
+    if mismatches:
+        print(f'First mismatch: {mismatches[0]!r}')
+
+    print(f'{"tokenizer":<12}{"caches":<8}{"tokens/s":>14}')
+    for name, factory in [('reference', ReferenceTokenizer), ('fast', SimpleTokenizer)]:
+        # Cold: a new tokenizer, so every word goes through BPE
+        n_tokens, elapsed = run(factory(), texts)
+        print(f'{name:<12}{"cold":<8}{n_tokens / elapsed:>14,.0f}')
+
+        # Warm: the same texts again
+        tokenizer = factory()
+        run(tokenizer, texts)
+        best = min(run(tokenizer, texts)[1] for _ in range(args.repeat))
+        print(f'{name:<12}{"warm":<8}{n_tokens / best:>14,.0f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Catalog of a video directory: the facts about each video that streaming and ingestion need, probed
+once, so no request has to run ffprobe on the video again.
+
+A catalog is a directory with one row per video, as memory-mapped arrays: its frame rate (fps.f64),
+number of frames (frames.i64), duration in seconds (duration.f64) and codec (codec_id.i32, an index
+of the codecs in catalog.json), and the frame numbers and byte offsets of the keyframes of all the
+videos (keyframe_frame.i64 and keyframe_pos.i64), those of row i being keyframe_start.i64[i] to
+keyframe_start.i64[i + 1]. catalog.json also has the names of the videos, as stored in the databases
+(their paths in the directory, without .mp4).
+
+Usage: python catalog.py VIDEOS_DIR CATALOG_DIR [--workers 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from video import list_videos, probe_packets, probe_video, video_name
+
+# Arrays with a row per video, and their types
+COLUMNS = {'fps': np.float64, 'frames': np.int64, 'duration': np.float64, 'codec_id': np.int32}
+EXTENSIONS = {np.float64: 'f64', np.int64: 'i64', np.int32: 'i32'}
+
+def probe(path: str) -> dict:
+    """Reads the frame rate, number of frames, duration, codec and keyframes of a video (see
+    video.probe_video and video.probe_packets).
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+
+    Returns
+    -------
+    dict
+        The properties of the video.
+    """
+    info = probe_video(path)
+    return {**info, **probe_packets(path, info['fps'])}
+
+def build_catalog(videos_dir: str, catalog_dir: str, workers: int = 4) -> 'VideoCatalog':
+    """Probes every video in a directory and writes its catalog. Videos that cannot be probed are left out.
+
+    Parameters
+    ----------
+    videos_dir : str
+        The videos directory.
+    catalog_dir : str
+        The directory of the catalog.
+    workers : int, optional
+        Number of videos probed at once (by ffprobe processes). By default, 4
+
+    Returns
+    -------
+    VideoCatalog
+        The catalog.
+    """
+    paths = list_videos(videos_dir)
+    names, rows, codecs = [], [], []
+
+    def run(path):
+        try:
+            return probe(path)
+        except (subprocess.CalledProcessError, KeyError, IndexError, ValueError) as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path, info in zip(paths, executor.map(run, paths)):
+            name = video_name(path, videos_dir)
+            if isinstance(info, Exception):
+                print(f'{name}: skipped, {type(info).__name__}: {info}')
+                continue
+            if info['codec'] not in codecs:
+                codecs.append(info['codec'])
+            names.append(name)
+            rows.append(info)
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    columns = {'fps': [row['fps'] for row in rows], 'frames': [row['frames'] for row in rows],
+               'duration': [row['duration'] for row in rows], 'codec_id': [codecs.index(row['codec']) for row in rows]}
+    for name, dtype in COLUMNS.items():
+        np.array(columns[name], dtype=dtype).tofile(os.path.join(catalog_dir, f'{name}.{EXTENSIONS[dtype]}'))
+    counts = [len(row['keyframe_frame']) for row in rows]
+    np.concatenate(([0], np.cumsum(counts))).astype(np.int64).tofile(os.path.join(catalog_dir, 'keyframe_start.i64'))
+    for name in ['keyframe_frame', 'keyframe_pos']:
+        values = np.concatenate([row[name] for row in rows]) if rows else np.empty(0)
+        values.astype(np.int64).tofile(os.path.join(catalog_dir, f'{name}.i64'))
+
+    # Written last, so an interrupted build leaves no catalog.json
+    catalog_path = os.path.join(catalog_dir, 'catalog.json')
+    with open(catalog_path + '.tmp', 'w') as f:
+        json.dump({'count': len(names), 'videos': names, 'codecs': codecs}, f)
+    os.replace(catalog_path + '.tmp', catalog_path)
+    return VideoCatalog(catalog_dir)
+
+class VideoCatalog:
+
+    def __init__(self, directory: str):
+        """A catalog written by build_catalog, memory-mapped read-only. Videos are looked up by name
+        in constant time, with or without the .mp4 extension, as in the node server.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the catalog.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'catalog.json')) as f:
+            meta = json.load(f)
+        self.videos = meta['videos']
+        self.codecs = meta['codecs']
+        self._rows = {name: row for row, name in enumerate(self.videos)}
+
+        def load(name, dtype):
+            path = os.path.join(directory, f'{name}.{EXTENSIONS[dtype]}')
+            # Empty files cannot be memory-mapped
+            return np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) else np.empty(0, dtype=dtype)
+
+        self.columns = {name: load(name, dtype) for name, dtype in COLUMNS.items()}
+        self.keyframe_start = load('keyframe_start', np.int64)
+        self.keyframe_frame = load('keyframe_frame', np.int64)
+        self.keyframe_pos = load('keyframe_pos', np.int64)
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def __contains__(self, name: str) -> bool:
+        return self._key(name) in self._rows
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return name[:-len('.mp4')] if name.endswith('.mp4') else name
+
+    def row(self, name: str) -> int:
+        """Returns the row of a video.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        return self._rows[self._key(name)]
+
+    def info(self, name: str) -> dict:
+        """Returns the frame rate (fps), number of frames (frames), duration (in seconds) and codec of a video.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        row = self.row(name)
+        return {'fps': float(self.columns['fps'][row]), 'frames': int(self.columns['frames'][row]),
+                'duration': float(self.columns['duration'][row]),
+                'codec': self.codecs[self.columns['codec_id'][row]]}
+
+    def keyframes(self, name: str) -> tuple:
+        """Returns the frame numbers and byte offsets of the keyframes of a video, as views of the catalog.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        row = self.row(name)
+        start, end = self.keyframe_start[row], self.keyframe_start[row + 1]
+        return self.keyframe_frame[start:end], self.keyframe_pos[start:end]
+
+    def keyframe_before(self, name: str, frame_n: int) -> tuple:
+        """Returns the frame number and byte offset of the last keyframe at or before a frame of a
+        video (its first keyframe if there is none), or (0, 0) if the video has no keyframe listed.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        frames, positions = self.keyframes(name)
+        if not len(frames):
+            return 0, 0
+        i = max(int(np.searchsorted(frames, frame_n, side='right')) - 1, 0)
+        return int(frames[i]), int(positions[i])
+
+    def clamp(self, name: str, start_frame: int, end_frame: int) -> tuple:
+        """Clamps a span of frames (both included) to the frames of a video.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        last = max(int(self.columns['frames'][self.row(name)]) - 1, 0)
+        return min(max(start_frame, 0), last), min(max(end_frame, 0), last)
+
+    def frame_to_time(self, name: str, frame_n):
+        """Returns the time (in seconds) of frames of a video.
+
+        Parameters
+        ----------
+        name : str
+            The name of the video.
+        frame_n : int or np.ndarray
+            The frame numbers.
+
+        Returns
+        -------
+        float or np.ndarray
+            Their times.
+
+        Raises
+        ------
+        KeyError
+            If the video is not in the catalog.
+        """
+        return frame_n / self.columns['fps'][self.row(name)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the catalog of a video directory.')
+    parser.add_argument('videos_dir')
+    parser.add_argument('catalog_dir')
+    parser.add_argument('--workers', type=int, default=4, help='Number of videos probed at once')
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.videos_dir, args.catalog_dir, args.workers)
+    print(f'Cataloged {len(catalog)} videos in {args.catalog_dir}')
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import gzip
 import html
 import os
+import pickle
+import threading
+import warnings
 from functools import lru_cache
 
 import ftfy
@@ -59,74 +62,121 @@ def whitespace_clean(text):
     return text
 
 
+def _snapshot_path(bpe_path: str, cache_dir: str) -> str:
+    # The snapshot is tied to the vocabulary file it was built from
+    stat = os.stat(bpe_path)
+    return os.path.join(cache_dir, f"{os.path.basename(bpe_path)}.{stat.st_size}.{int(stat.st_mtime)}.pkl")
+
+
+def load_vocabulary(bpe_path: str = default_bpe(), cache_dir: str = os.path.expanduser("~/.cache/clip")):
+    """
+    Returns the token encoder and the BPE merge ranks of a vocabulary.
+    The first time, they are built from the gzipped merges file and saved as a pickled snapshot in cache_dir,
+    which later loads skip the decompression, splitting and dict building.
+    """
+    snapshot_path = _snapshot_path(bpe_path, cache_dir)
+    if os.path.isfile(snapshot_path):
+        try:
+            with open(snapshot_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            warnings.warn(f"Vocabulary snapshot {snapshot_path} could not be loaded ({e}); rebuilding it")
+
+    merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
+    merges = merges[1:49152-256-2+1]
+    merges = [tuple(merge.split()) for merge in merges]
+    vocab = list(bytes_to_unicode().values())
+    vocab = vocab + [v+'</w>' for v in vocab]
+    for merge in merges:
+        vocab.append(''.join(merge))
+    vocab.extend(['<|startoftext|>', '<|endoftext|>'])
+    encoder = dict(zip(vocab, range(len(vocab))))
+    bpe_ranks = dict(zip(merges, range(len(merges))))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(snapshot_path + ".tmp", "wb") as f:
+            pickle.dump((encoder, bpe_ranks), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+    except OSError as e:
+        warnings.warn(f"Vocabulary snapshot could not be saved in {cache_dir}: {e}")
+
+    return encoder, bpe_ranks
+
+
 class SimpleTokenizer(object):
-    def __init__(self, bpe_path: str = default_bpe()):
+    def __init__(self, bpe_path: str = default_bpe(), cache_size: int = 65536):
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
-        merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
-        merges = merges[1:49152-256-2+1]
-        merges = [tuple(merge.split()) for merge in merges]
-        vocab = list(bytes_to_unicode().values())
-        vocab = vocab + [v+'</w>' for v in vocab]
-        for merge in merges:
-            vocab.append(''.join(merge))
-        vocab.extend(['<|startoftext|>', '<|endoftext|>'])
-        self.encoder = dict(zip(vocab, range(len(vocab))))
+        self.encoder, self.bpe_ranks = load_vocabulary(bpe_path)
         self.decoder = {v: k for k, v in self.encoder.items()}
-        self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {'<|startoftext|>': '<|startoftext|>', '<|endoftext|>': '<|endoftext|>'}
+        self.special_tokens = {'<|startoftext|>': '<|startoftext|>', '<|endoftext|>': '<|endoftext|>'}
         self.pat = re.compile(r"""<\|startoftext\|>|<\|endoftext\|>|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", re.IGNORECASE)
 
-    def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
-        pairs = get_pairs(word)
+        # Bounded caches, so a long-lived server does not grow them forever
+        self.bpe = lru_cache(maxsize=cache_size)(self._bpe)
+        self._token_ids = lru_cache(maxsize=cache_size)(self._token_ids)
 
-        if not pairs:
+    def _bpe(self, token):
+        if token in self.special_tokens:
+            return self.special_tokens[token]
+        word = list(token[:-1]) + [token[-1] + '</w>']
+        if len(word) == 1:
             return token+'</w>'
 
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
+        bpe_ranks = self.bpe_ranks
+        inf = float('inf')
+        while len(word) > 1:
+            # Lowest-ranked pair, the same min() over the pairs the reference implementation does
+            ranks = [bpe_ranks.get(pair, inf) for pair in zip(word, word[1:])]
+            best = min(ranks)
+            if best == inf:
                 break
-            first, second = bigram
-            new_word = []
-            i = 0
+            i = ranks.index(best)
+            first, second = word[i], word[i+1]
+
+            # Merge every non-overlapping occurrence of the pair, from left to right
+            new_word = word[:i]
             while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
+                if i < len(word)-1 and word[i] == first and word[i+1] == second:
                     new_word.append(first+second)
                     i += 2
                 else:
                     new_word.append(word[i])
                     i += 1
-            new_word = tuple(new_word)
             word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
-        self.cache[token] = word
-        return word
+        return ' '.join(word)
+
+    def _token_ids(self, token):
+        # Decoding as latin-1 gives one character per utf-8 byte, so translate() maps each byte through byte_encoder
+        token = token.encode('utf-8').decode('latin-1').translate(self.byte_encoder)
+        return tuple(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
 
     def encode(self, text):
         bpe_tokens = []
         text = whitespace_clean(basic_clean(text)).lower()
         for token in re.findall(self.pat, text):
-            token = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
-            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
+            bpe_tokens.extend(self._token_ids(token))
         return bpe_tokens
 
     def decode(self, tokens):
         text = ''.join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode('utf-8', errors="replace").replace('</w>', ' ')
         return text
+
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> SimpleTokenizer:
+    """
+    Returns the tokenizer shared by the whole process (CLIP and VCLIP use the same vocabulary).
+    It is built on first use, so importing the models does not pay for loading the vocabulary.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = SimpleTokenizer()
+    return _tokenizer
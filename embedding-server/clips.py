@@ -0,0 +1,148 @@
+"""Clips and thumbnails written at ingestion, so search results can be streamed without transcoding.
+
+The clips of the events (or windows) of a video are cut once, each as a standalone fragmented MP4
+(the same output as the node server's streaming route), and concatenated into a single file,
+<output>/<video>.<kind>.mp4. The byte range of each clip is saved with the events, so a clip is
+served by reading its range of the file.
+"""
+import os
+import subprocess
+
+import numpy as np
+from PIL import Image
+
+def cut_clip(path: str, start_frame: int, end_frame: int, fps: float) -> bytes:
+    """Cuts the frames of a video between two frames (both included) as a fragmented MP4, with
+    ffmpeg. The clip is re-encoded, so it starts with a keyframe at exactly start_frame.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+    start_frame : int
+        The first frame of the clip.
+    end_frame : int
+        The last frame of the clip.
+    fps : float
+        The frame rate of the video.
+
+    Returns
+    -------
+    bytes
+        The clip.
+
+    Raises
+    ------
+    RuntimeError
+        If ffmpeg fails to cut the clip.
+    """
+    command = ['ffmpeg', '-v', 'error', '-ss', f'{start_frame / fps:.6f}', '-i', path,
+               '-t', f'{(end_frame + 1 - start_frame) / fps:.6f}',
+               '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4', 'pipe:1']
+    process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0 or not process.stdout:
+        raise RuntimeError(f'ffmpeg failed to cut frames {start_frame}-{end_frame} of {os.path.basename(path)}: '
+                           f'{process.stderr.decode().strip()}')
+    return process.stdout
+
+def write_clips(path: str, spans: list, fps: float, output_path: str) -> tuple:
+    """Cuts a clip per span of a video (see cut_clip) and concatenates them into a file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+    spans : list
+        The (start_frame, end_frame) of each clip.
+    fps : float
+        The frame rate of the video.
+    output_path : str
+        The path to the file of the clips.
+
+    Returns
+    -------
+    tuple
+        The byte offset and size of each clip in the file, each of shape = [clips], int64.
+    """
+    offsets, sizes = np.zeros(len(spans), dtype=np.int64), np.zeros(len(spans), dtype=np.int64)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # Written under a temporary name, so an interrupted run never leaves a truncated file
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for i, (start_frame, end_frame) in enumerate(spans):
+            clip = cut_clip(path, start_frame, end_frame, fps)
+            offsets[i], sizes[i] = f.tell(), len(clip)
+            f.write(clip)
+    os.replace(tmp_path, output_path)
+    return offsets, sizes
+
+class ThumbnailStrip:
+
+    def __init__(self, total_frames: int, count: int = 16, size: int = 64):
+        """A strip of thumbnails of a video, side by side, evenly spaced over the video. It is built
+        from the frames decoded for the encoder as they come, so the video is not decoded again.
+
+        Parameters
+        ----------
+        total_frames : int
+            Number of frames of the video (an estimate is enough).
+        count : int, optional
+            Number of thumbnails. By default, 16
+        size : int, optional
+            Height of the thumbnails (their width keeps the aspect ratio of the frames). By default, 64
+        """
+        self.size = size
+        self.frame_n = []
+        # Frames of the thumbnails: the first frame decoded at or after each of these
+        self._targets = np.linspace(0, max(total_frames - 1, 0), count).round().astype(np.int64) if count else np.empty(0)
+        self._tiles = []
+        self._last = None  # Last frame pushed, for a last target past the end of a shorter video
+
+    def push(self, frame_n: np.ndarray, frames: np.ndarray):
+        """Adds the next decoded frames of the video.
+
+        Parameters
+        ----------
+        frame_n : np.ndarray
+            The frame numbers, in increasing order, shape = [frames].
+        frames : np.ndarray
+            The frames, shape = [frames, height, width, 3], dtype uint8.
+        """
+        if not len(frame_n):
+            return
+        while len(self._tiles) < len(self._targets):
+            i = np.searchsorted(frame_n, self._targets[len(self._tiles)])
+            if i == len(frame_n):
+                break
+            self._add(int(frame_n[i]), frames[i])
+        self._last = (int(frame_n[-1]), frames[-1].copy())
+
+    def _add(self, frame_n: int, frame: np.ndarray):
+        image = Image.fromarray(frame)
+        width = max(1, round(image.width * self.size / image.height))
+        self._tiles.append(np.asarray(image.resize((width, self.size), Image.BILINEAR)))
+        self.frame_n.append(frame_n)
+
+    def save(self, path: str) -> str:
+        """Saves the strip as a JPEG image.
+
+        Parameters
+        ----------
+        path : str
+            The path to the image.
+
+        Returns
+        -------
+        str
+            The path to the image, or None if no frame was pushed.
+        """
+        if len(self._tiles) < len(self._targets) and self._last is not None \
+                and (not self.frame_n or self._last[0] > self.frame_n[-1]):
+            self._add(*self._last)
+        if not self._tiles:
+            return None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        Image.fromarray(np.concatenate(self._tiles, axis=1)).save(tmp_path, format='JPEG', quality=80)
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,127 @@
+import os
+
+# For configuration parameters
+from yacs.config import CfgNode as CN
+
+# Default configuration of the embedding server
+_C = CN()
+
+# Encoder registry
+_C.REGISTRY = CN()
+# Encoders built when the server starts. The rest are built on their first request
+_C.REGISTRY.PRELOAD = []
+# Maximum memory (in MB) taken by the resident encoders. 0 means no limit
+_C.REGISTRY.MEMORY_BUDGET_MB = 0
+
+# Encoders
+_C.ENCODER = CN()
+# Device where the encoders run ('cuda' or 'cpu'). Empty uses cuda if available
+_C.ENCODER.DEVICE = ''
+# Whether to run inference with bf16 autocast on CPU (only if the CPU supports it natively)
+_C.ENCODER.BF16 = False
+# Texts are sorted by length and encoded in buckets of up to this size, each trimmed to its longest text. 0 disables bucketing
+_C.ENCODER.TEXT_BUCKET_SIZE = 64
+
+# CPU thread pools
+_C.CPU = CN()
+# Threads used inside each operator. 0 keeps torch's default (one per core)
+_C.CPU.INTRA_OP_THREADS = 0
+# Threads used to run independent operators in parallel. 0 keeps torch's default
+_C.CPU.INTER_OP_THREADS = 0
+# Whether to pin the threads to cores
+_C.CPU.PIN_THREADS = False
+
+# Dynamic micro-batching of concurrent requests
+_C.BATCHING = CN()
+# Maximum number of texts or images encoded in a single forward pass. 1 disables batching
+_C.BATCHING.MAX_BATCH_SIZE = 32
+# Maximum time (in ms) a request waits for others to join its batch
+_C.BATCHING.MAX_WAIT_MS = 5.0
+
+# Chunking of the /text/batch and /image/batch routes
+_C.BATCH = CN()
+# Number of items encoded per chunk when the encoder runs on GPU
+_C.BATCH.GPU_CHUNK_SIZE = 256
+# Number of items encoded per chunk when the encoder runs on CPU
+_C.BATCH.CPU_CHUNK_SIZE = 32
+
+# Cache of text embeddings
+_C.TEXT_CACHE = CN()
+# Maximum number of embeddings kept per encoder. 0 disables the cache
+_C.TEXT_CACHE.CAPACITY = 10000
+# Directory where the cache is persisted. Empty keeps it only in memory
+_C.TEXT_CACHE.DIR = ''
+
+# Videos, to read frames referenced by their video and frame number
+_C.VIDEO = CN()
+# Directory with the videos (the same the node server streams from)
+_C.VIDEO.DIR = '/videos'
+# Catalog of the videos (see catalog.py), to clamp the events returned to the frames of their videos. Empty disables it
+_C.VIDEO.CATALOG_DIR = ''
+
+# Local vector indexes (see vector_index.py), searched by the /search route
+_C.INDEX = CN()
+# Directory with one index per collection, named as in the databases (e.g. ucfvclipframes). Empty disables /search
+_C.INDEX.DIR = ''
+# Lists scanned per query by the IVF-PQ indexes
+_C.INDEX.NPROBE = 16
+# Candidates re-ranked with their exact embeddings by the IVF-PQ indexes
+_C.INDEX.RERANK = 100
+# Maximum number of results of a search
+_C.INDEX.MAX_K = 100
+# Frames before and after the best frame hit of an event (as the node routes do), less for worse hits
+_C.INDEX.FRAME_WINDOW = 75
+# Frame hits fetched per result, merged into events
+_C.INDEX.OVERFETCH = 10
+
+# Environment variables that override the default configuration
+def _to_bool(value: str) -> bool:
+    return value.lower() in ('1', 'true', 'yes')
+
+_ENV_OVERRIDES = {
+    'EMB_PRELOAD': ('REGISTRY', 'PRELOAD', lambda v: [name.strip() for name in v.split(',') if name.strip()]),
+    'EMB_MEMORY_BUDGET_MB': ('REGISTRY', 'MEMORY_BUDGET_MB', int),
+    'EMB_DEVICE': ('ENCODER', 'DEVICE', str),
+    'EMB_BF16': ('ENCODER', 'BF16', _to_bool),
+    'EMB_TEXT_BUCKET_SIZE': ('ENCODER', 'TEXT_BUCKET_SIZE', int),
+    'EMB_INTRA_OP_THREADS': ('CPU', 'INTRA_OP_THREADS', int),
+    'EMB_INTER_OP_THREADS': ('CPU', 'INTER_OP_THREADS', int),
+    'EMB_PIN_THREADS': ('CPU', 'PIN_THREADS', _to_bool),
+    'EMB_MAX_BATCH_SIZE': ('BATCHING', 'MAX_BATCH_SIZE', int),
+    'EMB_MAX_WAIT_MS': ('BATCHING', 'MAX_WAIT_MS', float),
+    'EMB_GPU_CHUNK_SIZE': ('BATCH', 'GPU_CHUNK_SIZE', int),
+    'EMB_CPU_CHUNK_SIZE': ('BATCH', 'CPU_CHUNK_SIZE', int),
+    'EMB_TEXT_CACHE_SIZE': ('TEXT_CACHE', 'CAPACITY', int),
+    'EMB_TEXT_CACHE_DIR': ('TEXT_CACHE', 'DIR', str),
+    'EMB_VIDEOS_DIR': ('VIDEO', 'DIR', str),
+    'EMB_VIDEO_CATALOG_DIR': ('VIDEO', 'CATALOG_DIR', str),
+    'EMB_INDEX_DIR': ('INDEX', 'DIR', str),
+    'EMB_INDEX_NPROBE': ('INDEX', 'NPROBE', int),
+    'EMB_INDEX_RERANK': ('INDEX', 'RERANK', int),
+    'EMB_INDEX_OVERFETCH': ('INDEX', 'OVERFETCH', int),
+}
+
+def get_config() -> CN:
+    """Returns the configuration of the embedding server, with the values set through
+    environment variables applied over the defaults.
+
+    Returns
+    -------
+    CN
+        The configuration node.
+
+    Raises
+    ------
+    ValueError
+        If a value is out of range.
+    """
+    cfg = _C.clone()
+    cfg.defrost()
+    for env_var, (section, key, cast) in _ENV_OVERRIDES.items():
+        value = os.environ.get(env_var)
+        if value:
+            cfg[section][key] = cast(value)
+    if cfg.INDEX.NPROBE < 1:
+        raise ValueError(f'EMB_INDEX_NPROBE must be at least 1, got {cfg.INDEX.NPROBE}')
+    cfg.freeze()
+    return cfg
@@ -0,0 +1,51 @@
+import os
+from functools import lru_cache
+
+import torch
+
+@lru_cache()
+def cpu_supports_bf16() -> bool:
+    """Checks whether the CPU has native bfloat16 instructions (AVX512-BF16 or AMX-BF16).
+    Without them, bf16 autocast is emulated and slower than fp32.
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def configure_cpu_runtime(intra_op_threads: int = 0, inter_op_threads: int = 0, pin_threads: bool = False):
+    """Configures the CPU thread pools used by torch. It must be called before any model runs,
+    as the inter-op pool cannot be resized once it has been used.
+
+    Parameters
+    ----------
+    intra_op_threads : int, optional
+        Threads used inside each operator (matmuls, convolutions...). By default, 0 (torch's default, one per core)
+    inter_op_threads : int, optional
+        Threads used to run independent operators in parallel. By default, 0 (torch's default)
+    pin_threads : bool, optional
+        Whether to pin the process to the first intra_op_threads cores it may run on, and bind the
+        OpenMP threads to them, so they are not migrated between cores. By default, False
+    """
+    if pin_threads and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        if intra_op_threads:
+            cores = cores[:intra_op_threads]
+        os.sched_setaffinity(0, cores)
+        # Only honoured if OpenMP has not started yet
+        os.environ.setdefault('OMP_PROC_BIND', 'close')
+        os.environ.setdefault('OMP_PLACES', 'cores')
+        print(f'CPU threads pinned to cores: {cores}')
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            print(f'Inter-op threads could not be set: {e}')
+
+    print(f'CPU runtime: {torch.get_num_threads()} intra-op threads, {torch.get_num_interop_threads()} inter-op threads')
@@ -1,5 +1,10 @@
+import threading
+from contextlib import nullcontext
+from itertools import islice
 from os.path import join as join_path
+import numpy as np
 import torch
+from PIL import Image
 
 # For configuration parameters
 from yacs.config import CfgNode as CN
@@ -12,14 +17,113 @@ from clip import clip
 # Modified CLIP
 from vclip import vclip
 
+from cpu_runtime import cpu_supports_bf16
+from explanations import attention_rollout, to_uint8_grid
+from quantization import quantize_dynamic_int8
+from video import iter_frames
+
 possible_models = [
     'default',
     'random',
     'clip',
     'clip-centroid',
-    'vclip'
+    'vclip',
+    'clip-int8',
+    'vclip-int8'
 ]
 
+def preprocess_images(images, preprocess, device) -> torch.Tensor:
+    """Preprocesses one image or a list of images into a single batch.
+
+    Parameters
+    ----------
+    images : Union[np.ndarray, Image.Image, list]
+        The image or list of images, either as PIL images or as numpy arrays.
+    preprocess : Callable[[PIL.Image], torch.Tensor]
+        The model's transform.
+    device : Union[str, torch.device]
+        The device where the batch is sent.
+
+    Returns
+    -------
+    torch.Tensor
+        The batch of images, shape = [number of images, 3, resolution, resolution].
+    """
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    images = [Image.fromarray(img) if isinstance(img, np.ndarray) else img for img in images]
+    return torch.stack([preprocess(img) for img in images]).to(device)
+
+# Normalization of the CLIP models' preprocessing (clip._transform)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+def default_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+def use_bf16(bf16: bool, device: str) -> bool:
+    # bf16 autocast is only worth it on CPUs with native bf16 instructions
+    if bf16 and str(device) == 'cpu' and not cpu_supports_bf16():
+        print('bf16 autocast disabled: the CPU has no native bf16 support')
+        return False
+    return bf16
+
+def encode_tokens(tokens: torch.Tensor, encode_fn, bucket_size: int = 0) -> torch.Tensor:
+    """Encodes a batch of tokenized texts in buckets of similar length. The text transformer only
+    runs up to the longest text of each forward pass, so grouping texts by length avoids running
+    short texts over the padding of long ones.
+
+    Parameters
+    ----------
+    tokens : torch.Tensor
+        The tokenized texts, shape = [number of texts, context length].
+    encode_fn : Callable[[torch.Tensor], torch.Tensor]
+        Encodes a batch of tokenized texts.
+    bucket_size : int, optional
+        Maximum number of texts per forward pass. By default, 0 (the whole batch at once)
+
+    Returns
+    -------
+    torch.Tensor
+        The embeddings, in the same order as the texts.
+    """
+    if bucket_size <= 0 or len(tokens) <= bucket_size:
+        return encode_fn(tokens)
+
+    # The eot token is the highest number in each sequence, so its position is the text's length
+    order = tokens.argmax(dim=-1).argsort()
+    embeddings = torch.cat([encode_fn(tokens[bucket]) for bucket in order.split(bucket_size)])
+    return embeddings[order.argsort()]
+
+def check_indices(indices: list, length: int, name: str) -> list:
+    # Validates layer or head indices (negative ones count from the end). None or empty selects all of them
+    if not indices:
+        return list(range(length))
+    for index in indices:
+        if isinstance(index, bool) or not isinstance(index, int) or not -length <= index < length:
+            raise ValueError(f'Invalid {name}: {index}. There are {length} {name}s')
+    return [index % length for index in indices]
+
+def load_checkpoint(path: str) -> dict:
+    """Loads a checkpoint memory-mapped, so its tensors are paged in from disk while they are
+    copied into the model instead of being read into memory first. Checkpoints in the legacy
+    (non-zip) format cannot be memory-mapped and are read as usual.
+
+    Parameters
+    ----------
+    path : str
+        The path to the checkpoint.
+
+    Returns
+    -------
+    dict
+        The checkpoint.
+    """
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+    except RuntimeError:
+        return torch.load(path, map_location='cpu', weights_only=False)
+
 class EmbeddingModel:
     def __init__(self):
         raise NotImplementedError
@@ -34,6 +138,35 @@ class EmbeddingModel:
         """
         raise NotImplementedError
 
+    def autocast(self):
+        """Returns the context in which inference runs: bf16 autocast when enabled and the
+        model runs on CPU, no autocast otherwise.
+        """
+        if getattr(self, 'bf16', False) and str(self.device) == 'cpu':
+            return torch.autocast('cpu', dtype=torch.bfloat16)
+        return nullcontext()
+
+    def is_loaded(self) -> bool:
+        """Checks whether the model is currently loaded.
+        """
+        return getattr(self, 'model', None) is not None
+
+    def memory_footprint(self) -> int:
+        """Returns the memory taken by the model's parameters and buffers.
+
+        Returns
+        -------
+        int
+            The size of the model in bytes. 0 if the model is not loaded.
+        """
+        if not self.is_loaded():
+            return 0
+        # The state dict also covers quantized layers, whose packed (weight, bias) are not parameters
+        tensors = []
+        for value in self.model.state_dict().values():
+            tensors.extend(value if isinstance(value, tuple) else [value])
+        return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
     def encode_image(self):
         """Generates the embedding of an image.
         """
@@ -44,11 +177,82 @@ class EmbeddingModel:
         """
         return NotImplementedError
 
-    def encode_video(self):
-        """Generates the embedding of a video.
+    def encode_preprocessed(self, images: torch.Tensor) -> np.ndarray:
+        """Generates the embeddings of a batch of already preprocessed images.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            The normalized images, shape = [number of images, 3, resolution, resolution].
+
+        Returns
+        -------
+        np.ndarray
+            The embeddings.
+        """
+        raise NotImplementedError
+
+    @torch.no_grad()
+    def encode_frames(self, frames: np.ndarray) -> np.ndarray:
+        """Generates the embeddings of a batch of frames already resized and cropped to the
+        model's input resolution (e.g. by the decoder), which only have to be normalized.
+
+        Parameters
+        ----------
+        frames : np.ndarray
+            The RGB frames, shape = [number of frames, resolution, resolution, 3], dtype uint8.
+
+        Returns
+        -------
+        np.ndarray
+            The embeddings.
         """
-        return NotImplementedError
-    
+        pixels = torch.from_numpy(frames).to(self.device).permute(0, 3, 1, 2).float().div_(255)
+        mean = torch.tensor(CLIP_MEAN, device=pixels.device).view(1, 3, 1, 1)
+        std = torch.tensor(CLIP_STD, device=pixels.device).view(1, 3, 1, 1)
+        return self.encode_preprocessed((pixels - mean) / std)
+
+    def input_resolution(self) -> int:
+        """Returns the resolution of the images the model takes.
+        """
+        return self.model.visual.input_resolution
+
+    def encode_video(self, path: str, stride: int = 1, batch_size: int = 32):
+        """Generates the embeddings of the frames of a video, one every stride frames. The video
+        is stream-decoded straight to the model's input resolution, and its frames are encoded in
+        batches as they are decoded.
+
+        Parameters
+        ----------
+        path : str
+            The path to the video.
+        stride : int, optional
+            Only one every stride frames is encoded. By default, 1 (every frame)
+        batch_size : int, optional
+            Number of frames encoded at once. By default, 32
+
+        Yields
+        ------
+        tuple
+            The frame numbers and the embeddings of each batch, shape = [batch, embedding size].
+        """
+        resolution = self.input_resolution()
+        frames = iter_frames(path, stride=stride, short_side=resolution, crop=resolution)
+        while batch := list(islice(frames, batch_size)):
+            frame_numbers, images = zip(*batch)
+            yield np.array(frame_numbers, dtype=np.int64), self.encode_frames(np.stack(images))
+
+    def explain(self, img, text: str, layers: list = None, heads: list = None) -> dict:
+        """Explains the match between an image and a text with an attention heatmap over the image's patches.
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support explanations')
+
+    def model_version(self) -> str:
+        """Returns an identifier of the model's weights, so embeddings computed with
+        different weights are never mixed (e.g. in caches).
+        """
+        raise NotImplementedError
+
     def get_params(self) -> dict:
         """Returns the params related with the encoder, to properly configure a database's
         collection.
@@ -88,6 +292,10 @@ class EncoderBuilder:
                     return CLIP(*args, **kwargs)
                 case 'vclip':
                     return VCLIP(*args, **kwargs)
+                case 'clip-int8':
+                    return CLIP(*args, quantize=True, **kwargs)
+                case 'vclip-int8':
+                    return VCLIP(*args, quantize=True, **kwargs)
                 case _:
                     raise TypeError(f'TypeError: Encoder {encoder_name} not found among implemented. Please, use one of the following: {possible_models}.')
         except torch.OutOfMemoryError:
@@ -95,42 +303,77 @@ class EncoderBuilder:
 
 class CLIP(EmbeddingModel):
 
-    def __init__(self, model_name:str='openai/clip-vit-base-patch32'):
+    def __init__(self, model_name:str='openai/clip-vit-base-patch32', device:str=None, bf16:bool=False, quantize:bool=False,
+                 text_bucket_size:int=64):
         """Uses HuggingFace's CLIP model to obtain the embeddings of the clips.
 
         Parameters
         ----------
         model_name : str, optional
             The specific CLIP model from the HuggingFace repository. By default, openai/clip-vit-large-patch14
+        device : str, optional
+            The device where the model runs ('cuda' or 'cpu'). By default, cuda if available
+        bf16 : bool, optional
+            Whether to run inference with bf16 autocast when running on CPU. By default, False
+        quantize : bool, optional
+            Whether to quantize the transformer blocks to int8 (dynamic quantization). Quantized models
+            only run on CPU, so the device is ignored. By default, False
+        text_bucket_size : int, optional
+            Maximum number of texts encoded per forward pass, grouped by length. By default, 64
         """
         self.model_name = model_name
+        self.quantize = quantize
+        self.text_bucket_size = text_bucket_size
+        self.device = torch.device('cpu' if quantize else device or default_device())
+        self.bf16 = use_bf16(bf16 and not quantize, self.device)
         self.load()
 
     def load(self):
+        # The checksum of the weights, which clip.load verifies
+        self.version = f'clip:ViT-B/32:{clip.weights_sha256("ViT-B/32")}' + (':int8' if self.quantize else '')
         try:
-            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
             self.model, self.processor = clip.load('ViT-B/32', device=self.device)
+            if self.quantize:
+                self.model = quantize_dynamic_int8(self.model, inplace=True)
             # self.model = CLIPModel.from_pretrained(self.model_name)
             # self.model.to(self.device)
             # self.processor = AutoProcessor.from_pretrained(self.model_name)
         except OSError as e:
             print(f'OSError: Model \'{self.model_name}\' not listed in HuggingFace repository. {e}')
 
+    def unload(self):
+        self.model = None
+        self.processor = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @torch.no_grad()
     def encode_image(self, img):
-        inputs = self.processor(images=img, return_tensors='pt').to(self.device)
+        # Accepts a single image or a list of images
+        return self.encode_preprocessed(preprocess_images(img, self.processor, self.device))
 
-        image_features = self.model.get_image_features(**inputs)
+    @torch.no_grad()
+    def encode_preprocessed(self, images):
+        with self.autocast():
+            image_features = self.model.encode_image(images)
 
-        return image_features.cpu().detach().numpy()
+        return image_features.float().cpu().numpy()
 
+    @torch.no_grad()
     def encode_text(self, text):
+        # Accepts a single text or a list of texts
         tokenized_text = clip.tokenize(text).to(self.device)
         # inputs = self.processor(text=text, return_tensors='pt').to(self.device)
 
-        text_features = self.model.encode_text(tokenized_text)
+        with self.autocast():
+            text_features = encode_tokens(tokenized_text, self.model.encode_text, self.text_bucket_size)
         # print(f'Text features: {text_features}')
 
-        return text_features.cpu().detach().numpy()
+        return text_features.float().cpu().numpy()
+
+    def model_version(self) -> str:
+        # Computed once, by load
+        return self.version
 
     def get_encoder_params(self) -> dict:
         params = {
@@ -142,7 +385,23 @@ class CLIP(EmbeddingModel):
 
 VCLIP_WEIGHTS_PATH = '/weights'
 class VCLIP(EmbeddingModel):
-    def __init__(self):
+    def __init__(self, device:str=None, bf16:bool=False, quantize:bool=False, text_bucket_size:int=64):
+        """Uses the VCLIP model (CLIP fine-tuned on video) to obtain the embeddings of the clips.
+
+        Parameters
+        ----------
+        device : str, optional
+            The device where the model runs ('cuda' or 'cpu'). By default, cuda if available
+        bf16 : bool, optional
+            Whether to run inference with bf16 autocast when running on CPU. By default, False
+        quantize : bool, optional
+            Whether to quantize the transformer blocks to int8 (dynamic quantization). Quantized models
+            only run on CPU, so the device is ignored. By default, False
+        text_bucket_size : int, optional
+            Maximum number of texts encoded per forward pass, grouped by length. By default, 64
+        """
+        self.quantize = quantize
+        self.text_bucket_size = text_bucket_size
 
         # Apply a default configuration
         _C = CN()
@@ -151,8 +410,9 @@ class VCLIP(EmbeddingModel):
         _C.MODEL.ARCH = 'ViT-B/32'
         _C.MODEL.WEIGHTS_DIR = VCLIP_WEIGHTS_PATH
         _C.MODEL.RESUME = join_path(VCLIP_WEIGHTS_PATH, '100batch_40frames_32.pth')
-        _C.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+        _C.DEVICE = 'cpu' if quantize else device or default_device()
         self.config = _C.clone()
+        self.bf16 = use_bf16(bf16 and not quantize, self.config.DEVICE)
 
         self.load()
 
@@ -165,29 +425,116 @@ class VCLIP(EmbeddingModel):
                                                  jit=False,
                                                  device=self.config.DEVICE)
         
-        self.model = self.model.float().cuda()
-        checkpoint = torch.load(self.config.MODEL.RESUME, map_location='cpu')
+        self.model = self.model.float().to(self.config.DEVICE)
+        checkpoint = load_checkpoint(self.config.MODEL.RESUME)
         load_state_dict = checkpoint['model']
         self.model.load_state_dict(load_state_dict, strict=False)
+        if self.quantize:
+            self.model = quantize_dynamic_int8(self.model, inplace=True)
+        # The fine-tuned checkpoint may be replaced in the weights directory, so the loaded one is
+        # identified by its checksum (hashed once, then read from its verification marker while it is unchanged)
+        self.version = f'vclip:{self.config.MODEL.ARCH}:{vclip.weights_sha256(self.config.MODEL.RESUME)}' \
+            + (':int8' if self.quantize else '')
 
         self.device = self.config.DEVICE
     
     def unload(self):
-        pass
+        self.model = None
+        self.preprocess = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
+    @torch.no_grad()
     def encode_image(self, img):
-        # Send image to device
-        image = self.preprocess(img).unsqueeze(0).to(self.device)
+        # Accepts a single image or a list of images. Send images to device
+        return self.encode_preprocessed(preprocess_images(img, self.preprocess, self.device))
 
+    @torch.no_grad()
+    def encode_preprocessed(self, images):
         # Get features
-        image_features, attention_weights = self.model.encode_image(image)
+        with self.autocast():
+            image_features, attention_weights = self.model.encode_image(images)
 
-        return image_features
+        return image_features.float().cpu().numpy()
 
+    @torch.no_grad()
     def encode_text(self, text):
+        # Accepts a single text or a list of texts
         text = vclip.tokenize(text).to(self.device)
-        text_features, _ = self.model.encode_text(text)
-        return text_features
+        with self.autocast():
+            text_features = encode_tokens(text, lambda tokens: self.model.encode_text(tokens)[0], self.text_bucket_size)
+        return text_features.float().cpu().numpy()
+
+    def explain(self, img, text: str, layers: list = None, heads: list = None) -> dict:
+        """Explains the match between an image and a text with a gradient-weighted attention rollout
+        of the image transformer. Only the requested layers compute their attention weights.
+
+        Parameters
+        ----------
+        img : Union[np.ndarray, Image.Image]
+            The image.
+        text : str
+            The text.
+        layers : list, optional
+            The layers of the image transformer rolled out (negative indices count from the last one). By default, None (all)
+        heads : list, optional
+            The attention heads taken into account. By default, None (all)
+
+        Returns
+        -------
+        dict
+            The image-text cosine similarity, the layers and heads used, and the heatmap as a
+            uint8 array over the patch grid (shape = [grid, grid]).
+
+        Raises
+        ------
+        NotImplementedError
+            If the model is quantized (quantized layers have no gradients).
+        ValueError
+            If a layer or head does not exist.
+        """
+        if self.quantize:
+            raise NotImplementedError('Quantized encoders do not support explanations')
+
+        transformer = self.model.visual.transformer
+        n_heads = transformer.resblocks[0].attn.num_heads
+        layers = sorted(set(check_indices(layers, transformer.layers, 'layer')))
+        heads = sorted(set(check_indices(heads, n_heads, 'head')))
+
+        image = preprocess_images(img, self.preprocess, self.device)
+        tokens = vclip.tokenize(text).to(self.device)
+
+        # The weights of the requested layers, as they take part in the forward pass, to get their gradients.
+        # Other threads may run the same model, so only this thread's forward pass is captured
+        thread, captured = threading.get_ident(), []
+        def capture(block, inputs, outputs):
+            if threading.get_ident() == thread and outputs[1] is not None:
+                captured.append(outputs[1])
+        hooks = [transformer.resblocks[layer].register_forward_hook(capture) for layer in layers]
+
+        try:
+            with torch.no_grad():
+                text_features, _ = self.model.encode_text(tokens)
+            with torch.enable_grad():
+                image_features, weights = self.model.encode_image(image, need_weights=layers)
+                similarity = torch.nn.functional.cosine_similarity(image_features, text_features).sum()
+                gradients = torch.autograd.grad(similarity, captured)
+        finally:
+            for hook in hooks:
+                hook.remove()
+
+        relevance = attention_rollout(weights.detach(), torch.stack(gradients), heads)
+        grid_size = self.model.visual.input_resolution // self.model.visual.conv1.kernel_size[0]
+        return {
+            'similarity': similarity.item(),
+            'layers': layers,
+            'heads': heads,
+            'heatmap': to_uint8_grid(relevance, grid_size)[0]
+        }
+
+    def model_version(self) -> str:
+        # Computed once, by load
+        return self.version
 
     def get_encoder_params(self) -> dict:
         params = {
@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+
+def attention_rollout(weights: torch.Tensor, gradients: torch.Tensor, heads: list = None) -> torch.Tensor:
+    """Gradient-weighted attention rollout (Chefer et al., 2021). Each layer's attention is
+    weighted by its gradient with respect to the image-text similarity, so only what pushes the
+    similarity up is kept, and the layers are chained from the first to the last.
+
+    Parameters
+    ----------
+    weights : torch.Tensor
+        The attention weights of the layers to roll out, shape = [layers, N, heads, L, L].
+    gradients : torch.Tensor
+        The gradients of the similarity with respect to the weights, same shape.
+    heads : list, optional
+        The heads taken into account. By default, None (all of them)
+
+    Returns
+    -------
+    torch.Tensor
+        The relevance of each patch for the class token, shape = [N, L - 1].
+    """
+    if heads is not None:
+        weights, gradients = weights[:, :, heads], gradients[:, :, heads]
+
+    # Positive relevance, averaged over the heads => [layers, N, L, L]
+    cams = (gradients * weights).clamp(min=0).mean(dim=2)
+
+    n_tokens = cams.shape[-1]
+    rollout = torch.eye(n_tokens, dtype=cams.dtype, device=cams.device).expand_as(cams[0])
+    for cam in cams:
+        rollout = rollout + cam @ rollout
+
+    # The class token's row, without itself
+    return rollout[:, 0, 1:]
+
+def to_uint8_grid(relevance: torch.Tensor, grid_size: int) -> np.ndarray:
+    """Scales the relevance of each patch to [0, 255] and lays it over the patch grid.
+
+    Parameters
+    ----------
+    relevance : torch.Tensor
+        The relevance of each patch, shape = [N, grid_size ** 2].
+    grid_size : int
+        The number of patches per side.
+
+    Returns
+    -------
+    np.ndarray
+        The heatmaps, shape = [N, grid_size, grid_size], dtype uint8.
+    """
+    relevance = relevance.reshape(-1, grid_size, grid_size).float()
+    low = relevance.amin(dim=(1, 2), keepdim=True)
+    high = relevance.amax(dim=(1, 2), keepdim=True)
+    scaled = (relevance - low) / (high - low).clamp(min=1e-12)
+    return (scaled * 255).round().to(torch.uint8).cpu().numpy()
@@ -0,0 +1,162 @@
+import multiprocessing as mp
+import queue
+import time
+from itertools import islice
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+
+import numpy as np
+
+from video import iter_frames
+
+class FrameBatch(NamedTuple):
+    # A batch of decoded frames of a video. The last batch of every video has last=True and
+    # may be empty (frames=None), or carry the decoding error that ended the video
+    video: str
+    frame_n: np.ndarray
+    frames: np.ndarray
+    last: bool
+    error: str = None
+
+def _decode_worker(tasks, free_slots, batches, shm_name, n_slots, batch_size, resolution, stride, decode_threads):
+    # Decodes videos straight into free slots of the shared buffer. Waiting for a free slot is
+    # what keeps the decoders from running ahead of the encoder (backpressure)
+    shm = SharedMemory(name=shm_name)
+    buffer = np.ndarray((n_slots, batch_size, resolution, resolution, 3), dtype=np.uint8, buffer=shm.buf)
+    try:
+        while (task := tasks.get()) is not None:
+            video, path = task
+            slot = None
+            try:
+                frames = iter_frames(path, stride=stride, short_side=resolution, crop=resolution, threads=decode_threads)
+                while True:
+                    slot = free_slots.get()
+                    frame_numbers = []
+                    for i, (frame_n, frame) in enumerate(islice(frames, batch_size)):
+                        buffer[slot, i] = frame
+                        frame_numbers.append(frame_n)
+                    if not frame_numbers:
+                        break
+                    batches.put((video, slot, frame_numbers, None))
+                    slot = None
+                batches.put((video, None, [], None))
+            except Exception as e:
+                batches.put((video, None, [], f'{type(e).__name__}: {e}'))
+            finally:
+                if slot is not None:
+                    free_slots.put(slot)
+    finally:
+        del buffer
+        shm.close()
+        # Tells the consumer this worker is done
+        batches.put(None)
+
+class FramePipeline:
+
+    def __init__(self, resolution: int = 224, stride: int = 1, batch_size: int = 32, workers: int = 2,
+                 slots: int = 0, decode_threads: int = 1):
+        """Pool of decoder processes that read videos in parallel, decode them straight to the model's
+        input resolution (scaled and center-cropped by ffmpeg) and hand the frames over to the encoder
+        in batches, through a fixed number of shared-memory slots. Decoders only decode into free
+        slots, so memory stays bounded regardless of the length of the videos.
+
+        Parameters
+        ----------
+        resolution : int, optional
+            The model's input resolution. By default, 224
+        stride : int, optional
+            Only one every stride frames is decoded. By default, 1 (every frame)
+        batch_size : int, optional
+            Number of frames per batch (and per slot). By default, 32
+        workers : int, optional
+            Number of decoder processes. By default, 2
+        slots : int, optional
+            Number of batches that can be decoded ahead of the encoder. By default, 0 (two per worker)
+        decode_threads : int, optional
+            Threads used by each decoder. By default, 1
+        """
+        self.resolution = resolution
+        self.stride = stride
+        self.batch_size = batch_size
+        self.workers = workers
+        self.slots = slots or 2 * workers
+        self.decode_threads = decode_threads
+        self.stats = {'batches': 0, 'frames': 0, 'wait_seconds': 0.0}
+
+    def run(self, paths: list):
+        """Decodes the videos, yielding their frames in batches. Batches of the same video are
+        yielded in order, while different videos are interleaved.
+
+        Parameters
+        ----------
+        paths : list
+            The paths to the videos.
+
+        Yields
+        ------
+        FrameBatch
+            The frames, shape = [batch, resolution, resolution, 3], dtype uint8. They live in shared
+            memory and are only valid until the next batch is requested.
+        """
+        # Workers are spawned instead of forked from a process running torch. Spawned processes import
+        # the main module again (e.g. ingestion.py), which must not import torch at the top for them
+        # to stay free of it, as this module and video.py are
+        ctx = mp.get_context('spawn')
+        slot_size = self.batch_size * self.resolution ** 2 * 3
+        shm = SharedMemory(create=True, size=self.slots * slot_size)
+        buffer = np.ndarray((self.slots, self.batch_size, self.resolution, self.resolution, 3), dtype=np.uint8, buffer=shm.buf)
+
+        tasks, free_slots, batches = ctx.Queue(), ctx.Queue(), ctx.Queue()
+        for task in enumerate(paths):
+            tasks.put(task)
+        for slot in range(self.slots):
+            free_slots.put(slot)
+
+        n_workers = max(1, min(self.workers, len(paths)))
+        args = (tasks, free_slots, batches, shm.name, self.slots, self.batch_size, self.resolution, self.stride,
+                self.decode_threads)
+        processes = [ctx.Process(target=_decode_worker, args=args, daemon=True) for _ in range(n_workers)]
+        for process in processes:
+            tasks.put(None)
+            process.start()
+
+        try:
+            running = n_workers
+            while running:
+                start = time.perf_counter()
+                try:
+                    message = batches.get(timeout=1.0)
+                except queue.Empty:
+                    message = False
+                # Time the encoder spent waiting for the decoders
+                self.stats['wait_seconds'] += time.perf_counter() - start
+                if message is False:
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError('The decoder processes exited unexpectedly')
+                    continue
+                if message is None:
+                    running -= 1
+                    continue
+
+                video, slot, frame_numbers, error = message
+                if slot is None:
+                    yield FrameBatch(paths[video], np.empty(0, dtype=np.int64), None, True, error)
+                    continue
+
+                self.stats['batches'] += 1
+                self.stats['frames'] += len(frame_numbers)
+                yield FrameBatch(paths[video], np.array(frame_numbers, dtype=np.int64), buffer[slot, :len(frame_numbers)], False)
+                # The consumer is done with the frames
+                free_slots.put(slot)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            del buffer
+            try:
+                shm.close()
+            except BufferError:
+                # The consumer still holds the frames of the last batch
+                pass
+            shm.unlink()
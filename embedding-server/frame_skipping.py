@@ -0,0 +1,114 @@
+from typing import Callable
+
+import numpy as np
+
+# ITU-R BT.601 luma weights
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def thumbnails(frames: np.ndarray, size: int = 32) -> np.ndarray:
+    """Downscaled grayscale copies of the frames, for cheap change detection.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        The frames, shape = [N, height, width, 3], dtype uint8.
+    size : int, optional
+        Side of the thumbnails. The frames are averaged over blocks of height // size x width // size
+        pixels (their borders are dropped if the sizes are not multiples). By default, 32
+
+    Returns
+    -------
+    np.ndarray
+        The thumbnails, in [0, 1], shape = [N, size, size], dtype float32.
+    """
+    n, height, width, _ = frames.shape
+    block_h, block_w = max(1, height // size), max(1, width // size)
+    rows, cols = height // block_h, width // block_w
+    gray = frames[:, :rows * block_h, :cols * block_w].astype(np.float32) @ (GRAY_WEIGHTS / 255)
+    return gray.reshape(n, rows, block_h, cols, block_w).mean(axis=(2, 4))
+
+class StaticFrameSkipper:
+
+    def __init__(self, threshold: float = 0.01, size: int = 32, max_skipped: int = 0):
+        """Skips the encoding of the frames of a video that barely differ from the last encoded frame
+        (e.g. a surveillance camera looking at an empty corridor). Skipped frames reuse that frame's
+        embedding, so every frame keeps an embedding.
+
+        The change score of a frame is the mean absolute difference between its downscaled grayscale
+        thumbnail and the last encoded frame's. Comparing with the last encoded frame, rather than the
+        previous one, keeps slow changes from going unnoticed.
+
+        Frames are given in batches, in order. One skipper is used per video.
+
+        Parameters
+        ----------
+        threshold : float, optional
+            Change score (in [0, 1]) below which a frame is skipped. By default, 0.01
+        size : int, optional
+            Side of the thumbnails compared. By default, 32
+        max_skipped : int, optional
+            Maximum number of consecutive skipped frames, so embeddings are refreshed now and then.
+            By default, 0 (no limit)
+        """
+        self.threshold = threshold
+        self.size = size
+        self.max_skipped = max_skipped
+        self.stats = {'frames': 0, 'skipped': 0}
+
+        self._reference = None  # Thumbnail of the last encoded frame
+        self._embedding = None  # and its embedding
+        self._skipped = 0  # Consecutive frames skipped since
+
+    def select(self, frames: np.ndarray) -> np.ndarray:
+        """Selects the frames to encode.
+
+        Parameters
+        ----------
+        frames : np.ndarray
+            The next frames of the video, shape = [N, height, width, 3], dtype uint8.
+
+        Returns
+        -------
+        np.ndarray
+            Whether each frame has to be encoded, shape = [N], dtype bool.
+        """
+        thumbs = thumbnails(frames, self.size)
+        encode = np.zeros(len(frames), dtype=bool)
+        # Sequential, as each frame is compared with the last selected one, but on tiny thumbnails
+        for i, thumb in enumerate(thumbs):
+            if (self._reference is None or np.abs(thumb - self._reference).mean() >= self.threshold
+                    or (self.max_skipped and self._skipped >= self.max_skipped)):
+                encode[i] = True
+                self._reference, self._skipped = thumb, 0
+            else:
+                self._skipped += 1
+        return encode
+
+    def encode(self, frames: np.ndarray, encode_fn: Callable) -> np.ndarray:
+        """Encodes the frames that changed, reusing the last encoded frame's embedding for the others.
+
+        Parameters
+        ----------
+        frames : np.ndarray
+            The next frames of the video, shape = [N, height, width, 3], dtype uint8.
+        encode_fn : Callable
+            Encodes frames, e.g. EmbeddingModel.encode_frames.
+
+        Returns
+        -------
+        np.ndarray
+            The embeddings of all the frames, shape = [N, embedding size].
+        """
+        encode = self.select(frames)
+        self.stats['frames'] += len(frames)
+        self.stats['skipped'] += int(len(frames) - encode.sum())
+
+        embeddings = encode_fn(frames[encode]) if encode.any() else np.empty((0, self._embedding.shape[-1]))
+        # Position (within the encoded frames) of the last encoded frame at or before each frame,
+        # -1 for the frames before the first one, which reuse the previous batch's
+        source = np.cumsum(encode) - 1
+        if self._embedding is not None:
+            embeddings = np.concatenate((self._embedding[None].astype(embeddings.dtype), embeddings))
+            source += 1
+        self._embedding = embeddings[-1]
+        return embeddings[source]
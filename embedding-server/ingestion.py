@@ -0,0 +1,542 @@
+"""Offline ingestion of a video directory: frame embeddings for the ucf*frames collections.
+
+A pool of --workers processes stream-decodes the videos with ffmpeg, straight to the model's input
+resolution. One every --stride frames is encoded with the selected encoder, and the embeddings are
+saved, one file per video, as <output>/<video>.npz with:
+
+- video: the video's name, as stored in the databases (its path in the directory, without .mp4),
+- frame_n: the frame numbers, shape = [frames],
+- embeddings: the frame embeddings as float32, shape = [frames, embedding size].
+
+With --events, the frames are also segmented into events as they are encoded (see segmentation.py)
+for the *centroid collections, saved as <output>/<video>.events.npz with video, start_frame,
+end_frame and the centroid embeddings.
+
+With --windows W, sliding windows of W encoded frames, one every --window-stride encoded frames, are
+also saved as <output>/<video>.windows.npz (same fields as the events). Their embeddings are pooled from
+the frame embeddings with cumulative sums, so every frame is encoded once however much windows overlap.
+Windows count encoded frames: with --stride 5, --windows 8 spans 40 frames of the video.
+
+With --skip-threshold, frames that barely differ from the last encoded frame of their video (see
+frame_skipping.py) are not encoded and reuse its embedding, so static footage costs much less.
+
+With --clips events (or windows, or both), the clip of every event is cut once (see clips.py) into
+<output>/<video>.events.mp4, in --clip-workers background threads while the next videos are encoded,
+and the events file also gets clip_offset and clip_size, the byte range of each clip, so they can be
+streamed without transcoding. With --thumbnails N, a strip of N thumbnails evenly spaced over the
+video is saved as <output>/<video>.thumbs.jpg, from the frames decoded for the encoder, and their
+frame numbers as thumbnail_frame_n in <output>/<video>.npz.
+
+With --catalog (see catalog.py), the frame rates and durations of the videos are read from the
+catalog instead of probing each video with ffprobe.
+
+Runs are incremental: <output>/manifest.json records the SHA-256 of every video ingested and the
+configuration it was ingested with (encoder, model version and the arguments above), see
+manifest.py. Only new and changed videos, and those ingested with another configuration, are
+encoded; the outputs of deleted videos are removed and the videos tombstoned. The videos are
+ingested in shards of --shard-size videos, and the manifest is saved after each one, so an
+interrupted run resumes from the last shard. --force ingests every video again.
+
+Usage: python ingestion.py VIDEOS_DIR OUTPUT_DIR [--encoder vclip] [--stride 5] [--batch-size 32] [--workers 2] [--events]
+       [--windows 8 --window-stride 4] [--skip-threshold 0.01] [--clips events,windows] [--thumbnails 16] [--catalog CATALOG_DIR]
+       [--shard-size 64] [--force] [--retry-failed]
+"""
+import argparse
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from clips import ThumbnailStrip, write_clips
+from config import get_config
+from frame_pipeline import FramePipeline
+from frame_skipping import StaticFrameSkipper
+from manifest import IngestionManifest
+from segmentation import EventSegmenter, WindowPooler
+from catalog import VideoCatalog
+from video import list_videos, probe_video, video_name
+
+if TYPE_CHECKING:
+    from encoders import EmbeddingModel
+
+# Files written per video, after its name
+OUTPUT_SUFFIXES = ('.npz', '.events.npz', '.windows.npz', '.events.mp4', '.windows.mp4', '.thumbs.jpg')
+
+def output_files(output_dir: str, video: str) -> list:
+    # The files of a video in the output directory
+    return [path for path in (os.path.join(output_dir, video + suffix) for suffix in OUTPUT_SUFFIXES) if os.path.isfile(path)]
+
+def video_info(path: str, videos_dir: str, catalog: VideoCatalog = None) -> dict:
+    """Returns the frame rate (fps), number of frames (frames) and duration of a video, from the
+    catalog if it has the video, or else probed with ffprobe (the number of frames then estimated
+    from the duration).
+    """
+    name = video_name(path, videos_dir)
+    if catalog is not None and name in catalog:
+        return catalog.info(name)
+    info = probe_video(path)
+    return {**info, 'frames': round(info['duration'] * info['fps'])}
+
+def ingest_video(model: 'EmbeddingModel', path: str, stride: int = 1, batch_size: int = 32) -> dict:
+    """Encodes the frames of a video, one every stride frames, decoding it in this process.
+
+    Parameters
+    ----------
+    model : EmbeddingModel
+        The encoder.
+    path : str
+        The path to the video.
+    stride : int, optional
+        Only one every stride frames is encoded. By default, 1 (every frame)
+    batch_size : int, optional
+        Number of frames encoded at once. By default, 32
+
+    Returns
+    -------
+    dict
+        The frame numbers (frame_n) and their embeddings.
+    """
+    return concatenate_batches(list(model.encode_video(path, stride=stride, batch_size=batch_size)))
+
+def concatenate_batches(batches: list) -> dict:
+    # Joins the (frame numbers, embeddings) of the batches of a video
+    if not batches:
+        return {'frame_n': np.empty(0, dtype=np.int64), 'embeddings': np.empty((0, 0), dtype=np.float32)}
+    frame_numbers, embeddings = zip(*batches)
+    return {'frame_n': np.concatenate(frame_numbers),
+            'embeddings': np.concatenate(embeddings).astype(np.float32, copy=False)}
+
+class NpzWriter:
+
+    def __init__(self, path: str, columns: dict):
+        """Writes a .npz file (as np.savez) whose arrays grow by rows as they are produced, so they
+        are never all held in memory. The rows of each array are appended to a temporary file next
+        to it until close copies them into the archive.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file.
+        columns : dict
+            The names of the arrays that grow, each with its dtype and number of dimensions.
+        """
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self._shapes = {}  # Shape of the rows of each array, from the first ones appended
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._files = {name: open(f'{path}.{name}.tmp', 'w+b') for name in columns}
+
+    def append(self, **arrays):
+        """Appends rows to every array, the same number to each.
+        """
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=self.columns[name][0])
+            self._shapes.setdefault(name, array.shape[1:])
+            self._files[name].write(array.data)
+        self.rows += len(next(iter(arrays.values())))
+
+    def close(self, **extra) -> str:
+        """Writes the file, atomically, with the rows appended and the arrays given here.
+
+        Returns
+        -------
+        str
+            The path to the file.
+        """
+        tmp_path = self.path[:-len('.npz')] + '.tmp.npz'
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, array in extra.items():
+                with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(array))
+            for name, (dtype, ndim) in self.columns.items():
+                shape = (self.rows, *self._shapes.get(name, (0,) * (ndim - 1)))
+                with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                             'fortran_order': False, 'shape': shape})
+                    self._files[name].seek(0)
+                    shutil.copyfileobj(self._files[name], f, 1 << 20)
+        os.replace(tmp_path, self.path)
+        self.discard()
+        return self.path
+
+    def discard(self):
+        """Deletes the rows appended, without writing the file.
+        """
+        for name, f in self._files.items():
+            f.close()
+            os.remove(f'{self.path}.{name}.tmp')
+        self._files = {}
+
+# Arrays of the files of frames and of events (or windows), and their dtypes and dimensions
+FRAME_COLUMNS = {'frame_n': (np.int64, 1), 'embeddings': (np.float32, 2)}
+EVENT_COLUMNS = {'start_frame': (np.int64, 1), 'end_frame': (np.int64, 1), 'embeddings': (np.float32, 2)}
+
+def event_columns(events: list) -> dict:
+    # The spans and centroids of a list of events, as the arrays of their file
+    return {'start_frame': np.array([event.start_frame for event in events], dtype=np.int64),
+            'end_frame': np.array([event.end_frame for event in events], dtype=np.int64),
+            'embeddings': np.array([event.centroid for event in events], dtype=np.float32)}
+
+def save_embeddings(output_dir: str, video: str, frames: dict, thumbnail_frame_n: list = None) -> str:
+    """Saves the frame embeddings of a video as <output_dir>/<video>.npz.
+
+    Parameters
+    ----------
+    output_dir : str
+        The output directory.
+    video : str
+        The video's name.
+    frames : dict
+        The frame numbers (frame_n) and their embeddings, as returned by ingest_video.
+    thumbnail_frame_n : list, optional
+        If given, the frame numbers of the thumbnails of the video, saved as thumbnail_frame_n. By default, None
+
+    Returns
+    -------
+    str
+        The path to the file.
+    """
+    path = os.path.join(output_dir, video + '.npz')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written under a temporary name, so an interrupted run never leaves a truncated file
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    extra = {'thumbnail_frame_n': np.array(thumbnail_frame_n, dtype=np.int64)} if thumbnail_frame_n is not None else {}
+    np.savez(tmp_path, video=np.array(video), frame_n=frames['frame_n'], embeddings=frames['embeddings'], **extra)
+    os.replace(tmp_path, path)
+    return path
+
+def save_events(output_dir: str, video: str, events: list, kind: str = 'events', clips: tuple = None) -> str:
+    """Saves the events of a video as <output_dir>/<video>.<kind>.npz, with the video's name,
+    the span of each event (start_frame and end_frame, both included) and their centroid embeddings.
+
+    Parameters
+    ----------
+    output_dir : str
+        The output directory.
+    video : str
+        The video's name.
+    events : list
+        The events, as returned by segmentation.EventSegmenter (or the windows of segmentation.WindowPooler).
+    kind : str, optional
+        Suffix of the file. By default, 'events'
+    clips : tuple, optional
+        If given, the byte offset and size of the clip of each event in <output_dir>/<video>.<kind>.mp4
+        (see clips.write_clips), saved as clip_offset and clip_size. By default, None
+
+    Returns
+    -------
+    str
+        The path to the file.
+    """
+    path = os.path.join(output_dir, f'{video}.{kind}.npz')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, video=np.array(video), **event_columns(events),
+             **({'clip_offset': clips[0], 'clip_size': clips[1]} if clips is not None else {}))
+    os.replace(tmp_path, path)
+    return path
+
+def save_clipped_events(writer: NpzWriter, video: str, path: str, spans: list, fps: float, clips_path: str) -> str:
+    """Cuts the clips of the events of a video into a file (see clips.write_clips), then writes the
+    file of the events with their byte ranges, saved as clip_offset and clip_size. If ffmpeg fails,
+    the events are saved without them, and are trimmed when streamed.
+
+    Parameters
+    ----------
+    writer : NpzWriter
+        The writer of the file of the events, with the events appended (see EVENT_COLUMNS).
+    video : str
+        The video's name.
+    path : str
+        The path to the video.
+    spans : list
+        The (start_frame, end_frame) of each event.
+    fps : float
+        The frame rate of the video.
+    clips_path : str
+        The path to the file of the clips.
+
+    Returns
+    -------
+    str
+        The path to the file of the events.
+    """
+    try:
+        offsets, sizes = write_clips(path, spans, fps, clips_path)
+        clips = {'clip_offset': offsets, 'clip_size': sizes}
+    except RuntimeError as e:
+        print(f'{video}: no clips in {os.path.basename(clips_path)}, {e}')
+        clips = {}
+    return writer.close(video=np.array(video), **clips)
+
+def write_events(state: dict, kind: str, events: list):
+    # Appends the events (or windows) of a video to its file as they are emitted, keeping only their spans
+    if events:
+        state['writers'][kind].append(**event_columns(events))
+        state['spans'][kind] += [(event.start_frame, event.end_frame) for event in events]
+
+def ingest(model: 'EmbeddingModel', videos_dir: str, output_dir: str, stride: int = 1, batch_size: int = 32,
+           workers: int = 2, segmenter_kwargs: dict = None, window_kwargs: dict = None, skip_kwargs: dict = None,
+           clip_kinds: tuple = (), clip_workers: int = 1, thumbnails: int = 0, catalog: VideoCatalog = None,
+           videos: list = None) -> dict:
+    """Encodes the frames of every video in a directory and saves them, one file per video. The
+    videos are decoded in parallel by a pool of processes (see frame_pipeline.FramePipeline),
+    while this process only encodes. The frame embeddings, events and windows are written out as
+    they are encoded (see NpzWriter), so memory does not grow with the length of the videos.
+
+    Parameters
+    ----------
+    model : EmbeddingModel
+        The encoder.
+    videos_dir : str
+        The videos directory.
+    output_dir : str
+        The directory where the embeddings are saved.
+    stride : int, optional
+        Only one every stride frames is encoded. By default, 1 (every frame)
+    batch_size : int, optional
+        Number of frames encoded at once. By default, 32
+    workers : int, optional
+        Number of decoder processes. By default, 2
+    segmenter_kwargs : dict, optional
+        If given, the frames are also segmented into events (see segmentation.EventSegmenter, which
+        takes these arguments) as they are encoded, and the events are saved as save_events does.
+        By default, None
+    window_kwargs : dict, optional
+        If given, sliding-window embeddings are also pooled from the frame embeddings (see
+        segmentation.WindowPooler, which takes these arguments) and saved as save_events does, as
+        windows. By default, None
+    skip_kwargs : dict, optional
+        If given, the frames of static scenes are not encoded (see frame_skipping.StaticFrameSkipper,
+        which takes these arguments) and reuse the embedding of the last encoded frame. By default, None
+    clip_kinds : tuple, optional
+        'events' and/or 'windows': the clips of these are cut and saved with them (see
+        save_clipped_events), in background threads. By default, () (none)
+    clip_workers : int, optional
+        Number of threads cutting clips. By default, 1
+    thumbnails : int, optional
+        Number of thumbnails of the strip of each video (see clips.ThumbnailStrip). By default, 0 (none)
+    catalog : VideoCatalog, optional
+        If given, the frame rates and durations of the videos in it are read from it instead of
+        probing the videos (see video_info). By default, None
+    videos : list, optional
+        The paths to the videos to ingest. By default, None (all the videos in the directory)
+
+    Returns
+    -------
+    dict
+        For each video ingested or skipped, its path and its error (None if it was ingested).
+    """
+    videos = list_videos(videos_dir) if videos is None else videos
+    results = {}
+    print(f'Ingesting {len(videos)} videos from {videos_dir} with {workers} decoders')
+
+    pipeline = FramePipeline(resolution=model.input_resolution(), stride=stride, batch_size=batch_size, workers=workers)
+    # Writers (frames, events and windows) of the videos being decoded, as videos are interleaved
+    pending, done = {}, 0
+    # Clips are cut by ffmpeg processes while the next videos are encoded
+    clip_executor = ThreadPoolExecutor(max_workers=max(1, clip_workers)) if clip_kinds else None
+    clip_jobs = []
+    total_footage, total_skipped, start = 0.0, 0, time.perf_counter()
+    for batch in pipeline.run(videos):
+        if batch.video not in pending:
+            video = video_name(batch.video, videos_dir)
+            writers = {'frames': NpzWriter(os.path.join(output_dir, video + '.npz'), FRAME_COLUMNS)}
+            for kind, kwargs in [('events', segmenter_kwargs), ('windows', window_kwargs)]:
+                if kwargs is not None:
+                    writers[kind] = NpzWriter(os.path.join(output_dir, f'{video}.{kind}.npz'), EVENT_COLUMNS)
+            pending[batch.video] = {
+                'writers': writers,
+                # Only the spans are kept, to cut the clips
+                'spans': {'events': [], 'windows': []},
+                'segmenter': EventSegmenter(**segmenter_kwargs) if segmenter_kwargs is not None else None,
+                'pooler': WindowPooler(**window_kwargs) if window_kwargs is not None else None,
+                'skipper': StaticFrameSkipper(**skip_kwargs) if skip_kwargs is not None else None,
+                'info': None, 'strip': None
+            }
+        state = pending[batch.video]
+        segmenter, pooler, skipper = state['segmenter'], state['pooler'], state['skipper']
+        if batch.frames is not None:
+            if thumbnails:
+                if state['strip'] is None:
+                    state['info'] = video_info(batch.video, videos_dir, catalog)
+                    state['strip'] = ThumbnailStrip(state['info']['frames'], count=thumbnails)
+                state['strip'].push(batch.frame_n, batch.frames)
+            if skipper is not None:
+                embeddings = skipper.encode(batch.frames, model.encode_frames)
+            else:
+                embeddings = model.encode_frames(batch.frames)
+            state['writers']['frames'].append(frame_n=batch.frame_n, embeddings=embeddings)
+            for kind, pooling in [('events', segmenter), ('windows', pooler)]:
+                if pooling is not None:
+                    write_events(state, kind, pooling.push(batch.frame_n, embeddings))
+        if not batch.last:
+            continue
+
+        done += 1
+        video = video_name(batch.video, videos_dir)
+        state = pending.pop(batch.video)
+        writers, spans = state['writers'], state['spans']
+        results[batch.video] = batch.error
+        if batch.error:
+            for writer in writers.values():
+                writer.discard()
+            print(f'[{done}/{len(videos)}] {video}: skipped, {batch.error}')
+            continue
+        info = state['info'] or video_info(batch.video, videos_dir, catalog)
+        strip = state['strip']
+        extra = {'video': np.array(video)}
+        if strip is not None:
+            strip.save(os.path.join(output_dir, video + '.thumbs.jpg'))
+            extra['thumbnail_frame_n'] = np.array(strip.frame_n, dtype=np.int64)
+        n_frames = writers['frames'].rows
+        writers['frames'].close(**extra)
+        for kind, pooling in [('events', segmenter), ('windows', pooler)]:
+            if pooling is None:
+                continue
+            write_events(state, kind, pooling.flush())
+            if kind in clip_kinds:
+                clip_jobs.append(clip_executor.submit(save_clipped_events, writers[kind], video, batch.video, spans[kind],
+                                                      info['fps'], os.path.join(output_dir, f'{video}.{kind}.mp4')))
+            else:
+                writers[kind].close(video=np.array(video))
+        footage = info['duration']
+        total_footage += footage
+        print(f'[{done}/{len(videos)}] {video}: {n_frames} frames ({footage:.0f} s of footage)'
+              + (f', {len(spans["events"])} events' if segmenter is not None else '')
+              + (f', {len(spans["windows"])} windows' if pooler is not None else '')
+              + (f', {skipper.stats["skipped"]} static frames skipped' if skipper is not None else ''))
+        if skipper is not None:
+            total_skipped += skipper.stats['skipped']
+
+    if clip_executor is not None:
+        print(f'Waiting for the clips of {sum(not job.done() for job in clip_jobs)} videos')
+        clip_executor.shutdown()
+        for job in clip_jobs:
+            job.result()
+
+    elapsed = time.perf_counter() - start
+    print(f'Ingested {total_footage / 3600:.2f} h of footage in {elapsed / 3600:.2f} h '
+          f'({total_footage / max(elapsed, 1e-9):.1f}x realtime). '
+          f'The encoder waited {pipeline.stats["wait_seconds"]:.1f} s for the decoders'
+          + (f'. {total_skipped} of {pipeline.stats["frames"]} frames were static and skipped' if skip_kwargs is not None else ''))
+    return results
+
+def ingest_incremental(model: 'EmbeddingModel', encoder_name: str, videos_dir: str, output_dir: str, shard_size: int = 64,
+                       force: bool = False, retry_failed: bool = False, **kwargs):
+    """Ingests the videos of a directory that are new or changed since the last run (see
+    manifest.IngestionManifest), shard by shard, saving the manifest after each shard. The outputs
+    of the videos no longer in the directory are removed, and the videos tombstoned.
+
+    Parameters
+    ----------
+    model : EmbeddingModel
+        The encoder.
+    encoder_name : str
+        Its name.
+    videos_dir : str
+        The videos directory.
+    output_dir : str
+        The directory where the embeddings and the manifest (manifest.json) are saved.
+    shard_size : int, optional
+        Number of videos ingested between checkpoints of the manifest. By default, 64
+    force : bool, optional
+        Whether every video is ingested, up to date or not. By default, False
+    retry_failed : bool, optional
+        Whether the videos that failed before are tried again even if they did not change. By default, False
+    **kwargs
+        Arguments of ingest.
+    """
+    # Everything that changes the outputs
+    config = {'encoder': encoder_name, 'model_version': model.model_version(), 'stride': kwargs.get('stride', 1),
+              'events': kwargs.get('segmenter_kwargs'), 'windows': kwargs.get('window_kwargs'),
+              'skip': kwargs.get('skip_kwargs'), 'clips': sorted(kwargs.get('clip_kinds', ())),
+              'thumbnails': kwargs.get('thumbnails', 0)}
+    manifest = IngestionManifest(os.path.join(output_dir, 'manifest.json'), config)
+
+    paths = list_videos(videos_dir)
+    pending, deleted = manifest.plan(paths, [video_name(path, videos_dir) for path in paths], retry_failed=retry_failed)
+    pending = paths if force else pending
+    for video in deleted:
+        for path in output_files(output_dir, video):
+            os.remove(path)
+        manifest.tombstone(video)
+    manifest.save()
+    print(f'{len(paths) - len(pending)} videos up to date, {len(pending)} to ingest, {len(deleted)} deleted')
+
+    n_shards = -(-len(pending) // shard_size)
+    for i, start in enumerate(range(0, len(pending), shard_size)):
+        results = ingest(model, videos_dir, output_dir, videos=pending[start:start + shard_size], **kwargs)
+        for path, error in results.items():
+            manifest.record(video_name(path, videos_dir), error)
+        manifest.save()
+        print(f'Shard {i + 1}/{n_shards} done')
+
+def main():
+    parser = argparse.ArgumentParser(description='Encodes the frames of a video directory.')
+    parser.add_argument('videos_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--encoder', default='vclip')
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2, help='Number of decoder processes')
+    parser.add_argument('--events', action='store_true', help='Also segment the videos into events (centroids)')
+    parser.add_argument('--event-threshold', type=float, default=0.15,
+                        help='Cosine distance between consecutive frames that starts a new event')
+    parser.add_argument('--event-min-frames', type=int, default=1)
+    parser.add_argument('--event-max-frames', type=int, default=0)
+    parser.add_argument('--windows', type=int, default=0,
+                        help='Also pool sliding windows of this many encoded frames (e.g. 8 with --stride 5 for 40 frames)')
+    parser.add_argument('--window-stride', type=int, default=1, help='Encoded frames between consecutive windows')
+    parser.add_argument('--skip-threshold', type=float, default=0,
+                        help='Change score (mean absolute difference of 32x32 grayscale thumbnails, in [0, 1]) '
+                             'below which a frame reuses the last encoded frame\'s embedding. By default, 0 (off)')
+    parser.add_argument('--skip-max-frames', type=int, default=0,
+                        help='Maximum number of consecutive skipped frames. By default, 0 (no limit)')
+    parser.add_argument('--clips', default='',
+                        help='Cut the clips of the events and/or windows (e.g. events,windows) for streaming without transcoding')
+    parser.add_argument('--clip-workers', type=int, default=1, help='Number of threads cutting clips')
+    parser.add_argument('--thumbnails', type=int, default=0, help='Number of thumbnails of the strip of each video')
+    parser.add_argument('--catalog', default='', help='Catalog of the videos (see catalog.py), instead of probing them')
+    parser.add_argument('--shard-size', type=int, default=64, help='Videos ingested between checkpoints of the manifest')
+    parser.add_argument('--force', action='store_true', help='Ingest every video, even if it is up to date')
+    parser.add_argument('--retry-failed', action='store_true', help='Try the videos that failed before again')
+    parser.add_argument('--device', default='', help='cuda or cpu. By default, the server\'s configuration')
+    args = parser.parse_args()
+
+    # Imported here, not at the top: the decoder processes are spawned, so they import this module
+    # again, and they do not need torch
+    from cpu_runtime import configure_cpu_runtime
+    from encoders import EncoderBuilder
+
+    # Same device, precision and thread settings as the server
+    cfg = get_config()
+    configure_cpu_runtime(intra_op_threads=cfg.CPU.INTRA_OP_THREADS,
+                          inter_op_threads=cfg.CPU.INTER_OP_THREADS,
+                          pin_threads=cfg.CPU.PIN_THREADS)
+    model = EncoderBuilder().build(args.encoder, device=args.device or cfg.ENCODER.DEVICE or None, bf16=cfg.ENCODER.BF16)
+
+    segmenter_kwargs = None
+    if args.events:
+        segmenter_kwargs = {'threshold': args.event_threshold, 'min_frames': args.event_min_frames,
+                            'max_frames': args.event_max_frames}
+    window_kwargs = {'window': args.windows, 'stride': args.window_stride} if args.windows else None
+    skip_kwargs = {'threshold': args.skip_threshold, 'max_skipped': args.skip_max_frames} if args.skip_threshold else None
+    clip_kinds = tuple(kind for kind in args.clips.split(',') if kind)
+    if not set(clip_kinds) <= {'events', 'windows'}:
+        parser.error('--clips takes events and/or windows')
+    if ('events' in clip_kinds and not args.events) or ('windows' in clip_kinds and not args.windows):
+        parser.error('--clips needs the --events or --windows it cuts')
+    ingest_incremental(model, args.encoder, args.videos_dir, args.output_dir, shard_size=args.shard_size,
+                       force=args.force, retry_failed=args.retry_failed, stride=args.stride, batch_size=args.batch_size,
+                       workers=args.workers, segmenter_kwargs=segmenter_kwargs, window_kwargs=window_kwargs,
+                       skip_kwargs=skip_kwargs, clip_kinds=clip_kinds, clip_workers=args.clip_workers,
+                       thumbnails=args.thumbnails, catalog=VideoCatalog(args.catalog) if args.catalog else None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 of the contents of a file, read in chunks.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file.
+    chunk_size : int, optional
+        Number of bytes read at once. By default, 1 MiB
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def config_hash(config: dict) -> str:
+    # Short digest of an ingestion configuration (JSON-serializable)
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+class IngestionManifest:
+
+    def __init__(self, path: str, config: dict):
+        """Record of the videos ingested into an output directory, so a run only encodes the
+        videos that are new or changed since the last one.
+
+        Each video is recorded with the SHA-256 of its contents and the configuration it was
+        ingested with: the encoder, its model_version (which identifies its weights) and every
+        argument that changes the output. A video is up to date if neither changed. Its size and
+        modification time are also recorded, so unchanged files are not hashed again. Videos are
+        recorded as done, failed (with the error) or deleted (tombstones of the videos that were
+        removed from the directory).
+
+        Parameters
+        ----------
+        path : str
+            The path to the manifest (a JSON file), created if it does not exist.
+        config : dict
+            The configuration of this run (JSON-serializable).
+        """
+        self.path = path
+        self.config = config
+        self.config_id = config_hash(config)
+        self.configs, self.videos = {}, {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.configs, self.videos = manifest['configs'], manifest['videos']
+        self._files = {}  # Name => hash, size and modification time of the videos found by plan
+
+    def plan(self, paths: list, names: list, retry_failed: bool = False, workers: int = 4) -> tuple:
+        """Finds the videos to ingest, hashing the new and modified ones.
+
+        Parameters
+        ----------
+        paths : list
+            The paths to the videos in the directory.
+        names : list
+            Their names.
+        retry_failed : bool, optional
+            Whether the videos that failed with the same contents and configuration are tried
+            again. By default, False
+        workers : int, optional
+            Number of files hashed at once. By default, 4
+
+        Returns
+        -------
+        tuple
+            The paths to the videos to ingest, and the names of the recorded videos that are no longer
+            in the directory.
+        """
+        stats = [os.stat(path) for path in paths]
+        # Files whose size and modification time match their record keep its hash
+        known = {}
+        for name, stat in zip(names, stats):
+            entry = self.videos.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                known[name] = entry['hash']
+        to_hash = [(path, name) for path, name in zip(paths, names) if name not in known]
+        if to_hash:
+            print(f'Hashing {len(to_hash)} new or modified videos')
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            hashes = dict(zip((name for _, name in to_hash), executor.map(file_hash, (path for path, _ in to_hash))))
+
+        pending = []
+        for path, name, stat in zip(paths, names, stats):
+            digest = known.get(name) or hashes[name]
+            self._files[name] = {'hash': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            entry = self.videos.get(name)
+            up_to_date = (entry is not None and entry['hash'] == digest and entry['config'] == self.config_id
+                          and (entry['status'] == 'done' or (entry['status'] == 'failed' and not retry_failed)))
+            if not up_to_date:
+                pending.append(path)
+            elif name not in known:
+                # Touched but unchanged: its new size and modification time save hashing it next time
+                entry.update(self._files[name])
+
+        present = set(names)
+        deleted = [name for name, entry in self.videos.items() if name not in present and entry['status'] != 'deleted']
+        return pending, deleted
+
+    def record(self, name: str, error: str = None):
+        """Records a video found by plan as ingested, or as failed with an error.
+        """
+        self.configs[self.config_id] = self.config
+        self.videos[name] = {**self._files[name], 'config': self.config_id, 'status': 'failed' if error else 'done',
+                             'time': time.time(), **({'error': error} if error else {})}
+
+    def tombstone(self, name: str):
+        """Records a video as deleted.
+        """
+        self.videos[name] = {**self.videos[name], 'status': 'deleted', 'time': time.time()}
+        self.videos[name].pop('error', None)
+
+    def save(self):
+        """Writes the manifest, atomically, so a crash leaves the last one saved.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Only the configurations still in use
+        configs = {entry['config'] for entry in self.videos.values()}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'configs': {key: value for key, value in self.configs.items() if key in configs},
+                       'videos': self.videos}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,88 @@
+import copy
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+class QuantizableSelfAttention(nn.Module):
+
+    def __init__(self, embed_dim: int, num_heads: int):
+        """Drop-in replacement of nn.MultiheadAttention for the self-attention of
+        ResidualAttentionBlock, with the input and output projections as plain nn.Linear
+        layers so they can be dynamically quantized (nn.MultiheadAttention keeps the input
+        projection as a bare parameter and its output projection is excluded from quantization).
+
+        Parameters
+        ----------
+        embed_dim : int
+            The (token) embedding dimension.
+        num_heads : int
+            The number of attention heads.
+        """
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_dim = embed_dim // num_heads
+        self.in_proj = nn.Linear(embed_dim, 3 * embed_dim)
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+
+    @classmethod
+    def from_multihead_attention(cls, attn: nn.MultiheadAttention) -> 'QuantizableSelfAttention':
+        module = cls(attn.embed_dim, attn.num_heads)
+        with torch.no_grad():
+            module.in_proj.weight.copy_(attn.in_proj_weight)
+            module.in_proj.bias.copy_(attn.in_proj_bias)
+            module.out_proj.weight.copy_(attn.out_proj.weight)
+            module.out_proj.bias.copy_(attn.out_proj.bias)
+        return module
+
+    def forward(self, query, key, value, need_weights=True, attn_mask=None, average_attn_weights=True):
+        # Same signature and outputs as nn.MultiheadAttention, for self-attention (query is key is value)
+        # query => [L, N, E]
+        L, N, E = query.shape
+        q, k, v = self.in_proj(query).chunk(3, dim=-1)
+
+        # [L, N, E] -> [N, heads, L, head_dim]
+        q, k, v = (t.reshape(L, N, self.num_heads, self.head_dim).permute(1, 2, 0, 3) for t in (q, k, v))
+
+        if need_weights:
+            scores = (q @ k.transpose(-2, -1)) * self.head_dim ** -0.5
+            if attn_mask is not None:
+                scores = scores + attn_mask
+            weights = scores.softmax(dim=-1)  # [N, heads, L, S]
+            x = weights @ v
+            if average_attn_weights:
+                weights = weights.mean(dim=1)
+        else:
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+            weights = None
+
+        # [N, heads, L, head_dim] -> [L, N, E]
+        x = x.permute(2, 0, 1, 3).reshape(L, N, E)
+        return self.out_proj(x), weights
+
+def quantize_dynamic_int8(model: nn.Module, inplace: bool = False) -> nn.Module:
+    """Returns a CLIP/VCLIP model where the nn.Linear layers of every ResidualAttentionBlock
+    (the attention projections and the MLP) are dynamically quantized to int8. Weights are stored
+    in int8 and activations are quantized on the fly, so it only runs on CPU.
+
+    Parameters
+    ----------
+    model : nn.Module
+        The fp32 model.
+    inplace : bool, optional
+        Whether to quantize the model itself instead of a copy. By default, False
+
+    Returns
+    -------
+    nn.Module
+        The quantized model, on CPU.
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model = model.float().cpu().eval()
+    for transformer in [model.transformer, model.visual.transformer]:
+        for block in transformer.resblocks:
+            block.attn = QuantizableSelfAttention.from_multihead_attention(block.attn)
+        torch.ao.quantization.quantize_dynamic(transformer, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
@@ -0,0 +1,231 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import get_config
+from encoders import EmbeddingModel, EncoderBuilder
+
+class EncoderRegistry:
+
+    def __init__(self, memory_budget: int = 0, builder: EncoderBuilder = None, build_kwargs: dict = None):
+        """Process-wide store of resident encoders. Each encoder is built once and the
+        same instance is handed to every request. When the encoders take more memory
+        than the budget, the least recently used ones are unloaded.
+
+        Code that runs an encoder holds a lease on it (see lease), so it is never unloaded
+        in the middle of a forward pass: leased encoders are skipped by the evictions, and
+        one unloaded explicitly is only released when its last lease ends.
+
+        Parameters
+        ----------
+        memory_budget : int, optional
+            Maximum memory (in bytes) taken by the resident encoders. By default, 0 (no limit)
+        builder : EncoderBuilder, optional
+            The builder used to instantiate the encoders. By default, a new EncoderBuilder
+        build_kwargs : dict, optional
+            Keyword arguments passed to every encoder (e.g. device). By default, None
+        """
+        self.memory_budget = memory_budget
+        self.builder = builder or EncoderBuilder()
+        self.build_kwargs = build_kwargs or {}
+
+        # Resident encoders, ordered from least to most recently used
+        self._encoders: OrderedDict[str, EmbeddingModel] = OrderedDict()
+        self._footprints: dict[str, int] = {}
+        # Number of leases on each encoder (by object, as an unloaded encoder may be built again)
+        self._leases: dict[int, int] = {}
+        # Encoders removed by unload while leased, unloaded on their last release
+        self._retired: dict[int, EmbeddingModel] = {}
+
+        self._lock = threading.Lock()
+        # One lock per encoder, so building one encoder does not block requests to the others
+        self._build_locks: dict[str, threading.Lock] = {}
+
+    def get(self, encoder_name: str) -> EmbeddingModel:
+        """Returns the resident encoder with the specified name, building it if it is not loaded.
+
+        Parameters
+        ----------
+        encoder_name : str
+            The name of the encoder.
+
+        Returns
+        -------
+        EmbeddingModel
+            The encoder's object.
+
+        Raises
+        ------
+        TypeError
+            If the specified encoder is not implemented.
+        MemoryError
+            If CUDA is out of memory.
+        """
+        with self._lock:
+            model = self._touch(encoder_name)
+            if model is not None:
+                return model
+            build_lock = self._build_locks.setdefault(encoder_name, threading.Lock())
+
+        with build_lock:
+            # Another request may have built it while waiting for the lock
+            with self._lock:
+                model = self._touch(encoder_name)
+                if model is not None:
+                    return model
+
+            print(f'Loading encoder: {encoder_name}')
+            model = self.builder.build(encoder_name, **self.build_kwargs)
+
+            with self._lock:
+                self._encoders[encoder_name] = model
+                self._footprints[encoder_name] = model.memory_footprint()
+                self._evict(keep=encoder_name)
+
+        return model
+
+    @contextmanager
+    def lease(self, encoder_name: str):
+        """Context manager that holds the encoder with the specified name (see get), so it is
+        not unloaded until the block exits. The evictions that could not unload it run then.
+
+        Parameters
+        ----------
+        encoder_name : str
+            The name of the encoder.
+
+        Yields
+        ------
+        EmbeddingModel
+            The encoder's object.
+
+        Raises
+        ------
+        TypeError
+            If the specified encoder is not implemented.
+        MemoryError
+            If CUDA is out of memory.
+        """
+        model = self.acquire(encoder_name)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def acquire(self, encoder_name: str) -> EmbeddingModel:
+        """Returns the encoder with the specified name (see get), leased until release is called.
+        """
+        while True:
+            model = self.get(encoder_name)
+            with self._lock:
+                # It may have been evicted between get and the lease
+                if self._encoders.get(encoder_name) is model:
+                    self._leases[id(model)] = self._leases.get(id(model), 0) + 1
+                    return model
+
+    def release(self, model: EmbeddingModel):
+        """Ends a lease taken by acquire.
+        """
+        with self._lock:
+            count = self._leases.pop(id(model)) - 1
+            if count:
+                self._leases[id(model)] = count
+                return
+            retired = self._retired.pop(id(model), None)
+            if retired is None:
+                # Evictions skipped while it was leased
+                self._evict(keep=None)
+        if retired is not None:
+            retired.unload()
+
+    def preload(self, encoder_names: list):
+        """Builds the specified encoders in advance.
+
+        Parameters
+        ----------
+        encoder_names : list
+            The names of the encoders.
+        """
+        for encoder_name in encoder_names:
+            self.get(encoder_name)
+
+    def unload(self, encoder_name: str):
+        """Unloads the specified encoder, if it is resident.
+
+        Parameters
+        ----------
+        encoder_name : str
+            The name of the encoder.
+        """
+        with self._lock:
+            model = self._encoders.pop(encoder_name, None)
+            self._footprints.pop(encoder_name, None)
+            if model is not None and id(model) in self._leases:
+                # Unloaded when its last lease ends
+                self._retired[id(model)] = model
+                return
+        if model is not None:
+            model.unload()
+
+    def memory_usage(self) -> int:
+        """Returns the memory (in bytes) taken by all the resident encoders.
+        """
+        with self._lock:
+            return sum(self._footprints.values())
+
+    def stats(self) -> dict:
+        """Returns the memory taken by each resident encoder, from least to most recently used.
+
+        Returns
+        -------
+        dict
+            The stats as a dictionary.
+        """
+        with self._lock:
+            return {
+                'memory_budget': self.memory_budget,
+                'memory_usage': sum(self._footprints.values()),
+                'encoders': {name: self._footprints[name] for name in self._encoders}
+            }
+
+    def _touch(self, encoder_name: str) -> EmbeddingModel:
+        # Marks the encoder as the most recently used. Must be called with the lock held
+        model = self._encoders.get(encoder_name)
+        if model is not None:
+            self._encoders.move_to_end(encoder_name)
+        return model
+
+    def _evict(self, keep: str):
+        # Unloads least recently used encoders until the budget is met, except the leased ones,
+        # which are left to their last release. Must be called with the lock held
+        if not self.memory_budget:
+            return
+        while sum(self._footprints.values()) > self.memory_budget:
+            victim = next((name for name, model in self._encoders.items()
+                           if name != keep and id(model) not in self._leases), None)
+            if victim is None:
+                break
+            print(f'Unloading encoder: {victim}')
+            self._footprints.pop(victim)
+            self._encoders.pop(victim).unload()
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> EncoderRegistry:
+    """Returns the process-wide encoder registry, configured through config.get_config().
+
+    Returns
+    -------
+    EncoderRegistry
+        The registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            cfg = get_config()
+            build_kwargs = {'device': cfg.ENCODER.DEVICE or None, 'bf16': cfg.ENCODER.BF16,
+                            'text_bucket_size': cfg.ENCODER.TEXT_BUCKET_SIZE}
+            _registry = EncoderRegistry(memory_budget=cfg.REGISTRY.MEMORY_BUDGET_MB * 1024 ** 2,
+                                        build_kwargs=build_kwargs)
+        return _registry
@@ -0,0 +1,333 @@
+from typing import NamedTuple
+
+import numpy as np
+
+class Event(NamedTuple):
+    # An event (or window) of a video: its span (first and last frame, both included) and centroid embedding
+    start_frame: int
+    end_frame: int
+    n_frames: int
+    centroid: np.ndarray
+
+class EventSegmenter:
+
+    def __init__(self, threshold: float = 0.15, min_frames: int = 1, max_frames: int = 0):
+        """Streaming segmentation of a video into events, from the embeddings of its frames. A new
+        event starts wherever the cosine distance between consecutive frame embeddings exceeds the
+        threshold. Each event is summarized by the normalized mean of its frames' embeddings.
+
+        Frames are pushed in batches, in order, and only the running sum of the current event is
+        kept between batches, so the memory does not depend on the length of the video.
+
+        Parameters
+        ----------
+        threshold : float, optional
+            Cosine distance (1 - cosine similarity) between consecutive frames above which a new event
+            starts. By default, 0.15
+        min_frames : int, optional
+            Minimum number of frames of an event. Boundaries closer than that to the previous one are
+            ignored. By default, 1
+        max_frames : int, optional
+            Maximum number of frames of an event, so static scenes are still split. By default, 0 (no limit)
+        """
+        self.threshold = threshold
+        self.min_frames = max(1, min_frames)
+        self.max_frames = max_frames
+
+        # Current event
+        self._last = None  # Embedding of the last frame pushed
+        self._start_frame = None
+        self._end_frame = None
+        self._sum = None
+        self._count = 0
+
+    def push(self, frame_n: np.ndarray, embeddings: np.ndarray) -> list:
+        """Adds the next frames of the video.
+
+        Parameters
+        ----------
+        frame_n : np.ndarray
+            The frame numbers, in increasing order, shape = [frames].
+        embeddings : np.ndarray
+            Their embeddings, shape = [frames, embedding size].
+
+        Returns
+        -------
+        list
+            The events completed by these frames.
+        """
+        if len(frame_n) == 0:
+            return []
+        embs = np.asarray(embeddings, dtype=np.float32)
+        embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+
+        # Cosine distance of every frame to the previous one, all at once. The first frame is
+        # compared with the last one of the previous batch (there is no boundary before the first frame)
+        distances = np.empty(len(embs), dtype=np.float32)
+        distances[1:] = 1 - np.einsum('ij,ij->i', embs[1:], embs[:-1])
+        distances[0] = 1 - embs[0] @ self._last if self._last is not None else 0
+        self._last = embs[-1]
+
+        cuts = self._cuts(np.flatnonzero(distances > self.threshold), len(embs))
+
+        events = []
+        if len(cuts) and cuts[0] == 0:
+            # The event carried over from the previous batch ends right before this one
+            events.append(self._close())
+            cuts = cuts[1:]
+
+        # Sum of the embeddings of every segment between cuts, in one pass
+        starts = np.concatenate(([0], cuts)).astype(np.int64)
+        sums = np.add.reduceat(embs, starts, axis=0)
+        counts = np.diff(np.append(starts, len(embs)))
+        ends = np.append(starts[1:], len(embs)) - 1
+
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            if i > 0:
+                events.append(self._close())
+            if self._count == 0:
+                self._start_frame, self._sum = int(frame_n[start]), np.zeros_like(sums[i])
+            self._sum += sums[i]
+            self._count += int(counts[i])
+            self._end_frame = int(frame_n[end])
+        return events
+
+    def flush(self) -> list:
+        """Ends the video, returning its last event (if any frame was pushed since the previous one).
+        """
+        events = [self._close()] if self._count else []
+        self._last = None
+        return events
+
+    def _cuts(self, candidates: np.ndarray, length: int) -> np.ndarray:
+        # Positions (within the batch) where new events start, honouring min_frames and max_frames.
+        # Only loops over the boundaries, not over the frames
+        cuts = []
+        # Position where the current event started (negative if it started in a previous batch)
+        event_start = -self._count
+        candidates = iter(candidates.tolist())
+        candidate = next(candidates, None)
+        while True:
+            # Skip the boundaries too close to the start of the event
+            while candidate is not None and candidate - event_start < self.min_frames:
+                candidate = next(candidates, None)
+            forced = event_start + self.max_frames if self.max_frames else None
+            if forced is not None and forced < length and (candidate is None or forced < candidate):
+                cut = forced
+            elif candidate is not None:
+                cut = candidate
+            else:
+                break
+            cuts.append(cut)
+            event_start = cut
+        return np.array(cuts, dtype=np.int64)
+
+    def _close(self) -> Event:
+        centroid = self._sum / max(np.linalg.norm(self._sum), 1e-12)
+        event = Event(self._start_frame, self._end_frame, self._count, centroid.astype(np.float32))
+        self._sum, self._count = None, 0
+        return event
+
+class WindowPooler:
+
+    def __init__(self, window: int, stride: int = 1):
+        """Streaming sliding-window embeddings of a video, from the embeddings of its frames (each
+        frame is encoded once). Every window of `window` consecutive frames, one every `stride`
+        frames, is summarized by the normalized mean of its frames' normalized embeddings, computed
+        from cumulative sums over the frames, so every window costs the same whatever its size.
+
+        Frames are pushed in batches, in order, and only the frames that later windows still need
+        are kept between batches.
+
+        Parameters
+        ----------
+        window : int
+            Number of frames per window.
+        stride : int, optional
+            Number of frames between the starts of consecutive windows. By default, 1
+        """
+        self.window = window
+        self.stride = stride
+
+        self._frame_n = np.empty(0, dtype=np.int64)  # Frames kept for the next windows
+        self._embs = None
+        self._offset = 0  # Index (within the video) of the first kept frame
+        self._next = 0  # Index of the first frame of the next window
+        self._last_end = -1  # Index of the last frame of the last window
+
+    def push(self, frame_n: np.ndarray, embeddings: np.ndarray) -> list:
+        """Adds the next frames of the video.
+
+        Parameters
+        ----------
+        frame_n : np.ndarray
+            The frame numbers, in increasing order, shape = [frames].
+        embeddings : np.ndarray
+            Their embeddings, shape = [frames, embedding size].
+
+        Returns
+        -------
+        list
+            The windows completed by these frames, as Event (start_frame and end_frame included).
+        """
+        if len(frame_n) == 0:
+            return []
+        embs = np.asarray(embeddings, dtype=np.float32)
+        embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        self._frame_n = np.concatenate((self._frame_n, frame_n))
+        self._embs = embs if self._embs is None else np.concatenate((self._embs, embs))
+        total = self._offset + len(self._frame_n)
+
+        starts = np.arange(self._next, total - self.window + 1, self.stride)
+        windows = self._pool(starts)
+        if len(starts):
+            self._next = int(starts[-1]) + self.stride
+
+        # Keep the frames of the next windows, and the last ones for the final window of flush()
+        keep_from = max(self._offset, min(self._next, total - self.window))
+        self._frame_n, self._embs = self._frame_n[keep_from - self._offset:], self._embs[keep_from - self._offset:]
+        self._offset = keep_from
+        return windows
+
+    def flush(self) -> list:
+        """Ends the video. Its last frames are covered by one more window, ending at the last
+        frame, if no window did (shorter than the others if the video is).
+        """
+        total = self._offset + len(self._frame_n)
+        windows = []
+        if total and self._last_end < total - 1:
+            windows = self._pool(np.array([max(0, total - self.window)]))
+        self.__init__(self.window, self.stride)
+        return windows
+
+    def _pool(self, starts: np.ndarray) -> list:
+        # Pools the windows starting at these frames (indices within the video)
+        if not len(starts):
+            return []
+        # Cumulative sums (in float64, so they stay accurate) => sum of frames [a, b) = csum[b] - csum[a]
+        csum = np.zeros((len(self._embs) + 1, self._embs.shape[1]), dtype=np.float64)
+        csum[1:] = self._embs
+        # Adding whole rows is several times faster than np.cumsum along the first axis
+        for i in range(2, len(csum)):
+            csum[i] += csum[i - 1]
+        local_starts = starts - self._offset
+        local_ends = np.minimum(local_starts + self.window, len(self._embs))
+        pooled = csum[local_ends] - csum[local_starts]
+        pooled = (pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)).astype(np.float32)
+        self._last_end = self._offset + int(local_ends[-1]) - 1
+        return [Event(int(self._frame_n[a]), int(self._frame_n[b - 1]), int(b - a), centroid)
+                for a, b, centroid in zip(local_starts.tolist(), local_ends.tolist(), pooled)]
+
+def segment_events(frame_n: np.ndarray, embeddings: np.ndarray, batch_size: int = 4096, **kwargs) -> list:
+    """Segments a whole video into events (see EventSegmenter), pushing its frames in batches.
+
+    Parameters
+    ----------
+    frame_n : np.ndarray
+        The frame numbers, in increasing order, shape = [frames].
+    embeddings : np.ndarray
+        Their embeddings, shape = [frames, embedding size]. It may be a memory-mapped array.
+    batch_size : int, optional
+        Number of frames pushed at once. By default, 4096
+    **kwargs
+        Arguments of EventSegmenter.
+
+    Returns
+    -------
+    list
+        The events of the video.
+    """
+    segmenter = EventSegmenter(**kwargs)
+    events = []
+    for start in range(0, len(frame_n), batch_size):
+        events += segmenter.push(frame_n[start:start + batch_size], embeddings[start:start + batch_size])
+    return events + segmenter.flush()
+
+def window_embeddings(frame_n: np.ndarray, embeddings: np.ndarray, window: int, stride: int = 1,
+                      batch_size: int = 4096) -> list:
+    """Sliding-window embeddings of a whole video (see WindowPooler), pushing its frames in batches.
+
+    Parameters
+    ----------
+    frame_n : np.ndarray
+        The frame numbers, in increasing order, shape = [frames].
+    embeddings : np.ndarray
+        Their embeddings, shape = [frames, embedding size]. It may be a memory-mapped array.
+    window : int
+        Number of frames per window.
+    stride : int, optional
+        Number of frames between the starts of consecutive windows. By default, 1
+    batch_size : int, optional
+        Number of frames pushed at once. By default, 4096
+
+    Returns
+    -------
+    list
+        The windows of the video, as Event.
+    """
+    pooler = WindowPooler(window, stride)
+    windows = []
+    for start in range(0, len(frame_n), batch_size):
+        windows += pooler.push(frame_n[start:start + batch_size], embeddings[start:start + batch_size])
+    return windows + pooler.flush()
+
+def merge_frame_hits(video_id: np.ndarray, frame_n: np.ndarray, scores: np.ndarray, window: int = 75,
+                     k: int = 0) -> tuple:
+    """Merges the frame hits of a search into non-overlapping events, so adjacent frames of the same
+    incident are returned as a single clip instead of a clip each.
+
+    Each hit spans the frames around it, up to window frames away for the best hit and less for
+    the others, in proportion to how its score compares with the best and worst hits (the worst
+    hit only spans itself). Hits of the same video whose spans overlap form an event, which spans
+    the union of their spans and takes the score of its best hit.
+
+    Parameters
+    ----------
+    video_id : np.ndarray
+        The video of each hit, shape = [hits], int.
+    frame_n : np.ndarray
+        The frame of each hit, shape = [hits], int.
+    scores : np.ndarray
+        The similarity of each hit, shape = [hits].
+    window : int, optional
+        Frames before and after the best hit spanned by its event. By default, 75
+    k : int, optional
+        Number of events returned, the best ones. By default, 0 (all)
+
+    Returns
+    -------
+    tuple
+        The video, start_frame and end_frame (clamped at 0, both included), score and number of
+        hits of each event, best first, each of shape = [events].
+    """
+    video_id, frame_n = np.asarray(video_id, dtype=np.int64), np.asarray(frame_n, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty(0, dtype=np.float64), empty
+
+    # Margin of each hit, from 0 for the worst score to window for the best
+    low, high = scores.min(), scores.max()
+    weight = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    margin = np.rint(weight * window).astype(np.int64)
+    starts, ends = frame_n - margin, frame_n + margin
+
+    # Sorted by video and start, with the videos shifted apart so the running maximum of the ends
+    # never carries over from one video to the next
+    shift = (video_id - video_id.min()) * (int(ends.max() - starts.min()) + 2)
+    order = np.lexsort((starts, video_id))
+    starts, ends = (starts + shift)[order], (ends + shift)[order]
+    # A hit starts a new event if it starts after the end of every previous hit
+    reach = np.maximum.accumulate(ends)
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+
+    event_video = video_id[order][first]
+    event_start = np.maximum(starts[first] - shift[order][first], 0)
+    event_end = np.maximum.reduceat(ends, first) - shift[order][first]
+    event_score = np.maximum.reduceat(scores[order], first)
+    event_hits = np.diff(np.append(first, len(order)))
+
+    best = np.argsort(-event_score, kind='stable')[:k or None]
+    return event_video[best], event_start[best], event_end[best], event_score[best], event_hits[best]
@@ -0,0 +1,127 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+FLOAT32_MIMETYPE = 'application/x-float32'
+FLOAT16_MIMETYPE = 'application/x-float16'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+FRAMES_MIMETYPE = 'application/octet-stream'
+
+# Formats offered for single embedding responses, JSON first so it is the default
+EMBEDDING_MIMETYPES = [JSON_MIMETYPE, FLOAT32_MIMETYPE, FLOAT16_MIMETYPE] + ([MSGPACK_MIMETYPE] if msgpack else [])
+
+# Dtype of the embeddings in each binary format
+_BINARY_DTYPES = {
+    FLOAT32_MIMETYPE: 'float32',
+    FLOAT16_MIMETYPE: 'float16',
+    MSGPACK_MIMETYPE: 'float32'
+}
+
+# Header of each binary frame: index of the first row, number of rows and embedding dimension
+_FRAME_HEADER = struct.Struct('<III')
+
+def ndjson_chunk(start: int, embs: np.ndarray) -> bytes:
+    """Serializes a chunk of embeddings as a line of newline-delimited JSON.
+
+    Parameters
+    ----------
+    start : int
+        Index of the chunk's first item in the request.
+    embs : np.ndarray
+        The embeddings, one row per item.
+
+    Returns
+    -------
+    bytes
+        The JSON line, terminated by a newline.
+    """
+    line = json.dumps({'index': start, 'embeddings': embs.tolist()})
+    return (line + '\n').encode('utf-8')
+
+def ndjson_error(start: int, message: str) -> bytes:
+    """Serializes an error that stopped a stream as a line of newline-delimited JSON.
+
+    Parameters
+    ----------
+    start : int
+        Index of the first item that could not be encoded.
+    message : str
+        The error message.
+
+    Returns
+    -------
+    bytes
+        The JSON line, terminated by a newline.
+    """
+    line = json.dumps({'index': start, 'error': message})
+    return (line + '\n').encode('utf-8')
+
+def binary_frame(start: int, embs: np.ndarray) -> bytes:
+    """Serializes a chunk of embeddings as a binary frame: a little-endian header with the index
+    of the first row, the number of rows and the dimension (3 x uint32), followed by the rows as
+    little-endian float32.
+
+    Parameters
+    ----------
+    start : int
+        Index of the chunk's first item in the request.
+    embs : np.ndarray
+        The embeddings, one row per item.
+
+    Returns
+    -------
+    bytes
+        The frame.
+    """
+    rows, dim = embs.shape
+    return _FRAME_HEADER.pack(start, rows, dim) + np.ascontiguousarray(embs, dtype='<f4').tobytes()
+
+def serialize_embeddings(embs: np.ndarray, mimetype: str) -> tuple:
+    """Serializes a matrix of embeddings in the requested format. Binary formats carry the
+    number of rows, the dimension and the dtype in the headers.
+
+    - application/json: list of lists of floats.
+    - application/x-float32: raw little-endian float32, row-major.
+    - application/x-float16: raw little-endian float16, row-major.
+    - application/msgpack: map with 'dtype', 'shape' and 'data' (raw little-endian float32).
+
+    Parameters
+    ----------
+    embs : np.ndarray
+        The embeddings, one row per item.
+    mimetype : str
+        One of EMBEDDING_MIMETYPES.
+
+    Returns
+    -------
+    tuple
+        The body and the headers of the response.
+    """
+    if mimetype == JSON_MIMETYPE:
+        return json.dumps(embs.tolist()), {'Content-Type': mimetype}
+
+    if mimetype not in _BINARY_DTYPES:
+        raise ValueError(f'Format {mimetype} not supported. Please, use one of the following: {EMBEDDING_MIMETYPES}.')
+
+    rows, dim = embs.shape
+    dtype = _BINARY_DTYPES[mimetype]
+    data = np.ascontiguousarray(embs, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    if mimetype == MSGPACK_MIMETYPE:
+        data = msgpack.packb({'dtype': dtype, 'shape': [rows, dim], 'data': data})
+
+    headers = {
+        'Content-Type': mimetype,
+        'X-Embedding-Count': str(rows),
+        'X-Embedding-Dim': str(dim),
+        'X-Embedding-Dtype': dtype
+    }
+    return data, headers
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from batching import BatchScheduler
+from registry import EncoderRegistry
+
+class StubEncoder:
+    # Encoder whose forward pass blocks until it is allowed to finish, and fails once unloaded
+    def __init__(self, name, footprint):
+        self.name = name
+        self.footprint = footprint
+        self.model = object()
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+
+    def memory_footprint(self):
+        return self.footprint
+
+    def encode_text(self, texts):
+        self.started.set()
+        self.proceed.wait(5)
+        if self.model is None:
+            raise AttributeError("'NoneType' object has no attribute 'encode_text'")
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+    def unload(self):
+        self.model = None
+
+class StubBuilder:
+    def __init__(self):
+        self.built = []
+
+    def build(self, encoder_name, **kwargs):
+        self.built.append(StubEncoder(encoder_name, footprint=10))
+        return self.built[-1]
+
+def test_eviction_waits_for_lease():
+    registry = EncoderRegistry(memory_budget=15, builder=StubBuilder())
+    with registry.lease('vclip') as model:
+        registry.get('vclip-int8')
+        # Over budget, but the leased encoder is still resident
+        assert model.model is not None
+        model.proceed.set()
+        assert model.encode_text(['a']).shape == (1, 4)
+    # Evicted on release
+    assert model.model is None
+    assert list(registry.stats()['encoders']) == ['vclip-int8']
+
+def test_eviction_during_inflight_encode():
+    registry = EncoderRegistry(memory_budget=15, builder=StubBuilder())
+    scheduler = BatchScheduler(registry, max_wait=0)
+    model = registry.get('vclip')
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(embs=scheduler.encode_text('vclip', ['a', 'b'])))
+    worker.start()
+    assert model.started.wait(5)
+
+    # Building another encoder goes over budget while vclip is in its forward pass
+    registry.get('vclip-int8')
+    assert model.model is not None
+    model.proceed.set()
+    worker.join(5)
+
+    assert result['embs'].shape == (2, 4)
+    assert model.model is None
+    assert registry.memory_usage() == 10
+
+def test_unload_while_leased():
+    registry = EncoderRegistry(builder=StubBuilder())
+    with registry.lease('clip') as model:
+        registry.unload('clip')
+        assert model.model is not None
+        # A new request builds it again
+        assert registry.get('clip') is not model
+    assert model.model is None
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from vector_index import IndexRegistry, build_exact_index
+
+def write_frames(directory, video, frame_n, embeddings):
+    # Same files as ingestion.py for the frames of a video
+    np.savez(os.path.join(directory, f'{video}.npz'), video=np.array(video), frame_n=np.asarray(frame_n, dtype=np.int32),
+             embeddings=np.asarray(embeddings, dtype=np.float32))
+
+def test_search_events_refetches_when_top_hits_form_one_event(tmp_path):
+    rng = np.random.default_rng(0)
+    query = np.zeros(16, dtype=np.float32)
+    query[0] = 1
+    ingestion_dir, index_dir = tmp_path / 'ingestion', tmp_path / 'indexes'
+    os.makedirs(ingestion_dir)
+
+    # 300 consecutive frames, all the best hits: the first hits fetched form a single event
+    write_frames(ingestion_dir, 'incident', np.arange(300), np.tile(query, (300, 1)))
+    # Frames of other videos, each one far from the others
+    for i in range(5):
+        frames = np.tile(query, (4, 1)) + 0.5 * rng.standard_normal((4, 16))
+        write_frames(ingestion_dir, f'other{i}', np.arange(4) * 1000, frames)
+    build_exact_index(str(ingestion_dir), str(index_dir / 'frames'))
+
+    events = IndexRegistry(str(index_dir)).search_events('frames', query, k=5, window=75, overfetch=10)[0]
+
+    assert len(events) == 5
+    assert events[0]['video'] == 'incident'
+    assert events[0]['hits'] == 300
+    assert [event['score'] for event in events] == sorted((event['score'] for event in events), reverse=True)
+
+def test_search_events_stops_when_index_is_exhausted(tmp_path):
+    query = np.ones(8, dtype=np.float32)
+    ingestion_dir, index_dir = tmp_path / 'ingestion', tmp_path / 'indexes'
+    os.makedirs(ingestion_dir)
+    write_frames(ingestion_dir, 'only', np.arange(50), np.tile(query, (50, 1)))
+    build_exact_index(str(ingestion_dir), str(index_dir / 'frames'))
+
+    events = IndexRegistry(str(index_dir)).search_events('frames', query, k=3, overfetch=1)[0]
+
+    assert len(events) == 1
+    assert events[0]['hits'] == 50
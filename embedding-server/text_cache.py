@@ -0,0 +1,207 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from clip.simple_tokenizer import basic_clean, whitespace_clean
+
+def normalize_text(text: str) -> str:
+    """Normalizes a text the same way SimpleTokenizer.encode does before tokenizing it, so
+    texts that only differ in spacing, case or escaping share a cache entry.
+    """
+    return whitespace_clean(basic_clean(text)).lower()
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class _Store:
+
+    def __init__(self, capacity: int, dim: int, directory: str = None):
+        """Fixed-size table of embeddings of one encoder and model version, with its LRU index.
+        If a directory is given, the table is a memory-mapped file and the index is saved next
+        to it, so the entries survive restarts.
+        """
+        self.capacity = capacity
+        self.dim = dim
+        self.directory = directory
+
+        # Normalized text -> row of the table, ordered from least to most recently used
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.free = list(range(capacity - 1, -1, -1))
+        self.dirty = 0
+
+        if directory is None:
+            self.table = np.zeros((capacity, dim), dtype=np.float32)
+            self.key_hashes = np.zeros(capacity, dtype=np.uint64)
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        table_path = os.path.join(directory, 'embeddings.f32')
+        hashes_path = os.path.join(directory, 'keys.u64')
+        index_path = os.path.join(directory, 'index.json')
+
+        meta = None
+        if all(os.path.isfile(path) for path in [index_path, table_path, hashes_path]):
+            with open(index_path) as f:
+                meta = json.load(f)
+            if meta['capacity'] != capacity or meta['dim'] != dim:
+                print(f'Text cache at {directory} has a different shape, discarding it')
+                meta = None
+
+        mode = 'r+' if meta else 'w+'
+        self.table = np.memmap(table_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        # Hash of the key stored in each row. Rows rewritten after the index was last saved
+        # no longer match their entry, so those entries are dropped
+        self.key_hashes = np.memmap(hashes_path, dtype=np.uint64, mode=mode, shape=(capacity,))
+        if meta:
+            self.index = OrderedDict((key, slot) for key, slot in meta['entries'] if self.key_hashes[slot] == _key_hash(key))
+            used = set(self.index.values())
+            self.free = [slot for slot in range(capacity - 1, -1, -1) if slot not in used]
+
+    def get(self, key: str) -> np.ndarray:
+        slot = self.index.get(key)
+        if slot is None:
+            return None
+        self.index.move_to_end(key)
+        return np.array(self.table[slot])
+
+    def put(self, key: str, emb: np.ndarray):
+        slot = self.index.pop(key, None)
+        if slot is None:
+            # Reuse the row of the least recently used entry when full
+            slot = self.free.pop() if self.free else self.index.popitem(last=False)[1]
+        self.table[slot] = emb
+        self.key_hashes[slot] = _key_hash(key)
+        self.index[key] = slot
+        self.dirty += 1
+
+    def flush(self):
+        if self.directory is None or not self.dirty:
+            return
+        self.table.flush()
+        self.key_hashes.flush()
+        index_path = os.path.join(self.directory, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'capacity': self.capacity, 'dim': self.dim, 'entries': list(self.index.items())}, f)
+        os.replace(index_path + '.tmp', index_path)
+        self.dirty = 0
+
+class TextEmbeddingCache:
+
+    def __init__(self, capacity: int = 10000, directory: str = None, flush_every: int = 100):
+        """LRU cache of text embeddings keyed on (encoder, model version, normalized text).
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Maximum number of embeddings kept per encoder and model version. By default, 10000
+        directory : str, optional
+            Directory where the cache is persisted as memory-mapped files. By default, None (not persisted)
+        flush_every : int, optional
+            Number of new entries after which the cache is written to disk. By default, 100
+        """
+        self.capacity = capacity
+        self.directory = directory
+        self.flush_every = flush_every
+
+        self.hits = 0
+        self.misses = 0
+
+        self._stores: dict[tuple, _Store] = {}
+        self._lock = threading.Lock()
+
+        if directory is not None:
+            atexit.register(self.flush)
+
+    def encode(self, encoder_name: str, model_version: str, texts: list, encode_fn: Callable[[list], np.ndarray]) -> np.ndarray:
+        """Returns the embeddings of the texts, encoding only the ones that are not cached.
+
+        Parameters
+        ----------
+        encoder_name : str
+            The name of the encoder.
+        model_version : str
+            The version of the encoder's weights.
+        texts : list
+            The texts.
+        encode_fn : Callable[[list], np.ndarray]
+            Function that encodes a list of texts into a matrix with one row per text.
+
+        Returns
+        -------
+        np.ndarray
+            The embeddings, one row per text.
+        """
+        keys = [normalize_text(text) for text in texts]
+        store_key = (encoder_name, model_version)
+
+        with self._lock:
+            store = self._store(store_key)
+            cached = [store.get(key) if store else None for key in keys]
+
+        missing = [i for i, emb in enumerate(cached) if emb is None]
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            embs = encode_fn([texts[i] for i in missing])
+            with self._lock:
+                store = self._store(store_key, embs.shape[1])
+                for i, emb in zip(missing, embs):
+                    store.put(keys[i], emb)
+                    cached[i] = emb
+                if store.dirty >= self.flush_every:
+                    store.flush()
+
+        return np.stack(cached)
+
+    def flush(self):
+        """Writes the cache to disk, if it is persisted.
+        """
+        with self._lock:
+            for store in self._stores.values():
+                store.flush()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the number of entries per encoder.
+
+        Returns
+        -------
+        dict
+            The stats as a dictionary.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'capacity': self.capacity,
+                'entries': {f'{name}@{version}': len(store.index) for (name, version), store in self._stores.items()}
+            }
+
+    def _store(self, store_key: tuple, dim: int = None) -> _Store:
+        # Returns the store of the encoder and model version, opening it from disk if it was
+        # persisted. Without a dimension, a store that does not exist yet is not created.
+        # Must be called with the lock held
+        if store_key in self._stores:
+            return self._stores[store_key]
+
+        directory = None
+        if self.directory is not None:
+            encoder_name, model_version = store_key
+            version_hash = hashlib.sha1(model_version.encode('utf-8')).hexdigest()[:12]
+            directory = os.path.join(self.directory, f'{encoder_name}-{version_hash}')
+            index_path = os.path.join(directory, 'index.json')
+            if dim is None and os.path.isfile(index_path):
+                with open(index_path) as f:
+                    dim = json.load(f)['dim']
+
+        if dim is None:
+            return None
+        self._stores[store_key] = _Store(self.capacity, dim, directory)
+        return self._stores[store_key]
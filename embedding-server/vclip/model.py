@@ -1,9 +1,9 @@
 from collections import OrderedDict
-from typing import Tuple, Union
+from typing import Sequence, Tuple, Union
 
 import numpy as np
 import torch
-# import torch.nn.functional as F
+import torch.nn.functional as F
 from torch import nn
 
 
@@ -34,19 +34,55 @@ class ResidualAttentionBlock(nn.Module):
         ]))
         self.ln_2 = LayerNorm(d_model)
         self.attn_mask = attn_mask
-
-    def attention(self, x: torch.Tensor):
-        self.attn_mask = self.attn_mask.to(dtype=x.dtype, device=x.device) if self.attn_mask is not None else None
-        # Yup, pytorch's forward for MultideadAttention expects arguments (query, key, value, ...)
-        # query => [L, N, E]; key and value => [S, N, E]
-        # L: target dim; S: source dim; E: (token) embedding dim; N: batch
-        return self.attn(x, x, x, need_weights=True, attn_mask=self.attn_mask, average_attn_weights=False)
-
-    def forward(self, x: torch.Tensor):
-        attention_res = self.attention(self.ln_1(x))
+        # The mask cast to each (dtype, device) it has been used with, so it is not cast on every call
+        self._attn_masks = {}
+
+    def attention_mask(self, length: int, dtype: torch.dtype, device: torch.device):
+        if self.attn_mask is None:
+            return None
+        if (dtype, device) not in self._attn_masks:
+            self._attn_masks[dtype, device] = self.attn_mask.to(dtype=dtype, device=device)
+        # The text transformer may run on fewer tokens than the context length, so the mask is sliced to match
+        return self._attn_masks[dtype, device][:length, :length]
+
+    def attention(self, x: torch.Tensor, need_weights: bool = False):
+        # Quantized models swap self.attn for a module with the same interface
+        if not isinstance(self.attn, nn.MultiheadAttention):
+            # Yup, pytorch's forward for MultideadAttention expects arguments (query, key, value, ...)
+            # query => [L, N, E]; key and value => [S, N, E]
+            # L: target dim; S: source dim; E: (token) embedding dim; N: batch
+            return self.attn(x, x, x, need_weights=need_weights, attn_mask=self.attention_mask(x.shape[0], x.dtype, x.device),
+                             average_attn_weights=False)
+
+        # Same as self.attn (with its weights), without going through nn.MultiheadAttention
+        L, N, E = x.shape
+        heads = self.attn.num_heads
+
+        q, k, v = F.linear(x, self.attn.in_proj_weight, self.attn.in_proj_bias).chunk(3, dim=-1)
+        # [L, N, E] -> [N, heads, L, E/heads]
+        q, k, v = (t.reshape(L, N, heads, E // heads).permute(1, 2, 0, 3) for t in (q, k, v))
+
+        # Under autocast the projections may have a lower precision than x, and the mask must match them
+        attn_mask = self.attention_mask(L, q.dtype, q.device)
+        if need_weights:
+            # The output is computed from the returned weights, so gradients can flow through them (e.g. for explanations)
+            scores = (q @ k.transpose(-2, -1)) * (E // heads) ** -0.5
+            weights = (scores if attn_mask is None else scores + attn_mask).softmax(dim=-1)  # [N, heads, L, S]
+            x = weights @ v
+        else:
+            # The fused kernel never materializes the attention weights, so it takes less time and memory
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+            weights = None
+
+        # [N, heads, L, E/heads] -> [L, N, E]
+        x = x.permute(2, 0, 1, 3).reshape(L, N, E)
+        return self.attn.out_proj(x), weights
+
+    def forward(self, x: torch.Tensor, need_weights: bool = False):
+        attention_res = self.attention(self.ln_1(x), need_weights)
         x, weights = x + attention_res[0], attention_res[1]
         # x => attn_output => shape = [L, N, E]
-        # weights => attn_output_weights => shape = [layers, N, heads, L, S]
+        # weights => attn_output_weights => shape = [N, heads, L, S], None unless need_weights
         x = x + self.mlp(self.ln_2(x))
         return x, weights
 
@@ -58,15 +94,19 @@ class Transformer(nn.Module):
         self.layers = layers
         self.resblocks = nn.Sequential(*[ResidualAttentionBlock(width, heads, attn_mask) for _ in range(layers)])
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, need_weights: Union[bool, Sequence[int]] = False):
+        # need_weights may also be the indices of the layers whose weights are needed
+        layers = range(self.layers) if need_weights is True else (need_weights or ())
         weights_all_blocks = []
 
         # Go through all the blocks (layers)
-        for block in self.resblocks:
-            x, weight = block(x)
-            weights_all_blocks.append(weight)
+        for i, block in enumerate(self.resblocks):
+            x, weight = block(x, i in layers)
+            if weight is not None:
+                weights_all_blocks.append(weight)
 
-        return x, torch.stack(weights_all_blocks)
+        # The attention weights are only computed (and stacked) for the requested layers
+        return x, torch.stack(weights_all_blocks) if weights_all_blocks else None
 
 
 class VisionTransformer(nn.Module):
@@ -88,7 +128,7 @@ class VisionTransformer(nn.Module):
 
         self.get_cls = False
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, need_weights: Union[bool, Sequence[int]] = False):
         # The conv1 uses kernel_size=patch_size, stride=patch_size, therefore stride==kernel_size and
         # that will do the equivalent of chopping the image into patches and converting those into "tokens"
         # with a depth (number of output layers / channels in the conv1) equals to "width".
@@ -116,9 +156,9 @@ class VisionTransformer(nn.Module):
         # Pytorch transformer stuff expects the batch as the second dimension
         x = x.permute(1, 0, 2)  # shape: [N, L, E] -> [L, N, E]
 
-        x, weights = self.transformer(x)
+        x, weights = self.transformer(x, need_weights)
         # x => attn_output => shape = [L, N, E]
-        # weights => attn_output_weights => shape = [layers, N, heads, L, S]
+        # weights => attn_output_weights => shape = [layers, N, heads, L, S] for the layers in need_weights, None if none
         # N: batch
         # L = S: 1 + grid**2
         # E: width or (token) embedding dim
@@ -238,27 +278,34 @@ class CLIP(nn.Module):
     def dtype(self):
         return self.visual.conv1.weight.dtype
 
-    def encode_image(self, image, get_cls=False):
+    def encode_image(self, image, get_cls=False, need_weights=False):
         self.visual.get_cls = get_cls
-        return self.visual(image.type(self.dtype))
+        return self.visual(image.type(self.dtype), need_weights)
 
-    def encode_text(self, text):
+    def encode_text(self, text, need_weights=False):
         # Here text is the input "tokenized" text (clip.tokenize). 
         # It has shape = [batch, context_length]
-        
+
+        # The eot_token is the token with the highest value (index) in each sequence. As the attention mask is causal,
+        # its embedding does not depend on the padding after it, so the batch is cut right after the furthest eot token.
+        # From here on, context_length is that trimmed length.
+        eot = text.argmax(dim=-1)
+        n_ctx = int(eot.max()) + 1
+        text = text[:, :n_ctx]
+
         x = self.token_embedding(text).type(self.dtype)  # [batch_size, context_length, transformer_width]
                                                          # transformer_width => d_model => token embeddings
                                                          # context_length => sentence_length
 
         # A clear difference between this and the vision one is the lack of a CLS token.
-        x = x + self.positional_embedding.type(self.dtype)
+        x = x + self.positional_embedding[:n_ctx].type(self.dtype)
 
         # Pytorch transformer stuff expects the batch as the second dimension
         x = x.permute(1, 0, 2)  # shape: [N, L, E] -> [L, N, E]
 
-        x, weights = self.transformer(x)
+        x, weights = self.transformer(x, need_weights)
         # x => attn_output => shape = [L, N, E]
-        # weights => attn_output_weights => shape = [layers, N, heads, L, S]
+        # weights => attn_output_weights => shape = [layers, N, heads, L, S] for the layers in need_weights, None if none
         # N: batch
         # L = S: context_length
         # E: transformer_width or (token) embedding_dim
@@ -272,7 +319,7 @@ class CLIP(nn.Module):
         # Take features ONLY from the eot embedding. The eot_token is the token with the highest value (index) in each sequence.
         # Although we are only using that token, it went through all the transformer layers,
         # so it carries lots if information (but I don't know why they chose exactly the last one)
-        x = x[torch.arange(x.shape[0]), text.argmax(dim=-1), :] @ self.text_projection  # I added the ":" for clarity...
+        x = x[torch.arange(x.shape[0]), eot, :] @ self.text_projection  # I added the ":" for clarity...
         # The operation is [batch_size, transformer_width] x [transformer_width, output_embed_dim] = [batch_size, output_embed_dim]
 
         return x, weights
@@ -5,13 +5,14 @@ import warnings
 from packaging import version
 from typing import Union, List
 
+import numpy as np
 import torch
 from PIL import Image
 from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor, Normalize
 from tqdm import tqdm
 
 from .model import build_model
-from .simple_tokenizer import SimpleTokenizer as _Tokenizer
+from .simple_tokenizer import get_tokenizer
 
 try:
     from torchvision.transforms import InterpolationMode
@@ -24,8 +25,7 @@ if version.parse(torch.__version__) < version.parse("1.7.1"):
     warnings.warn("PyTorch version 1.7.1 or higher is recommended")
 
 
-__all__ = ["available_models", "load", "tokenize"]
-_tokenizer = _Tokenizer()
+__all__ = ["available_models", "load", "tokenize", "weights_sha256"]
 
 _MODELS = {
     "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
@@ -40,6 +40,41 @@ _MODELS = {
 }
 
 
+def _sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _verified_marker(path: str, sha256: str) -> str:
+    # The marker is only valid while the file keeps the size and mtime it had when it was verified
+    stat = os.stat(path)
+    return f"{sha256} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def _mark_verified(path: str, sha256: str):
+    try:
+        with open(path + ".verified", "w") as f:
+            f.write(_verified_marker(path, sha256))
+    except OSError as e:
+        warnings.warn(f"Could not save the verification marker of {path}: {e}")
+
+
+def _is_verified(path: str, expected_sha256: str) -> bool:
+    marker_path = path + ".verified"
+    if os.path.isfile(marker_path):
+        with open(marker_path) as f:
+            if f.read() == _verified_marker(path, expected_sha256):
+                return True
+
+    if _sha256(path) != expected_sha256:
+        return False
+    _mark_verified(path, expected_sha256)
+    return True
+
+
 def _download(url: str, root: str):
     os.makedirs(root, exist_ok=True)
     filename = os.path.basename(url)
@@ -51,27 +86,59 @@ def _download(url: str, root: str):
         raise RuntimeError(f"{download_target} exists and is not a regular file")
 
     if os.path.isfile(download_target):
-        if hashlib.sha256(open(download_target, "rb").read()).hexdigest() == expected_sha256:
+        if _is_verified(download_target, expected_sha256):
             return download_target
         else:
             warnings.warn(f"{download_target} exists, but the SHA256 checksum does not match; re-downloading the file")
 
+    # Hashed while it is written, so the file is not read again
+    sha256 = hashlib.sha256()
     with urllib.request.urlopen(url) as source, open(download_target, "wb") as output:
         with tqdm(total=int(source.info().get("Content-Length")), ncols=80, unit='iB', unit_scale=True, unit_divisor=1024) as loop:
             while True:
-                buffer = source.read(8192)
+                buffer = source.read(1 << 20)
                 if not buffer:
                     break
 
                 output.write(buffer)
+                sha256.update(buffer)
                 loop.update(len(buffer))
 
-    if hashlib.sha256(open(download_target, "rb").read()).hexdigest() != expected_sha256:
+    if sha256.hexdigest() != expected_sha256:
         raise RuntimeError("Model has been downloaded but the SHA256 checksum does not not match")
+    _mark_verified(download_target, expected_sha256)
 
     return download_target
 
 
+def _load_state_dict(model_path: str) -> dict:
+    """Load the state dict of a checkpoint, memory-mapped so tensors are paged in from disk on demand
+    and the checkpoint is never held in memory next to the model
+
+    JIT archives cannot be memory-mapped, so the first time their state dict is saved next to them
+    as a regular checkpoint, which later loads map instead.
+    """
+    converted_path = model_path + ".state_dict"
+    if os.path.isfile(converted_path) and os.path.getmtime(converted_path) >= os.path.getmtime(model_path):
+        return torch.load(converted_path, map_location="cpu", mmap=True, weights_only=True)
+
+    try:
+        state_dict = torch.jit.load(model_path, map_location="cpu").state_dict()
+    except RuntimeError:
+        # Not a JIT archive. Checkpoints in the legacy (non-zip) format cannot be memory-mapped
+        try:
+            return torch.load(model_path, map_location="cpu", mmap=True)
+        except RuntimeError:
+            return torch.load(model_path, map_location="cpu")
+
+    try:
+        torch.save(state_dict, converted_path + ".tmp")
+        os.replace(converted_path + ".tmp", converted_path)
+    except OSError as e:
+        warnings.warn(f"Could not save the state dict of {model_path}; it will not be memory-mapped: {e}")
+    return state_dict
+
+
 def _convert_image_to_rgb(image):
     return image.convert("RGB")
 
@@ -86,6 +153,32 @@ def _transform(n_px):
     ])
 
 
+def weights_sha256(name: str) -> str:
+    """Returns the SHA256 checksum of the weights of a model, which identifies them
+
+    Parameters
+    ----------
+    name : str
+        A model name listed by `available_models()` (whose weights are verified against the checksum
+        in their URL when loaded), or the path to a model checkpoint, hashed once and then read from
+        its verification marker while the file is unchanged
+    """
+    if name in _MODELS:
+        return _MODELS[name].split("/")[-2]
+
+    marker_path = name + ".verified"
+    if os.path.isfile(marker_path):
+        with open(marker_path) as f:
+            marker = f.read()
+        sha256 = marker.split(" ")[0]
+        if marker == _verified_marker(name, sha256):
+            return sha256
+
+    sha256 = _sha256(name)
+    _mark_verified(name, sha256)
+    return sha256
+
+
 def available_models() -> List[str]:
     """Returns the names of available CLIP models"""
     return list(_MODELS.keys())
@@ -123,20 +216,18 @@ def load(name: str, device: Union[str, torch.device] = "cuda" if torch.cuda.is_a
     else:
         raise RuntimeError(f"Model {name} not found; available models = {available_models()}")
 
-    with open(model_path, 'rb') as opened_file:
-        try:
-            # loading JIT archive
-            model = torch.jit.load(opened_file, map_location=device if jit else "cpu").eval()
-            state_dict = None
-        except RuntimeError:
-            # loading saved state dict
-            if jit:
+    if jit:
+        with open(model_path, 'rb') as opened_file:
+            try:
+                # loading JIT archive
+                model = torch.jit.load(opened_file, map_location=device).eval()
+            except RuntimeError:
+                # loading saved state dict
                 warnings.warn(f"File {model_path} is not a JIT archive. Loading as a state dict instead")
                 jit = False
-            state_dict = torch.load(opened_file, map_location="cpu")
 
     if not jit:
-        model = build_model(state_dict or model.state_dict()).to(device)
+        model = build_model(_load_state_dict(model_path)).to(device)
         if str(device) == "cpu":
             model.float()
         return model, _transform(model.visual.input_resolution)
@@ -225,13 +316,13 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77, truncate: b
     if isinstance(texts, str):
         texts = [texts]
 
+    _tokenizer = get_tokenizer()
     sot_token = _tokenizer.encoder["<|startoftext|>"]
     eot_token = _tokenizer.encoder["<|endoftext|>"]
     all_tokens = [[sot_token] + _tokenizer.encode(text) + [eot_token] for text in texts]
-    if version.parse(torch.__version__) < version.parse("1.8.0"):
-        result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
-    else:
-        result = torch.zeros(len(all_tokens), context_length, dtype=torch.int)
+
+    # Filled in a single preallocated array and handed to torch without copying
+    result = np.zeros((len(all_tokens), context_length), dtype=np.int32)
 
     for i, tokens in enumerate(all_tokens):
         if len(tokens) > context_length:
@@ -240,6 +331,10 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77, truncate: b
                 tokens[-1] = eot_token
             else:
                 raise RuntimeError(f"Input {texts[i]} is too long for context length {context_length}")
-        result[i, :len(tokens)] = torch.tensor(tokens)
+        result[i, :len(tokens)] = tokens
+
+    result = torch.from_numpy(result)
+    if version.parse(torch.__version__) < version.parse("1.8.0"):
+        result = result.long()
 
     return result
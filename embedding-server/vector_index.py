@@ -0,0 +1,609 @@
+"""In-process vector search over the embeddings written by ingestion.py.
+
+An index is a directory with the normalized embeddings of a collection as a float16 matrix
+(embeddings.f16) and its metadata as int32 arrays (video_id.i32, plus frame_n.i32 for frames, or
+start_frame.i32 and end_frame.i32 for events and windows), all memory-mapped, and index.json with
+its shape and the names of the videos. Events and windows cut into clips at ingestion also get the
+byte range of each clip (clip_offset.i64 and clip_size.i64, -1 if it has none). With --ivfpq, an IVF-PQ index for approximate search is
+added to the same directory (the ivf_* and pq_* files and ivfpq.json).
+
+Usage: python vector_index.py INGESTION_DIR INDEX_DIR [--kind frames|events|windows] [--ivfpq [--lists 1024]]
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from segmentation import merge_frame_hits
+
+KINDS = ('frames', 'events', 'windows')
+# Byte range of the clip of each event in <video>.<kind>.mp4 (see clips.py)
+CLIP_FIELDS = ('clip_offset', 'clip_size')
+
+def ingestion_files(ingestion_dir: str, kind: str = 'frames') -> list:
+    """Returns the files written by ingestion.py for a kind of collection, sorted.
+
+    Parameters
+    ----------
+    ingestion_dir : str
+        The output directory of ingestion.py.
+    kind : str, optional
+        'frames', 'events' or 'windows'. By default, 'frames'
+
+    Returns
+    -------
+    list
+        The paths to the files.
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Unknown kind of collection: {kind}')
+    paths = glob.glob(os.path.join(ingestion_dir, '**', '*.npz'), recursive=True)
+    if kind == 'frames':
+        return sorted(path for path in paths if not path.endswith(tuple(f'.{suffix}.npz' for suffix in KINDS + ('tmp',))))
+    return sorted(path for path in paths if path.endswith(f'.{kind}.npz'))
+
+def build_exact_index(ingestion_dir: str, index_dir: str, kind: str = 'frames') -> 'ExactIndex':
+    """Writes the index of a collection from the files of ingestion.py, one video at a time, so it
+    can be larger than memory.
+
+    Parameters
+    ----------
+    ingestion_dir : str
+        The output directory of ingestion.py.
+    index_dir : str
+        The directory of the index.
+    kind : str, optional
+        'frames', 'events' or 'windows'. By default, 'frames'
+
+    Returns
+    -------
+    ExactIndex
+        The index.
+    """
+    paths = ingestion_files(ingestion_dir, kind)
+    fields = ['frame_n'] if kind == 'frames' else ['start_frame', 'end_frame']
+
+    # First pass over the (lazily loaded) files for the size of the matrix
+    count, dim, clips = 0, 0, False
+    for path in paths:
+        with np.load(path) as data:
+            count += len(data[fields[0]])
+            dim = dim or (data['embeddings'].shape[1] if len(data[fields[0]]) else 0)
+            clips = clips or 'clip_offset' in data.files
+
+    os.makedirs(index_dir, exist_ok=True)
+    embeddings = np.memmap(os.path.join(index_dir, 'embeddings.f16'), dtype=np.float16, mode='w+', shape=(max(count, 1), dim))
+    columns = {name: np.memmap(os.path.join(index_dir, f'{name}.i32'), dtype=np.int32, mode='w+', shape=(max(count, 1),))
+               for name in ['video_id'] + fields}
+    if clips:
+        for name in CLIP_FIELDS:
+            columns[name] = np.memmap(os.path.join(index_dir, f'{name}.i64'), dtype=np.int64, mode='w+', shape=(max(count, 1),))
+    videos, row = [], 0
+    for path in paths:
+        with np.load(path) as data:
+            n = len(data[fields[0]])
+            if not n:
+                continue
+            embs = data['embeddings'].astype(np.float32)
+            embeddings[row:row + n] = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+            columns['video_id'][row:row + n] = len(videos)
+            for name in fields:
+                columns[name][row:row + n] = data[name]
+            for name in CLIP_FIELDS if clips else []:
+                columns[name][row:row + n] = data[name] if name in data.files else -1
+            videos.append(str(data['video']))
+            row += n
+    embeddings.flush()
+    for column in columns.values():
+        column.flush()
+    del embeddings, columns
+
+    # Written last, so an interrupted build leaves no index.json
+    index_path = os.path.join(index_dir, 'index.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'kind': kind, 'count': count, 'dim': dim, 'videos': videos, 'clips': clips}, f)
+    os.replace(index_path + '.tmp', index_path)
+    return ExactIndex(index_dir)
+
+class ExactIndex:
+
+    def __init__(self, directory: str):
+        """Exact (brute-force) cosine search over an index written by build_exact_index. The matrix is
+        memory-mapped read-only and scanned in blocks, so it never has to fit in memory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the index.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            meta = json.load(f)
+        self.kind = meta['kind']
+        self.count = meta['count']
+        self.dim = meta['dim']
+        self.videos = meta['videos']
+
+        shape = (max(self.count, 1),)
+        self.embeddings = np.memmap(os.path.join(directory, 'embeddings.f16'), dtype=np.float16, mode='r',
+                                    shape=shape + (self.dim,))[:self.count]
+        fields = ['video_id'] + (['frame_n'] if self.kind == 'frames' else ['start_frame', 'end_frame'])
+        self.columns = {name: np.memmap(os.path.join(directory, f'{name}.i32'), dtype=np.int32, mode='r', shape=shape)[:self.count]
+                        for name in fields}
+        self.clips = meta.get('clips', False)
+        if self.clips:
+            for name in CLIP_FIELDS:
+                self.columns[name] = np.memmap(os.path.join(directory, f'{name}.i64'), dtype=np.int64, mode='r',
+                                               shape=shape)[:self.count]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def search(self, queries: np.ndarray, k: int = 10, block_size: int = 32768) -> tuple:
+        """Returns the k rows most similar to each query.
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            The query embeddings, shape = [queries, dim] (or [dim]). They are normalized here.
+        k : int, optional
+            Number of results per query. By default, 10
+        block_size : int, optional
+            Number of rows multiplied at once. Memory grows with block_size * (dim + queries). By default, 32768
+
+        Returns
+        -------
+        tuple
+            The cosine similarities, shape = [queries, k], float32, and the rows, shape = [queries, k],
+            int64, best first.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        k = min(k, self.count)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        if k == 0:
+            return best_scores, best_ids
+
+        # float16 has no BLAS kernels: each block is converted into this buffer and multiplied in float32
+        buffer = np.empty((min(block_size, self.count), self.dim), dtype=np.float32)
+        for start in range(0, self.count, block_size):
+            block = buffer[:min(block_size, self.count - start)]
+            np.copyto(block, self.embeddings[start:start + len(block)])
+            scores, ids = self._top_k(queries @ block.T, np.arange(start, start + len(block)), k)
+            # Merged with the k best so far
+            best_scores, best_ids = self._top_k(np.concatenate((best_scores, scores), axis=1),
+                                                np.concatenate((best_ids, ids), axis=1), k)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> tuple:
+        # The k best (unsorted) of each row of scores, with their ids (one per column, or per score)
+        ids = np.broadcast_to(ids, scores.shape)
+        if scores.shape[1] <= k:
+            return scores, ids
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+    def references(self, ids) -> list:
+        """Returns the metadata of rows: the video and its frame_n, or its start_frame and end_frame,
+        plus the file, offset and size of its clip if it has one.
+
+        Parameters
+        ----------
+        ids : array-like
+            The rows.
+
+        Returns
+        -------
+        list
+            One dictionary per row.
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        columns = {name: column[ids].tolist() for name, column in self.columns.items()}
+        video_ids = columns.pop('video_id')
+        offsets, sizes = (columns.pop(name) for name in CLIP_FIELDS) if self.clips else ([-1] * len(ids),) * 2
+        references = []
+        for i, video_id in enumerate(video_ids):
+            reference = {'video': self.videos[video_id], **{name: values[i] for name, values in columns.items()}}
+            if offsets[i] >= 0:
+                reference['clip'] = {'file': f'{self.videos[video_id]}.{self.kind}.mp4', 'offset': offsets[i], 'size': sizes[i]}
+            references.append(reference)
+        return references
+
+def kmeans(x: np.ndarray, k: int, iterations: int = 20, seed: int = 0, workers: int = 0,
+           chunk_size: int = 8192) -> np.ndarray:
+    """Lloyd's k-means. Each iteration splits the points into chunks, assigned and summed per
+    cluster in a pool of threads (the matrix products release the GIL).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The points, shape = [n, dim], float32.
+    k : int
+        Number of centroids (at most n).
+    iterations : int, optional
+        Number of iterations. By default, 20
+    seed : int, optional
+        Seed of the initialization (k random points) and of the reinitialization of empty clusters. By default, 0
+    workers : int, optional
+        Number of threads. By default, 0 (one per core)
+    chunk_size : int, optional
+        Number of points assigned at once by each thread. By default, 8192
+
+    Returns
+    -------
+    np.ndarray
+        The centroids, shape = [k, dim], float32.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+
+    def assign(start: int) -> tuple:
+        # Sum and number of the points of the chunk in each cluster
+        chunk = x[start:start + chunk_size]
+        labels = nearest_centroids(chunk, centroids)
+        order = np.argsort(labels, kind='stable')
+        clusters, starts = np.unique(labels[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[clusters] = np.add.reduceat(chunk[order], starts, axis=0)
+        return sums, np.bincount(labels, minlength=k)
+
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        for _ in range(iterations):
+            sums, counts = map(sum, zip(*pool.map(assign, range(0, len(x), chunk_size))))
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()), replace=False)]
+    return centroids
+
+def nearest_centroids(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 = argmin ||c||^2 - 2 x.c
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * x @ centroids.T, axis=1)
+
+def build_ivfpq_index(index_dir: str, n_lists: int = 1024, n_subvectors: int = 0, train_size: int = 65536,
+                      pq_train_size: int = 16384, iterations: int = 20, block_size: int = 32768, seed: int = 0, workers: int = 0) -> 'IVFPQIndex':
+    """Adds an IVF-PQ index to an exact index (see build_exact_index), in the same directory.
+
+    A coarse k-means quantizer splits the embeddings into n_lists inverted lists. The residual of each
+    embedding to its list's centroid is product-quantized: split into n_subvectors subvectors, each
+    replaced by the nearest of 256 centroids of its subspace, so an embedding takes n_subvectors bytes.
+
+    Parameters
+    ----------
+    index_dir : str
+        The directory of the exact index.
+    n_lists : int, optional
+        Number of inverted lists (about the square root of the number of embeddings or a few times more). By default, 1024
+    n_subvectors : int, optional
+        Number of subvectors, which must divide the dimension. By default, 0 (one per 8 dimensions)
+    train_size : int, optional
+        Number of embeddings sampled to train the coarse quantizer. By default, 65536
+    pq_train_size : int, optional
+        Number of them used to train the product quantizer. By default, 16384
+    iterations : int, optional
+        Iterations of k-means. By default, 20
+    block_size : int, optional
+        Number of embeddings encoded at once. By default, 32768
+    seed : int, optional
+        Seed of the sampling and of k-means. By default, 0
+    workers : int, optional
+        Threads used by k-means. By default, 0 (one per core)
+
+    Returns
+    -------
+    IVFPQIndex
+        The index.
+    """
+    exact = ExactIndex(index_dir)
+    n_subvectors = n_subvectors or exact.dim // 8
+    if exact.dim % n_subvectors:
+        raise ValueError(f'The number of subvectors ({n_subvectors}) must divide the dimension ({exact.dim})')
+    if not exact.count:
+        raise ValueError(f'The index at {index_dir} is empty')
+    sub_dim = exact.dim // n_subvectors
+
+    # Training on a sample, read in order from the memory-mapped matrix
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(exact.count, min(train_size, exact.count), replace=False))
+    x = np.asarray(exact.embeddings[sample], dtype=np.float32)
+    n_lists = min(n_lists, len(x))
+    centroids = kmeans(x, n_lists, iterations, seed, workers)
+    # 256 centroids per subspace need far fewer points than the coarse quantizer
+    pq_sample = x[rng.permutation(len(x))[:pq_train_size]]
+    residuals = (pq_sample - centroids[nearest_centroids(pq_sample, centroids)]).reshape(len(pq_sample), n_subvectors, sub_dim)
+    n_codes = min(256, len(pq_sample))
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        codebooks = np.stack(list(pool.map(lambda j: kmeans(residuals[:, j], n_codes, iterations, seed + j, workers=1),
+                                           range(n_subvectors))))
+
+    # Lists and codes of every embedding
+    lists = np.empty(exact.count, dtype=np.int32)
+    codes = np.empty((exact.count, n_subvectors), dtype=np.uint8)
+    for start in range(0, exact.count, block_size):
+        block = np.asarray(exact.embeddings[start:start + block_size], dtype=np.float32)
+        lists[start:start + len(block)] = nearest_centroids(block, centroids)
+        codes[start:start + len(block)] = pq_encode(block - centroids[lists[start:start + len(block)]], codebooks)
+
+    # Embeddings sorted by list, so each list is a contiguous range
+    order = np.argsort(lists, kind='stable')
+    offsets = np.searchsorted(lists[order], np.arange(n_lists + 1)).astype(np.int64)
+    centroids.tofile(os.path.join(index_dir, 'ivf_centroids.f32'))
+    codebooks.tofile(os.path.join(index_dir, 'pq_codebooks.f32'))
+    codes[order].tofile(os.path.join(index_dir, 'pq_codes.u8'))
+    order.astype(np.int64).tofile(os.path.join(index_dir, 'ivf_ids.i64'))
+    offsets.tofile(os.path.join(index_dir, 'ivf_offsets.i64'))
+
+    meta_path = os.path.join(index_dir, 'ivfpq.json')
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'count': exact.count, 'dim': exact.dim, 'n_lists': n_lists, 'n_subvectors': n_subvectors,
+                   'n_codes': n_codes}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return IVFPQIndex(index_dir)
+
+def pq_encode(x: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    # Index of the nearest centroid of each subvector, shape = [n, subvectors]
+    n_subvectors, _, sub_dim = codebooks.shape
+    subvectors = x.reshape(len(x), n_subvectors, sub_dim)
+    return np.stack([nearest_centroids(subvectors[:, j], codebooks[j]) for j in range(n_subvectors)], axis=1).astype(np.uint8)
+
+class IVFPQIndex:
+
+    def __init__(self, directory: str):
+        """Approximate search over an IVF-PQ index written by build_ivfpq_index. A query only scans
+        the nprobe lists closest to it, scoring their embeddings from their codes, and the best
+        candidates are re-ranked with their exact embeddings, read from the exact index.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the index (the same as the exact index).
+        """
+        self.exact = ExactIndex(directory)
+        with open(os.path.join(directory, 'ivfpq.json')) as f:
+            meta = json.load(f)
+        self.n_lists = meta['n_lists']
+        self.n_subvectors = meta['n_subvectors']
+        dim, sub_dim = meta['dim'], meta['dim'] // meta['n_subvectors']
+
+        self.centroids = np.fromfile(os.path.join(directory, 'ivf_centroids.f32'), dtype=np.float32).reshape(-1, dim)
+        self.codebooks = np.fromfile(os.path.join(directory, 'pq_codebooks.f32'), dtype=np.float32).reshape(
+            self.n_subvectors, meta['n_codes'], sub_dim)
+        self.offsets = np.fromfile(os.path.join(directory, 'ivf_offsets.i64'), dtype=np.int64)
+        count = meta['count']
+        self.codes = np.memmap(os.path.join(directory, 'pq_codes.u8'), dtype=np.uint8, mode='r',
+                               shape=(count, self.n_subvectors)) if count else np.empty((0, self.n_subvectors), np.uint8)
+        self.ids = np.memmap(os.path.join(directory, 'ivf_ids.i64'), dtype=np.int64, mode='r',
+                             shape=(count,)) if count else np.empty(0, np.int64)
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = 16, rerank: int = 100) -> tuple:
+        """Returns the (approximately) k rows most similar to each query.
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            The query embeddings, shape = [queries, dim] (or [dim]). They are normalized here.
+        k : int, optional
+            Number of results per query. By default, 10
+        nprobe : int, optional
+            Number of lists scanned per query. More is slower but more accurate. By default, 16
+        rerank : int, optional
+            Number of candidates re-ranked with their exact embeddings (at least k). By default, 100
+
+        Returns
+        -------
+        tuple
+            The cosine similarities, shape = [queries, k], float32, and the rows, shape = [queries, k],
+            int64, best first. Queries with fewer than k candidates are padded with -inf and -1.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        coarse = queries @ self.centroids.T
+        nprobe = max(1, min(nprobe, self.n_lists))
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        # q.(c + r) = q.c + sum_j q_j.r_j: one table of subvector products per query, shared by all lists
+        tables = np.einsum('qjd,jcd->qjc', queries.reshape(len(queries), self.n_subvectors, -1), self.codebooks)
+        subvectors = np.arange(self.n_subvectors)
+        for i, (query, table) in enumerate(zip(queries, tables)):
+            lists = np.sort(probes[i])
+            ranges = [np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            positions = np.concatenate(ranges)
+            if not len(positions):
+                continue
+            approx = np.repeat(coarse[i, lists], [len(r) for r in ranges]) + table[subvectors, self.codes[positions]].sum(axis=1)
+
+            # Exact scores of the best candidates, read in order from the memory-mapped matrix
+            n_candidates = min(max(rerank, k), len(positions))
+            candidates = positions[np.argpartition(-approx, n_candidates - 1)[:n_candidates]]
+            rows = np.sort(self.ids[candidates])
+            exact = np.asarray(self.exact.embeddings[rows], dtype=np.float32) @ query
+            best = np.argsort(-exact, kind='stable')[:k]
+            scores[i, :len(best)], ids[i, :len(best)] = exact[best], rows[best]
+        return scores, ids
+
+    def references(self, ids) -> list:
+        """Returns the metadata of rows (see ExactIndex.references).
+        """
+        return self.exact.references(ids)
+
+def collection_name(encoder: str, dataset: str) -> str:
+    """Returns the name of a collection, as the node server names them in the databases.
+
+    Parameters
+    ----------
+    encoder : str
+        The encoder (its int8 variant shares the collections of the full-precision one).
+    dataset : str
+        'frames' or 'centroid' (or any other suffix of the collections).
+
+    Returns
+    -------
+    str
+        The name of the collection, e.g. ucfvclipframes or ucaclipcentroid.
+    """
+    encoder = encoder[:-len('-int8')] if encoder.endswith('-int8') else encoder
+    return ('uca' if dataset == 'centroid' else 'ucf') + encoder + dataset
+
+class IndexRegistry:
+
+    def __init__(self, directory: str, nprobe: int = 16, rerank: int = 100):
+        """Indexes of the collections, one subdirectory of a directory per collection (named after
+        it, see collection_name), opened on their first search and kept open. Collections with an
+        IVF-PQ index are searched with it, the rest exactly.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the indexes.
+        nprobe : int, optional
+            Lists scanned per query by the IVF-PQ indexes. By default, 16
+        rerank : int, optional
+            Candidates re-ranked exactly by the IVF-PQ indexes. By default, 100
+        """
+        self.directory = directory
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, collection: str):
+        """Returns the index of a collection, opening it if needed.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the collection has no index.
+        """
+        with self._lock:
+            if collection not in self._indexes:
+                path = os.path.join(self.directory, collection)
+                if not self.directory or os.path.dirname(os.path.normpath(path)) != os.path.normpath(self.directory) \
+                        or not os.path.isfile(os.path.join(path, 'index.json')):
+                    raise FileNotFoundError(f'No index for collection {collection}')
+                is_ivfpq = os.path.isfile(os.path.join(path, 'ivfpq.json'))
+                self._indexes[collection] = IVFPQIndex(path) if is_ivfpq else ExactIndex(path)
+                print(f'Opened the {"IVF-PQ" if is_ivfpq else "exact"} index of {collection}')
+            return self._indexes[collection]
+
+    def search(self, collection: str, queries: np.ndarray, k: int = 10) -> list:
+        """Returns the k most similar rows of a collection for each query, with their metadata.
+
+        Parameters
+        ----------
+        collection : str
+            The name of the collection.
+        queries : np.ndarray
+            The query embeddings, shape = [queries, dim] (or [dim]).
+        k : int, optional
+            Number of results per query. By default, 10
+
+        Returns
+        -------
+        list
+            For each query, the list of its results (see ExactIndex.references), best first, each
+            with its cosine similarity as score.
+        """
+        index = self.get(collection)
+        if isinstance(index, IVFPQIndex):
+            scores, ids = index.search(queries, k, nprobe=self.nprobe, rerank=self.rerank)
+        else:
+            scores, ids = index.search(queries, k)
+        results = []
+        for query_scores, query_ids in zip(scores, ids):
+            found = query_ids >= 0
+            references = index.references(query_ids[found])
+            results.append([{**reference, 'score': float(score)} for reference, score in zip(references, query_scores[found])])
+        return results
+
+    def search_events(self, collection: str, queries: np.ndarray, k: int = 10, window: int = 75,
+                      overfetch: int = 10, refetches: int = 6) -> list:
+        """Returns the k most similar events of a collection for each query. For collections of
+        frames, k * overfetch frame hits are fetched and merged into non-overlapping events (see
+        segmentation.merge_frame_hits). The queries whose hits merge into fewer than k events are
+        searched again with twice as many hits, until they have k events or the index has no more
+        hits for them. The rest are searched as in search.
+
+        Parameters
+        ----------
+        collection : str
+            The name of the collection.
+        queries : np.ndarray
+            The query embeddings, shape = [queries, dim] (or [dim]).
+        k : int, optional
+            Number of events per query. By default, 10
+        window : int, optional
+            Frames before and after the best frame hit spanned by its event. By default, 75
+        overfetch : int, optional
+            Frame hits fetched per event. By default, 10
+        refetches : int, optional
+            Maximum number of times the hits are doubled. By default, 6
+
+        Returns
+        -------
+        list
+            For each query, the list of its events (video, start_frame, end_frame and score, plus
+            the number of hits merged for frames), best first.
+        """
+        index = self.get(collection)
+        exact = index.exact if isinstance(index, IVFPQIndex) else index
+        if exact.kind != 'frames':
+            return self.search(collection, queries, k)
+
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        results = [[] for _ in queries]
+        pending = np.arange(len(queries))
+        n_hits = k * max(1, overfetch)
+        for _ in range(max(0, refetches) + 1):
+            if isinstance(index, IVFPQIndex):
+                scores, ids = index.search(queries[pending], n_hits, nprobe=self.nprobe, rerank=self.rerank)
+            else:
+                scores, ids = index.search(queries[pending], n_hits)
+            short = []
+            for i, query_scores, query_ids in zip(pending, scores, ids):
+                found = query_ids >= 0
+                rows = query_ids[found]
+                events = merge_frame_hits(exact.columns['video_id'][rows], exact.columns['frame_n'][rows],
+                                          query_scores[found], window=window, k=k)
+                results[i] = [{'video': exact.videos[video], 'start_frame': start, 'end_frame': end,
+                               'score': score, 'hits': hits}
+                              for video, start, end, score, hits in zip(*(column.tolist() for column in events))]
+                # Fewer hits than asked for means there are no more
+                if len(results[i]) < k and found.sum() == n_hits:
+                    short.append(i)
+            if not short:
+                break
+            pending = np.array(short)
+            n_hits *= 2
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the exact index of a collection from the files of ingestion.py.')
+    parser.add_argument('ingestion_dir')
+    parser.add_argument('index_dir')
+    parser.add_argument('--kind', choices=KINDS, default='frames')
+    parser.add_argument('--ivfpq', action='store_true', help='Also build an IVF-PQ index for approximate search')
+    parser.add_argument('--lists', type=int, default=1024, help='Number of IVF lists')
+    parser.add_argument('--subvectors', type=int, default=0, help='Number of PQ subvectors. By default, one per 8 dimensions')
+    args = parser.parse_args()
+
+    index = build_exact_index(args.ingestion_dir, args.index_dir, args.kind)
+    print(f'Indexed {len(index)} {args.kind} of {len(index.videos)} videos in {args.index_dir}')
+    if args.ivfpq and len(index):
+        ivfpq = build_ivfpq_index(args.index_dir, n_lists=args.lists, n_subvectors=args.subvectors)
+        print(f'Built an IVF-PQ index with {ivfpq.n_lists} lists and {ivfpq.n_subvectors} subvectors')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import json
+import os
+import subprocess
+import tempfile
+from fractions import Fraction
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+def list_videos(directory: str) -> list:
+    """Returns the paths of the videos in a directory and its subdirectories, sorted.
+
+    Parameters
+    ----------
+    directory : str
+        The videos directory.
+
+    Returns
+    -------
+    list
+        The paths to the videos.
+    """
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                  for name in names if name.lower().endswith(VIDEO_EXTENSIONS))
+
+def video_name(path: str, directory: str) -> str:
+    # The node server adds the .mp4 extension back when streaming
+    name = os.path.relpath(path, directory)
+    return name[:-len('.mp4')] if name.endswith('.mp4') else name
+
+def resolve_video(name: str, directory: str) -> str:
+    """Returns the path of a video in the videos directory. As in the node server, the
+    name may be given with or without the .mp4 extension.
+
+    Parameters
+    ----------
+    name : str
+        The name of the video.
+    directory : str
+        The videos directory.
+
+    Returns
+    -------
+    str
+        The path to the video.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the video does not exist or lies outside the videos directory.
+    """
+    directory = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(directory, name if name.endswith('.mp4') else name + '.mp4'))
+    if os.path.commonpath([directory, path]) != directory or not os.path.isfile(path):
+        raise FileNotFoundError(f'Video not found: {name}')
+    return path
+
+def read_frame(path: str, frame_n: int) -> np.ndarray:
+    """Decodes a single frame of a video with ffmpeg.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+    frame_n : int
+        The number of the frame, starting at 0.
+
+    Returns
+    -------
+    np.ndarray
+        The frame as an RGB image, shape = [height, width, 3].
+
+    Raises
+    ------
+    ValueError
+        If the video has no such frame, or ffmpeg fails to decode it.
+    """
+    if frame_n < 0:
+        raise ValueError(f'Frame {frame_n} not found in {os.path.basename(path)}')
+    # select keeps the frame counting every decoded frame, so it is exact regardless of the timestamps
+    command = ['ffmpeg', '-v', 'error', '-i', path, '-vf', f'select=eq(n\\,{int(frame_n)})',
+               '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-']
+    process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0:
+        raise ValueError(f'ffmpeg failed to decode {os.path.basename(path)}: '
+                         f'{process.stderr.decode(errors="replace").strip()}')
+    out = process.stdout
+    if not out:
+        raise ValueError(f'Frame {frame_n} not found in {os.path.basename(path)}')
+    return np.array(Image.open(BytesIO(out)).convert('RGB'))
+
+def probe_video(path: str) -> dict:
+    """Reads the properties of the first video stream with ffprobe.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+
+    Returns
+    -------
+    dict
+        The width, height, frame rate (fps), codec and duration (in seconds) of the video.
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-of', 'json',
+               '-show_entries', 'stream=width,height,r_frame_rate,codec_name,duration:format=duration', path]
+    info = json.loads(subprocess.run(command, capture_output=True, check=True).stdout)
+    stream = info['streams'][0]
+    return {
+        'width': stream['width'],
+        'height': stream['height'],
+        'fps': float(Fraction(stream['r_frame_rate'])),
+        'codec': stream.get('codec_name', ''),
+        # Some containers only report the duration of the whole file
+        'duration': float(stream.get('duration') or info.get('format', {}).get('duration') or 0)
+    }
+
+def probe_packets(path: str, fps: float) -> dict:
+    """Lists the packets of the first video stream with ffprobe, without decoding them.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+    fps : float
+        The frame rate of the video, to number the keyframes.
+
+    Returns
+    -------
+    dict
+        The number of frames (frames) of the video, and the frame numbers (keyframe_frame) and byte
+        offsets in the file (keyframe_pos) of its keyframes, in order, as int64 arrays.
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,pos,flags',
+               '-of', 'csv=p=0:nk=0', path]
+    out = subprocess.run(command, capture_output=True, check=True, text=True).stdout
+    frames, times, positions = 0, [], []
+    for line in out.splitlines():
+        fields = dict(field.split('=', 1) for field in line.split(',') if '=' in field)
+        if 'flags' not in fields:
+            continue
+        frames += 1
+        if 'K' in fields['flags'] and fields.get('pts_time', 'N/A') != 'N/A' and fields.get('pos', 'N/A') != 'N/A':
+            times.append(float(fields['pts_time']))
+            positions.append(int(fields['pos']))
+    times, positions = np.array(times), np.array(positions, dtype=np.int64)
+    # Numbered from the first keyframe (streams may not start at 0), in presentation order
+    order = np.argsort(times, kind='stable')
+    keyframe_frame = np.rint((times[order] - (times.min() if len(times) else 0)) * fps).astype(np.int64)
+    return {'frames': frames, 'keyframe_frame': keyframe_frame, 'keyframe_pos': positions[order]}
+
+def output_size(width: int, height: int, short_side: int = 0) -> tuple:
+    # Size with the shorter side scaled to short_side (keeping the aspect ratio), as torchvision's Resize does
+    if not short_side:
+        return width, height
+    if width <= height:
+        return short_side, round(height * short_side / width)
+    return round(width * short_side / height), short_side
+
+def iter_frames(path: str, stride: int = 1, short_side: int = 0, crop: int = 0, threads: int = 0):
+    """Stream-decodes a video with ffmpeg, yielding one every stride frames. Frames are decoded
+    as raw RGB and read from a pipe one at a time, so the video is never held in memory.
+
+    Parameters
+    ----------
+    path : str
+        The path to the video.
+    stride : int, optional
+        Only the frames whose number is a multiple of stride are yielded. By default, 1 (every frame)
+    short_side : int, optional
+        If not 0, ffmpeg scales the frames so their shorter side has this size, which is much cheaper
+        than scaling them afterwards (e.g. 224 for the CLIP models' preprocessing). By default, 0
+    crop : int, optional
+        If not 0, ffmpeg also crops the center crop x crop square of the (scaled) frames, as torchvision's
+        CenterCrop does. By default, 0
+    threads : int, optional
+        Threads used by the decoder. By default, 0 (ffmpeg's choice)
+
+    Yields
+    ------
+    tuple
+        The frame number and the frame as an RGB image, shape = [height, width, 3].
+
+    Raises
+    ------
+    RuntimeError
+        If ffmpeg fails to decode the video.
+    """
+    info = probe_video(path)
+    width, height = output_size(info['width'], info['height'], short_side)
+    filters = [f'select=not(mod(n\\,{int(stride)}))'] if stride > 1 else []
+    if short_side:
+        filters.append(f'scale={width}:{height}:flags=bicubic')
+    if crop:
+        # Same offsets as torchvision's CenterCrop
+        left, top = int(round((width - crop) / 2)), int(round((height - crop) / 2))
+        filters.append(f'crop={crop}:{crop}:{left}:{top}')
+        width, height = crop, crop
+
+    # -vsync 0 keeps exactly the selected frames (no duplicates or drops to match a frame rate)
+    command = ['ffmpeg', '-v', 'error', '-threads', str(threads), '-i', path, '-an', '-sn', '-vsync', '0',
+               *(['-vf', ','.join(filters)] if filters else []), '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    frame_size = width * height * 3
+    # stderr goes to a file, not a pipe: a pipe only read at the end would fill up with the errors of a
+    # long video and block ffmpeg, and with it the reads of stdout
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, bufsize=frame_size)
+        try:
+            index = 0
+            while len(data := process.stdout.read(frame_size)) == frame_size:
+                # With select, the n-th decoded output is the frame n * stride of the video
+                yield index * stride, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                index += 1
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f'ffmpeg failed to decode {os.path.basename(path)}: '
+                                   f'{stderr.read().decode(errors="replace").strip()}')
+        finally:
+            # The consumer may stop early
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
@@ -19,6 +19,9 @@ app.use('/query', qdrant);
 const milvus = require('./routes/milvus.js')
 app.use('/query', milvus)
 
+const local = require('./routes/local.js')
+app.use('/query', local)
+
 // Add routes to send videos
 const streaming = require('./routes/streaming.js')
 app.use('/video', streaming)
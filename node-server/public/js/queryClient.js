@@ -86,7 +86,10 @@ function printVideos(videosJson) {
 
         // Add source
         const source = document.createElement('source');
-        source.src = `/video?name=${video_name}&startFrame=${start_frame}&endFrame=${end_frame}`;
+        // Clips cut at ingestion are streamed as they are, the rest are trimmed by the server
+        source.src = (element.clip)
+            ? `/video/clip?file=${encodeURIComponent(element.clip.file)}&offset=${element.clip.offset}&size=${element.clip.size}`
+            : `/video?name=${video_name}&startFrame=${start_frame}&endFrame=${end_frame}`;
         source.type = 'video/mp4';
         videoPlayer.appendChild(source);
 
@@ -0,0 +1,84 @@
+// Add express
+const express = require('express');
+
+// Instantiate router object
+const router = express.Router();
+
+// Add .env params
+const dotenv = require('dotenv');
+dotenv.config();
+
+// Add HTTP library to build requests
+const http = require('http');
+
+// To query the local indexes of the embedding server: it encodes the text and searches
+// the collection itself, so the events come back in a single request
+router.get('/local', (req, res) => {
+
+    const textQuery = req.query.text; // Get text to query
+    const encoderQuery = req.query.encoder; // Get encoder to build the embedding
+    const datasetQuery = req.query.dataset; // Get the dataset to query
+
+    // If URL is wrong
+    if(!textQuery || !encoderQuery || !datasetQuery) {
+        return res.status(400).json({status: "400", message: "Missing text, encoder or dataset"});
+    };
+
+    // POST request body
+    const searchData = JSON.stringify({
+        encoder: encoderQuery,
+        dataset: datasetQuery,
+        prompt: textQuery,
+        k: 10
+    });
+
+    // POST request options
+    const searchOptions = {
+        hostname: process.env.EMB_ENGINE_HOST,
+        port: process.env.EMB_ENGINE_PORT,
+        path: '/search',
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Content-Length': Buffer.byteLength(searchData)
+        }
+    };
+
+    const searchRequest = http.request(searchOptions, searchRes => {
+        let searchJSON = '';
+
+        // Callback for when data is being recieved
+        searchRes.on('data', chunk => {
+            searchJSON += chunk.toString();
+        });
+
+        // Callback for when data has been recieved
+        searchRes.on('end', () => {
+            // Forward the error message of the Flask server
+            if (searchRes.statusCode >= 400) {
+                return res.status(searchRes.statusCode == 404 ? 404 : 500).json({
+                    status: searchRes.statusCode.toString(),
+                    message: searchJSON
+                });
+            }
+
+            try {
+                // Already in the format of the other routes: video, start_frame and end_frame
+                const results = JSON.parse(searchJSON).results;
+                res.json({results: results});
+            } catch (err) {
+                res.status(500).json({status: "500", message: "Invalid response from the embedding server"});
+            }
+        });
+    });
+
+    searchRequest.on("error", (err) => {
+        console.log(err);
+        res.status(500).json({status: "500", message: "Error with embedding server request"});
+    })
+
+    searchRequest.write(searchData);
+    searchRequest.end();
+});
+
+module.exports = router;
@@ -18,6 +18,54 @@ ffmpeg.setFfprobePath(ffprobe.path);  // Set ffprobe path
 // Videos directory (inside the container)
 const videoDirectory = '/videos'
 
+// Clips and thumbnails cut at ingestion (inside the container)
+const clipsDirectory = '/clips'
+
+// Catalog of the videos made by the embedding server's catalog.py (inside the container)
+const catalogDirectory = '/catalog'
+
+// Frame rate and number of frames of the cataloged videos, reloaded when the catalog is rebuilt
+let catalog = { mtime: 0, rows: new Map(), fps: null, frames: null };
+
+const loadCatalog = () => {
+    const catalogPath = path.join(catalogDirectory, 'catalog.json');
+    if (!fs.existsSync(catalogPath)) {
+        return catalog;
+    }
+    const mtime = fs.statSync(catalogPath).mtimeMs;
+    if (mtime !== catalog.mtime) {
+        const meta = JSON.parse(fs.readFileSync(catalogPath));
+        // One float64 and one int64 per video, copied into aligned buffers
+        const fpsBuffer = new Uint8Array(fs.readFileSync(path.join(catalogDirectory, 'fps.f64'))).buffer;
+        const framesBuffer = new Uint8Array(fs.readFileSync(path.join(catalogDirectory, 'frames.i64'))).buffer;
+        catalog = {
+            mtime: mtime,
+            rows: new Map(meta.videos.map((name, row) => [name, row])),
+            fps: new Float64Array(fpsBuffer, 0, meta.count),
+            frames: new BigInt64Array(framesBuffer, 0, meta.count)
+        };
+    }
+    return catalog;
+};
+
+// Frame rate and number of frames of a video from the catalog, or null if it is not cataloged
+const catalogInfo = (name) => {
+    try {
+        const { rows, fps, frames } = loadCatalog();
+        const row = rows.get(name.endsWith('.mp4') ? name.slice(0, -4) : name);
+        return (row === undefined) ? null : { frameRate: fps[row], videoLength: Number(frames[row]) };
+    } catch (err) {
+        console.error('Error reading the catalog:', err);
+        return null;
+    }
+};
+
+// Resolves a file of the clips directory, or null if the name leaves it
+const clipsPath = (name) => {
+    const filePath = path.resolve(clipsDirectory, name || '');
+    return filePath.startsWith(clipsDirectory + path.sep) ? filePath : null;
+};
+
 // To log execution time
 function log_times(time, category) {
     const logFile = path.join('/logs', category+'_times.log');
@@ -76,14 +124,16 @@ app.get('/', async (req, res) => {
         return res.status(400).send('Invalid startFrame or endFrame parameters');
     }
 
-    const videoLength = await getVideoLength(videoPath);
+    try {
+        // From the catalog if the video is in it, so ffprobe does not run on every request
+        const info = catalogInfo(name);
+        const videoLength = (info) ? info.videoLength : await getVideoLength(videoPath);
 
-    startFrameNumber = (startFrameNumber < 0) ? 0 : startFrameNumber;
-    endFrameNumber = (endFrameNumber > videoLength) ? videoLength : endFrameNumber;
+        startFrameNumber = (startFrameNumber < 0) ? 0 : startFrameNumber;
+        endFrameNumber = (endFrameNumber > videoLength) ? videoLength : endFrameNumber;
 
-    try {
         // Get the video frame rate
-        const frameRate = await getVideoFrameRate(videoPath);
+        const frameRate = (info) ? info.frameRate : await getVideoFrameRate(videoPath);
 
         // Convert frame numbers to time (seconds)
         const startSeconds = startFrameNumber / frameRate;
@@ -115,4 +165,58 @@ app.get('/', async (req, res) => {
     }
 });
 
+// Streams a clip cut at ingestion: its byte range of the clips file, with no transcoding
+app.get('/clip', (req, res) => {
+
+    const { file, offset, size } = req.query;
+
+    const clipPath = clipsPath(file);
+    // Check if the clips file exists
+    if (!clipPath || !fs.existsSync(clipPath)) {
+        return res.status(404).send('Clip not found');
+    }
+
+    const start = parseInt(offset);
+    const length = parseInt(size);
+
+    if (isNaN(start) || isNaN(length) || start < 0 || length <= 0) {
+        return res.status(400).send('Invalid offset or size parameters');
+    }
+
+    fs.stat(clipPath, (err, stat) => {
+        if (err) {
+            console.error('Error reading clip:', err);
+            return res.status(404).send('Clip not found');
+        }
+        // The range must lie within the file, or the response would be shorter than its Content-Length
+        if (start + length > stat.size) {
+            res.set('Content-Range', `bytes */${stat.size}`);
+            return res.status(416).send('Clip range outside the clips file');
+        }
+
+        res.set({'Content-Type': 'video/mp4', 'Content-Length': length});
+        fs.createReadStream(clipPath, { start: start, end: start + length - 1 })
+            .on('error', (err) => {
+                console.error('Error reading clip:', err);
+                // Once the clip has started streaming, the response can only be cut
+                if (!res.headersSent) {
+                    res.status(500).send('Error reading clip');
+                } else {
+                    res.destroy(err);
+                }
+            })
+            .pipe(res);
+    });
+});
+
+// Sends the strip of thumbnails of a video made at ingestion
+app.get('/thumbnails', (req, res) => {
+
+    const thumbnailsPath = clipsPath(req.query.name + '.thumbs.jpg');
+    if (!thumbnailsPath || !fs.existsSync(thumbnailsPath)) {
+        return res.status(404).send('Thumbnails not found');
+    }
+    res.sendFile(thumbnailsPath);
+});
+
 module.exports = app;